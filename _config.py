@@ -35,7 +35,6 @@ class _BaseConfig:
     BASE_DIR: str = os.path.abspath(os.path.dirname(__file__))
     sys.path.insert(0, BASE_DIR)
     LOG_DIR: str = os.path.join(BASE_DIR, "logs")
-    os.makedirs(LOG_DIR, exist_ok=True)
     LOG_LEVEL: str = os.getenv("LOG_LEVEL", "INFO")
 
     SIMPLENOTE_PROJECT_NAME: str = "Simplenote"
@@ -95,4 +94,10 @@ for attr in dir(CONFIG):
 from importlib import import_module
 
 
+# Record the import cost of the plugin modules loaded from here on, see `utils.startup.report`.
+# The finder sits on the meta path shared by every package of the plugin host, it leaves theirs alone.
+import_module("utils.startup").install(
+    prefixes=tuple(filter(None, (__package__,)))
+    + ("api", "models", "operations", "settings", "simplenote", "simplenotecommands", "utils")
+)
 import_module("utils.logger.init")
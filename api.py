@@ -4,22 +4,25 @@
 """
 
 import base64
-import functools
 import logging
 import os
 import pickle
 import time
-from typing import Any, Dict, Optional
+from typing import Any, Callable, Dict, Optional
+from urllib.error import HTTPError
 from urllib.parse import urlencode
 from uuid import uuid4
 
+from utils import metrics
+from utils.jsonstream import ArrayStreamParser
+from utils.logger import structured
 from utils.patterns.singleton.base import Singleton
-from utils.request import Response, request
+from utils.request import Response, Session, request
 
 
 logger = logging.getLogger()
 
-__all__ = ["Simplenote"]
+__all__ = ["Simplenote", "URL"]
 
 SIMPLENOTE_BASE_DIR = os.path.abspath(os.path.dirname(__file__))
 SIMPLENOTE_APP_ID: str = "chalk-bump-f49"
@@ -27,27 +30,41 @@ SIMPLENOTE_APP_KEY: str = base64.b64decode("YzhjMmI4NjMzNzE1NGNkYWJjOTg5YjIzZTMw
 SIMPLENOTE_BUCKET: str = "note"
 _SIMPLENOTE_TOKEN_FILE = "simplenote_token.pkl"
 SIMPLENOTE_TOKEN_FILE = os.path.join(SIMPLENOTE_BASE_DIR, _SIMPLENOTE_TOKEN_FILE)
+# Seconds to wait for the answer of a change feed request, the server holds it open until a change
+SIMPLENOTE_FEED_TIMEOUT = 90
 
 
 class URL:
-    BASE: str = "https://api.simperium.com/1"
-    DATA = f"{BASE}/{SIMPLENOTE_APP_ID}/{SIMPLENOTE_BUCKET}"
-    __auth = f"{BASE}/{SIMPLENOTE_APP_ID}/authorize/"
-    __index = DATA + "/index"
-    __retrieve = DATA + "/i/%s"
-    __modify = __retrieve
-    __delete = __retrieve
+    DEFAULT_BASE: str = "https://api.simperium.com/1"
+    # Point the client at another Simperium compatible server, e.g. `python -m utils.simperium`
+    BASE: str = os.getenv("SIMPLENOTE_API_URL", DEFAULT_BASE).rstrip("/")
+
+    @classmethod
+    def set_base(cls, base: str = ""):
+        """Use `base` for every request from now on, the default server if empty"""
+        cls.BASE = (base or os.getenv("SIMPLENOTE_API_URL", cls.DEFAULT_BASE)).rstrip("/")
+
+    @classmethod
+    def data(cls) -> str:
+        return f"{cls.BASE}/{SIMPLENOTE_APP_ID}/{SIMPLENOTE_BUCKET}"
 
     @classmethod
     def auth(cls):
-        return cls.__auth
+        return f"{cls.BASE}/{SIMPLENOTE_APP_ID}/authorize/"
 
     @classmethod
     def index(cls, **kwargs: Dict[str, Any]):
         """
         e.g. "https://api.simperium.com/1/chalk-bump-f49/note/index?limit=10&data=true"
         """
-        return cls.__index + "?" + urlencode(kwargs)
+        return cls.data() + "/index?" + urlencode(kwargs)
+
+    @classmethod
+    def changes(cls, **kwargs: Any):
+        """
+        e.g. "https://api.simperium.com/1/chalk-bump-f49/note/all?cv=666e8b00a5cc2b14e5c85722&data=1"
+        """
+        return cls.data() + "/all?" + urlencode(kwargs)
 
     @classmethod
     def retrieve(cls, note_id: str, version: Optional[int] = None):
@@ -55,15 +72,15 @@ class URL:
         e.g. "https://api.simperium.com/1/chalk-bump-f49/note/i/ba4f2735aab811e89fd89d5f0cfefda5"
         """
         if version is not None:
-            return cls.__retrieve % note_id + "/v/%s" % version
-        return cls.__retrieve % note_id
+            return cls.data() + "/i/%s/v/%s" % (note_id, version)
+        return cls.data() + "/i/%s" % note_id
 
     @classmethod
     def modify(cls, note_id: str, version: Optional[int] = None, response: int = 1, **kwargs: Dict[str, Any]):
         """
         e.g. "https://api.simperium.com/1/chalk-bump-f49/note/i/ba4f2735aab811e89fd89d5f0cfefda5/v/2?response=1"
         """
-        _: str = cls.__modify % note_id
+        _: str = cls.data() + "/i/%s" % note_id
         params = "?response=%s" % response + urlencode(kwargs)
         if version is not None:
             return _ + "/v/%s" % version + params
@@ -74,7 +91,7 @@ class URL:
         """
         e.g. "https://api.simperium.com/1/chalk-bump-f49/note/i/ba4f2735aab811e89fd89d5f0cfefda5/v/2"
         """
-        _: str = cls.__delete % note_id
+        _: str = cls.data() + "/i/%s" % note_id
         if version is not None:
             return _ + "/v/%s" % version + urlencode(kwargs)
         return _ + urlencode(kwargs)
@@ -85,33 +102,49 @@ class SimplenoteLoginFailed(Exception):
 
 
 class Simplenote(Singleton):
-    """Class for interacting with the simplenote web service"""
+    """Class for interacting with the simplenote web service
+
+    The instance is a long-lived client session: it keeps the token and the
+    keep-alive connections in memory, and re-authenticates when the token expires.
+    """
 
     def __init__(self, username: str = "", password: str = ""):
         """object constructor"""
         super().__init__()
+        assert all(map(bool, [username, password])), "username and password must be set"
+        credentials = (username, password, URL.BASE)
+        if getattr(self, "session", None) is not None and credentials == self.credentials:
+            # Singleton: keep the live session when constructed again with the same credentials and server
+            return
+        self.credentials = credentials
         self.username = username
         self.password = password
-        assert all(map(bool, [self.username, self.password])), "username and password must be set"
         self.header = "X-Simperium-Token"
         self.mark = "mark"
         self._token: str = ""
+        self.session = Session()
+        # Long-polls get their own connection, they would hold a pooled one for minutes
+        self.feed_session = Session(pool_size=1, timeout=SIMPLENOTE_FEED_TIMEOUT, metric="long_poll.http.request")
 
     @classmethod
-    def authenticate(cls, username: str, password: str):
+    @metrics.timed("api.authenticate")
+    def authenticate(cls, username: str, password: str, session: Optional[Session] = None):
         """Method to get simplenote auth token
 
         Arguments:
             - username (string): simplenote email address
             - password (string): simplenote password
+            - session (Session): optional session to send the request through, counted in its stats
 
         Returns:
             Simplenote API token as string
         """
         headers = {"X-Simperium-API-Key": SIMPLENOTE_APP_KEY}
         request_data = {"username": username, "password": password}
-        logger.debug(("request_data:", request_data, "headers:", headers))
-        response = request(URL.auth(), method="POST", headers=headers, data=request_data, data_as_json=False)
+        structured.debug(logger, "authenticate", data=request_data, headers=headers)
+        response = request(
+            URL.auth(), method="POST", headers=headers, data=request_data, data_as_json=False, session=session
+        )
         assert response.status == 200, SimplenoteLoginFailed("response.status is not 200: %s" % response.status)
         result = response.json()
         assert isinstance(result, dict), "result is not a dict: %s" % result
@@ -127,16 +160,30 @@ class Simplenote(Singleton):
                 raise err
         assert isinstance(token, str), "token is not a string: %s" % token
         assert len(token) == 32, "token length is not 32: %s" % token
-        with open(SIMPLENOTE_TOKEN_FILE, "wb") as fh:
-            pickle.dump(token, fh)
+        cls._save_token(token, username)
         return token
 
-    @functools.cached_property
+    @staticmethod
+    def _save_token(token: str, username: str):
+        """Persist the token atomically, a crash never leaves a truncated token file behind.
+
+        The token is stored with the server and the account it was issued for, another
+        account or server never reads it back.
+        """
+        tmp_filepath = SIMPLENOTE_TOKEN_FILE + ".tmp"
+        with open(tmp_filepath, "wb") as fh:
+            pickle.dump({"api_url": URL.BASE, "username": username, "token": token}, fh)
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.replace(tmp_filepath, SIMPLENOTE_TOKEN_FILE)
+
+    @property
     def token(self):
         """Method to retrieve an auth token.
 
-        The cached global token is looked up and returned if it exists. If it
-        is `None` a new one is requested and returned.
+        The token is kept in memory, the token file is only read by the first call. If
+        there is no token file, or it holds the token of another account or server, a new
+        token is requested and returned.
 
         Returns:
             Simplenote API token as string
@@ -144,23 +191,40 @@ class Simplenote(Singleton):
         if not self._token:
             try:
                 with open(SIMPLENOTE_TOKEN_FILE, "rb") as fh:
-                    token = pickle.load(fh, encoding="utf-8")
-                    self._token = token
+                    stored = pickle.load(fh, encoding="utf-8")
             except FileNotFoundError as err:
                 logger.exception(err)
-                self._token = self.authenticate(self.username, self.password)
+                stored = None
             except (EOFError, Exception) as err:
                 logger.exception(err)
                 raise err
+            # Files written before tokens were keyed hold a bare token, of an unknown account
+            key = (URL.BASE, self.username)
+            if isinstance(stored, dict) and (stored.get("api_url"), stored.get("username")) == key:
+                self._token = stored["token"]
+            else:
+                self._token = self.authenticate(self.username, self.password, session=self.session)
         return self._token
 
+    def _request(self, url: str, method: str = "GET", session: Optional[Session] = None, **kwargs: Any) -> Response:
+        """Send an authenticated request through the session, re-authenticating once on 401"""
+        session = session or self.session
+        try:
+            return request(url, method=method, headers={self.header: self.token}, session=session, **kwargs)
+        except HTTPError as err:
+            if err.code != 401:
+                raise err
+            logger.info("Token rejected, authenticating again")
+            self._token = self.authenticate(self.username, self.password, session=self.session)
+            return request(url, method=method, headers={self.header: self.token}, session=session, **kwargs)
+
     def _parse_response(self, note_id: str, response: Response):
         msg = "OK"
         try:
             assert isinstance(response, Response), "response is not a Response: %s" % response
             assert response.status == 200, "response.status is not 200: %s" % response
             _version: str | None = response.headers.get("X-Simperium-Version")
-            logger.debug(("status:", response.status, "version:", _version))
+            structured.debug(logger, "response", id=note_id, status=response.status, version=_version)
             assert isinstance(_version, str), "version is not a string: %s" % _version
             assert _version.isdigit(), "version is not a number: %s" % _version
             return 0, msg, {"id": note_id, "v": int(_version), "d": response.data}
@@ -174,10 +238,12 @@ class Simplenote(Singleton):
             msg = err
         return -1, msg, {}
 
+    @metrics.timed("api.index")
     def index(
         self,
         limit: int = 1000,
         data: bool = False,
+        on_entry: Optional[Callable[[Dict[str, Any]], Any]] = None,
     ):
         """Method to get the note list
 
@@ -188,6 +254,8 @@ class Simplenote(Singleton):
         Arguments:
             - tags=[] list of tags as string: return notes that have
               at least one of these tags
+            - on_entry (callable): parse the body while it is received and pass
+              each note to it as soon as it is complete, `index` is then empty
 
         Returns:
             A tuple `(status, notes)`
@@ -223,18 +291,80 @@ class Simplenote(Singleton):
         if data:
             params["data"] = "true"
 
+        if on_entry is not None:
+            return self._index_stream(URL.index(**params), on_entry)
         try:
-            response = request(
+            response = self._request(
                 URL.index(**params),
                 method="GET",
-                params=params,
-                headers={self.header: self.token},
             )
             return 0, "OK", response.data
         except IOError as err:
             logger.exception(err)
             return -1, err, []
 
+    def _index_stream(self, url: str, on_entry: Callable[[Dict[str, Any]], Any]):
+        parser = ArrayStreamParser("index")
+
+        def on_chunk(chunk: bytes):
+            for entry in parser.feed(chunk):
+                on_entry(entry)
+
+        try:
+            response = self._request(url, method="GET", on_chunk=on_chunk)
+            if response.status != 200:
+                return -1, response.text, []
+            for entry in parser.close():
+                on_entry(entry)
+        except (IOError, ValueError) as err:
+            logger.exception(err)
+            return -1, err, []
+        return 0, "OK", dict(parser.fields, index=[])
+
+    # Waits until a change, timed apart from the requests answered right away
+    @metrics.timed("long_poll.api.changes")
+    def changes(self, cv: str, data: bool = True):
+        """Method to wait for the changes made after `cv`
+
+        The server answers as soon as there is a change, or with an empty list after
+        a while without any.
+
+        Arguments:
+            - cv (string): change version, the `current` of an index or the `cv` of a change
+            - data (bool): include the new content of the changed notes
+
+        Returns:
+            A tuple `(status, changes)`
+
+            - status (int): 0 on success and -1 otherwise
+            - msg (string): "OK" or an error message
+            - changes (list): change objects in order
+            [{
+                'id': 'd3aa2b8e6ade430bb0bd17e66b20d428',
+                'o': 'M',
+                'cv': '666e8b00a5cc2b14e5c85723',
+                'sv': 2,
+                'ev': 3,
+                'd': {'content': '# 1', ...}
+            }]
+        """
+        params: Dict[str, Any] = {"cv": cv}
+        if data:
+            params["data"] = 1
+        try:
+            response = self._request(URL.changes(**params), method="GET", session=self.feed_session)
+            if response.status != 200:
+                return -1, response.text, []
+            # An empty body when the wait ended without changes
+            changes = response.data if response.body.strip() else []
+            if not isinstance(changes, list):
+                return -1, "changes is not a list: %s" % changes, []
+            return 0, "OK", changes
+        except IOError as err:
+            logger.debug(err)
+            return -1, err, []
+
+    @metrics.timed("api.retrieve")
     def retrieve(self, note_id: str, version: Optional[int] = None):
         """Method to get a specific note
 
@@ -250,16 +380,16 @@ class Simplenote(Singleton):
             - note (dict): note object
         """
         try:
-            response = request(
+            response = self._request(
                 URL.retrieve(note_id, version),
                 method="GET",
-                headers={self.header: self.token},
             )
             return self._parse_response(note_id, response)
         except IOError as err:
             logger.exception(err)
             return -1, err, {}
 
+    @metrics.timed("api.modify")
     def modify(self, note: Dict[str, Any], note_id: Optional[str] = None, version: Optional[int] = None):
         """Method to modify or create a note
 
@@ -283,10 +413,9 @@ class Simplenote(Singleton):
             # raise ValueError("note_id should be a string, but got %s" % note_id)
         note["modificationDate"] = time.time()
         try:
-            response = request(
+            response = self._request(
                 URL.modify(note_id, version),
                 method="POST",
-                headers={self.header: self.token},
                 data=note,
             )
             return self._parse_response(note_id, response)
@@ -294,6 +423,7 @@ class Simplenote(Singleton):
             logger.exception(err)
             return -1, err, {}
 
+    @metrics.timed("api.delete")
     def delete(self, note_id: str, version: Optional[int] = None):
         """Method to permanently delete a note
 
@@ -308,16 +438,16 @@ class Simplenote(Singleton):
             - note (dict): an empty dict or an error message
         """
         try:
-            response = request(
+            response = self._request(
                 URL.delete(note_id, version),
                 method="DELETE",
-                headers={self.header: self.token},
             )
             return self._parse_response(note_id, response)
         except IOError as err:
             logger.exception(err)
             return -1, err, {}
 
+    @metrics.timed("api.trash")
     def trash(self, note_id: str, version: Optional[int] = None):
         """Method to move a note to the trash
 
@@ -0,0 +1,28 @@
+"""
+Load the `sublime` and `sublime_plugin` stand-ins of tests/stubs, so the plugin modules can
+be imported outside Sublime Text. No window is open until one is asked for, timeouts only
+run when `sublime.CLOCK` advances and settings are the defaults shipped with the plugin.
+"""
+
+import os
+import sys
+
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STUBS_DIR = os.path.join(BASE_DIR, "tests", "stubs")
+
+
+__all__ = ["install"]
+
+
+def install():
+    """Make the stand-ins importable, unless the real modules are"""
+    try:
+        import sublime  # noqa: F401
+        import sublime_plugin  # noqa: F401
+
+        return
+    except ImportError:
+        pass
+    if STUBS_DIR not in sys.path:
+        sys.path.insert(0, STUBS_DIR)
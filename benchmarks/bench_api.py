@@ -0,0 +1,55 @@
+"""
+Client throughput against the local Simperium server, with injected latency.
+
+Retrieves every note of the account sequentially and from a thread pool, through the
+pooled `Simplenote` session, and reports requests per second and connections opened.
+
+Usage:
+    python benchmarks/bench_api.py [notes] [latency_seconds]
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import os
+import sys
+import tempfile
+import time
+from unittest import mock
+
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BASE_DIR not in sys.path:
+    sys.path.insert(0, BASE_DIR)
+
+import api  # noqa: E402
+from utils.simperium import Faults, SimperiumServer  # noqa: E402
+
+
+def main():
+    notes = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.02
+    with tempfile.TemporaryDirectory() as tmp_dir, SimperiumServer(faults=Faults(latency=latency)) as server:
+        for index in range(notes):
+            server.store.put("%032x" % index, {"content": "Note %s\n\n%s" % (index, "body " * 200), "tags": []})
+        token_file = os.path.join(tmp_dir, "token.pkl")
+        with mock.patch.object(api.URL, "BASE", server.url), mock.patch.object(
+            api, "SIMPLENOTE_TOKEN_FILE", token_file
+        ):
+            client = api.Simplenote("bench@example.com", "secret")
+            _, _, index = client.index(limit=1000)
+            note_ids = [entry["id"] for entry in index["index"]]
+            print("%s notes, %sms latency per response" % (len(note_ids), latency * 1000))
+            for workers in (1, 4, 9, 16):
+                connections = client.session.stats["connections"]
+                start_time = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    results = list(executor.map(client.retrieve, note_ids))
+                cost = time.perf_counter() - start_time
+                assert all(status == 0 for status, _, _ in results)
+                print(
+                    "%2s workers %8.1fms  %7.1f requests/s  %s new connections"
+                    % (workers, cost * 1000, len(note_ids) / cost, client.session.stats["connections"] - connections)
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+JSON codec throughput on the body of a synthetic 5,000-note index.
+
+For every installed backend of `utils.codec`, times decoding the index, encoding the
+`modify` bodies of its notes, and `index` + `_parse_response` style access to a response:
+`data` read twice, which decoded the body twice before responses cached it.
+
+Usage:
+    python benchmarks/bench_codec.py [notes] [repeat]
+"""
+
+from email.message import Message
+import json
+import os
+import sys
+import time
+from typing import Any, Callable
+
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BASE_DIR not in sys.path:
+    sys.path.insert(0, BASE_DIR)
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+if BENCHMARKS_DIR not in sys.path:
+    sys.path.insert(0, BENCHMARKS_DIR)
+
+from synthetic import AccountSpec, generate_notes  # noqa: E402
+
+from utils import codec  # noqa: E402
+from utils.request import Response  # noqa: E402
+
+
+def best(fn: Callable[[], Any], repeat: int) -> float:
+    costs = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        fn()
+        costs.append(time.perf_counter() - start_time)
+    return min(costs)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    notes = generate_notes(AccountSpec(notes=count))
+    body = json.dumps({"index": notes, "current": "synthetic"})
+    raw = body.encode("utf-8")
+    size = len(raw)
+    print("%s notes, index body %.1fMiB, best of %s" % (count, size / 2**20, repeat))
+
+    # The stdlib round trip as requests did it before the codec
+    baseline = {
+        "loads": best(lambda: json.loads(body), repeat),
+        "dumps": best(lambda: [json.dumps(note["d"]).encode() for note in notes], repeat),
+        "response": best(lambda: [json.loads(body) for _ in range(2)], repeat),
+    }
+    results = {"json (before)": baseline}
+    for name in codec.available():
+        codec.use(name)
+
+        def response():
+            response = Response(status=200, headers=Message(), body=raw)
+            return response.data, response.data
+
+        results[name] = {
+            "loads": best(lambda: codec.loads(body), repeat),
+            "dumps": best(lambda: [codec.dumps(note["d"]) for note in notes], repeat),
+            "response": best(response, repeat),
+        }
+    codec.use()
+
+    for name, costs in results.items():
+        print(
+            "%-14s loads %7.1fms (%6.1fMiB/s)  dumps %7.1fms  response.data x2 %7.1fms (x%.1f)"
+            % (
+                name,
+                costs["loads"] * 1e3,
+                size / costs["loads"] / 2**20,
+                costs["dumps"] * 1e3,
+                costs["response"] * 1e3,
+                baseline["response"] / costs["response"],
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Per-record cost of the level files, one filtered file handler per level vs `LevelRoutingHandler`.
+
+Handlers run synchronously and the console is left out, so only the file routing is measured.
+
+Usage:
+    python benchmarks/bench_log_routing.py [records]
+"""
+
+import logging
+import logging.config
+import os
+import sys
+import tempfile
+import time
+from typing import Any, Dict
+
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BASE_DIR not in sys.path:
+    sys.path.insert(0, BASE_DIR)
+
+from utils.logger import init as logger_init  # noqa: E402
+
+
+LEVELS = ["info", "warning", "error", "critical"]
+
+
+def filtered_config(log_dir: str) -> Dict[str, Any]:
+    """The previous config: four rotating file handlers, each guarded by a `LevelMatchFilter`"""
+    return {
+        "version": 1,
+        "disable_existing_loggers": True,
+        "formatters": {"standard": logger_init.LOG_CONFIG["formatters"]["standard"]},
+        "filters": {level: logger_init.LOG_CONFIG["filters"][level] for level in LEVELS},
+        "handlers": {
+            level: {
+                "class": "logging.handlers.TimedRotatingFileHandler",
+                "filename": os.path.join(log_dir, "%s.log" % level),
+                "when": "midnight",
+                "backupCount": logger_init.LOG_BACKUP_COUNT,
+                "encoding": "utf8",
+                "delay": True,
+                "level": level.upper(),
+                "formatter": "standard",
+                "filters": [level],
+            }
+            for level in LEVELS
+        },
+        "loggers": {"": {"handlers": LEVELS, "level": "INFO", "propagate": False}},
+    }
+
+
+def routing_config(log_dir: str) -> Dict[str, Any]:
+    handler = dict(logger_init.LOG_CONFIG["handlers"]["levels"])
+    handler["filenames"] = {level.upper(): os.path.join(log_dir, "%s.log" % level) for level in LEVELS}
+    return {
+        "version": 1,
+        "disable_existing_loggers": True,
+        "formatters": {"standard": logger_init.LOG_CONFIG["formatters"]["standard"]},
+        "handlers": {"levels": handler},
+        "loggers": {"": {"handlers": ["levels"], "level": "INFO", "propagate": False}},
+    }
+
+
+def run(name: str, records: int, config_factory) -> float:
+    with tempfile.TemporaryDirectory() as log_dir:
+        logging.config.dictConfig(config_factory(log_dir))
+        logger = logging.getLogger()
+        levels = [logging.INFO, logging.INFO, logging.INFO, logging.WARNING, logging.ERROR, logging.CRITICAL]
+        start_time = time.perf_counter()
+        for index in range(records):
+            logger.log(levels[index % len(levels)], "NotesIndicator %s", index)
+        cost = time.perf_counter() - start_time
+        sizes = {filename: os.path.getsize(os.path.join(log_dir, filename)) for filename in sorted(os.listdir(log_dir))}
+        logging.shutdown()
+        for handler in logger.handlers[:]:
+            logger.removeHandler(handler)
+    print("%-10s %8.2fus/record  %s" % (name, cost / records * 1e6, sizes))
+    return cost
+
+
+def main():
+    records = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    rounds = 3
+    print("%s records, half INFO, the rest WARNING/ERROR/CRITICAL, best of %s alternating rounds" % (records, rounds))
+    costs: Dict[str, float] = {}
+    for _ in range(rounds):
+        for name, config_factory in (("filtered", filtered_config), ("routing", routing_config)):
+            costs[name] = min(costs.get(name, float("inf")), run(name, records, config_factory))
+    print("routing/filtered: %.2f" % (costs["routing"] / costs["filtered"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Per-call latency of logging on the hot path, synchronous handlers vs the queue pipeline.
+
+Usage:
+    python benchmarks/bench_logging.py [calls]
+"""
+
+import copy
+import io
+import logging
+import os
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BASE_DIR not in sys.path:
+    sys.path.insert(0, BASE_DIR)
+
+from utils.logger import init as logger_init  # noqa: E402
+
+
+def percentile(samples: List[float], percent: float) -> float:
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * percent / 100))]
+
+
+def bench_config(log_dir: str) -> Dict[str, Any]:
+    """The plugin config, with files under `log_dir` and the console in memory"""
+    config = copy.deepcopy(logger_init.LOG_CONFIG)
+    for handler in config["handlers"].values():
+        if "filename" in handler:
+            handler["filename"] = os.path.join(log_dir, os.path.basename(handler["filename"]))
+        for level_name, filename in handler.get("filenames", {}).items():
+            handler["filenames"][level_name] = os.path.join(log_dir, os.path.basename(filename))
+    config["handlers"]["console"]["stream"] = io.StringIO()
+    config["loggers"][""]["level"] = "INFO"
+    return config
+
+
+def run(name: str, calls: int, queue: bool) -> Dict[str, float]:
+    with tempfile.TemporaryDirectory() as log_dir:
+        queue_handler = logger_init.configure(bench_config(log_dir), queue=queue)
+        logger = logging.getLogger()
+        note = {"id": "c6efd3fb-1111-1111-1111-86e9441003d3", "v": 2, "d": {"content": "x" * 200}}
+        samples: List[float] = []
+        for index in range(calls):
+            start_time = time.perf_counter()
+            if index % 2:
+                logger.info("NotesIndicator %s", index)
+            else:
+                logger.warning(note)
+            samples.append(time.perf_counter() - start_time)
+        drain_start = time.perf_counter()
+        if queue_handler is not None:
+            queue_handler.flush()
+        drain = time.perf_counter() - drain_start
+        logging.shutdown()
+    result = {
+        "mean_us": sum(samples) / len(samples) * 1e6,
+        "p50_us": percentile(samples, 50) * 1e6,
+        "p99_us": percentile(samples, 99) * 1e6,
+        "max_us": max(samples) * 1e6,
+        "drain_ms": drain * 1e3,
+    }
+    print(
+        "%-12s mean %8.2fus  p50 %8.2fus  p99 %8.2fus  max %9.2fus  (background drain %.1fms)"
+        % (name, result["mean_us"], result["p50_us"], result["p99_us"], result["max_us"], result["drain_ms"])
+    )
+    return result
+
+
+def main():
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    print("%s log calls, half INFO strings, half WARNING dicts" % calls)
+    run("synchronous", calls, queue=False)
+    run("queue", calls, queue=True)
+
+
+if __name__ == "__main__":
+    main()
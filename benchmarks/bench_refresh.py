@@ -0,0 +1,93 @@
+"""
+Allocations of refreshing a cache of 10k notes from server payloads.
+
+Compares rebuilding every note with `Note(**payload)` against `Note.upsert(**payload)`,
+for a refresh where nothing changed and one where 5% of the notes got new tags. Payloads
+are decoded before each measurement, only the note updates are traced.
+
+Usage:
+    python benchmarks/bench_refresh.py [notes]
+"""
+
+import copy
+import gc
+import os
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List
+
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BASE_DIR not in sys.path:
+    sys.path.insert(0, BASE_DIR)
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+if BENCHMARKS_DIR not in sys.path:
+    sys.path.insert(0, BENCHMARKS_DIR)
+
+import _headless  # noqa: E402
+
+
+_headless.install()
+
+from synthetic import AccountSpec, generate_notes  # noqa: E402
+
+from models import Note  # noqa: E402
+from utils.tree.redblacktree import rbtree as RedBlackTree  # noqa: E402
+
+
+EDIT_RATIO = 0.05
+
+
+def reset(notes: List[Dict[str, Any]]):
+    Note.mapper_id_note.clear()
+    Note.tree = RedBlackTree()
+    for payload in copy.deepcopy(notes):
+        Note(**payload)
+    gc.collect()
+
+
+def edited(notes: List[Dict[str, Any]], ratio: float) -> List[Dict[str, Any]]:
+    """The payloads after another client tagged `ratio` of the notes"""
+    payloads = copy.deepcopy(notes)
+    for payload in payloads[: int(len(payloads) * ratio)]:
+        payload["v"] += 1
+        payload["d"]["tags"] = payload["d"]["tags"] + ["edited"]
+    return payloads
+
+
+def measure(notes: List[Dict[str, Any]], payloads: List[Dict[str, Any]], apply: Callable[..., Note]) -> Dict[str, Any]:
+    reset(notes)
+    payloads = copy.deepcopy(payloads)
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    start_time = time.perf_counter()
+    for payload in payloads:
+        apply(**payload)
+    cost = time.perf_counter() - start_time
+    after = tracemalloc.take_snapshot()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    stats = after.compare_to(before, "filename")
+    return {
+        "seconds": cost,
+        "peak_bytes": peak,
+        "allocated_blocks": sum(stat.count_diff for stat in stats if stat.count_diff > 0),
+    }
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    notes = generate_notes(AccountSpec(notes=count))
+    print("%s notes, time under tracemalloc" % count)
+    for name, payloads in (("unchanged", notes), ("tags %d%%" % (EDIT_RATIO * 100), edited(notes, EDIT_RATIO))):
+        for label, apply in (("Note(**payload)", Note), ("Note.upsert", Note.upsert)):
+            result = measure(notes, payloads, apply)
+            print(
+                "%-10s %-16s %8.1fms  peak %7.1fKiB  %8s blocks"
+                % (name, label, result["seconds"] * 1e3, result["peak_bytes"] / 1024, result["allocated_blocks"])
+            )
+
+
+if __name__ == "__main__":
+    main()
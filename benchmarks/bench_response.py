@@ -0,0 +1,93 @@
+"""
+Peak and retained memory of decoding a large index response.
+
+Replays the body of a synthetic 5,000-note index, plain and gzip encoded, through the
+decoders of `utils.request` and `Response.data`, for every installed codec. The previous
+chain is kept here for comparison: decompressed bytes decoded to a `str` body, JSON parsed
+from the `str`. Reading the body from the socket is part of the measure.
+
+Usage:
+    python benchmarks/bench_response.py [notes]
+"""
+
+from email.message import Message
+import gc
+import gzip
+import io
+import json
+import os
+import sys
+import tracemalloc
+from typing import Any, Callable, Dict
+
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BASE_DIR not in sys.path:
+    sys.path.insert(0, BASE_DIR)
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+if BENCHMARKS_DIR not in sys.path:
+    sys.path.insert(0, BENCHMARKS_DIR)
+
+from synthetic import AccountSpec, generate_notes  # noqa: E402
+
+from utils import codec  # noqa: E402
+from utils.request import ContentDecoding, Response  # noqa: E402
+
+
+class RawResponse:
+    """What `ContentDecoding` reads from, `read` allocates the received body like a socket read"""
+
+    def __init__(self, raw: bytes):
+        self.raw = bytearray(raw)
+        self.headers = Message()
+        self.headers["Content-Type"] = "application/json; charset=UTF-8"
+
+    def read(self) -> bytes:
+        return bytes(self.raw)
+
+
+def before(raw: RawResponse, encoding: str) -> Any:
+    if encoding == "gzip":
+        body = gzip.GzipFile(fileobj=io.BytesIO(raw.read())).read().decode()
+    else:
+        body = raw.read().decode(raw.headers.get_content_charset("utf-8"))
+    return body, json.loads(body)
+
+
+def after(raw: RawResponse, encoding: str) -> Any:
+    response = Response(status=200, headers=raw.headers, body=getattr(ContentDecoding, encoding)(raw))
+    return response, response.data
+
+
+def measure(fn: Callable[[], Any]) -> Dict[str, int]:
+    gc.collect()
+    tracemalloc.start()
+    result = fn()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return {"peak": peak, "retained": current}
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    body = json.dumps({"index": generate_notes(AccountSpec(notes=count)), "current": "synthetic"}).encode()
+    bodies = {"default": body, "gzip": gzip.compress(body, 6)}
+    print("%s notes, index body %.1fMiB, gzip %.1fMiB" % (count, len(body) / 2**20, len(bodies["gzip"]) / 2**20))
+    for name in codec.available():
+        codec.use(name)
+        for encoding, raw in bodies.items():
+            for label, decode in (("before", before), ("Response", after)):
+                if label == "before" and name != "json":
+                    continue
+                received = RawResponse(raw)
+                result = measure(lambda: decode(received, encoding))
+                print(
+                    "%-7s %-8s %-9s peak %7.1fMiB  retained %7.1fMiB"
+                    % (name, encoding, label, result["peak"] / 2**20, result["retained"] / 2**20)
+                )
+    codec.use()
+
+
+if __name__ == "__main__":
+    main()
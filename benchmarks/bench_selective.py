@@ -0,0 +1,98 @@
+"""
+Selective retrieval against the index with data.
+
+Syncs a synthetic account once, then compares a second sync by `Note.sync_index` with
+data, as `NotesIndicator` always did, with the version-only index of `NotesIndicator`,
+which only retrieves the notes whose server version is newer. Reports the requests made,
+the bytes of index body decoded and the time, for an unchanged account and a few edits.
+
+Usage:
+    python benchmarks/bench_selective.py [notes]
+"""
+
+import gc
+import os
+import sys
+import time
+from typing import Any, Callable, Dict
+from unittest import mock
+
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BASE_DIR not in sys.path:
+    sys.path.insert(0, BASE_DIR)
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+if BENCHMARKS_DIR not in sys.path:
+    sys.path.insert(0, BENCHMARKS_DIR)
+
+import _headless  # noqa: E402
+
+
+_headless.install()
+
+from synthetic import AccountSpec, SyntheticSimplenote, generate_notes  # noqa: E402
+
+from models import Note  # noqa: E402
+from operations import NotesIndicator  # noqa: E402
+from utils.tree.redblacktree import rbtree as RedBlackTree  # noqa: E402
+
+
+EDITS = (0, 10, 50)
+
+
+def selective(limit: int):
+    indicator = NotesIndicator(sync_note_number=limit)
+    indicator.run()
+    if isinstance(indicator.result, Exception):
+        raise indicator.result
+
+
+def measure(api: SyntheticSimplenote, edits: int, sync: Callable[[], Any]) -> Dict[str, Any]:
+    Note.mapper_id_note.clear()
+    Note.tree = RedBlackTree()
+    Note.sync_index(limit=len(api.notes), data=True)
+    api.edit(edits / len(api.notes))
+    api._bodies.clear()
+    gc.collect()
+    del api.calls[:]
+    start_time = time.perf_counter()
+    sync()
+    seconds = time.perf_counter() - start_time
+    indexes = sum(1 for call, _ in api.calls if call == "index")
+    return {
+        "index": indexes,
+        "retrieve": len(api.calls) - indexes,
+        # Bodies are cached per (limit, data), only the ones of this sync are left
+        "bytes": sum(len(body) for body in api._bodies.values()),
+        "seconds": seconds,
+    }
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    api = SyntheticSimplenote(generate_notes(AccountSpec(notes=count)))
+    print("%s notes" % count)
+    with mock.patch.object(Note, "API", api):
+        for edits in EDITS:
+            for label, sync in (
+                ("data index", lambda: Note.sync_index(limit=count, data=True)),
+                ("selective", lambda: selective(count)),
+            ):
+                result = measure(api, edits, sync)
+                print(
+                    "%3s edited  %-10s %s index + %3s retrieve  index body %8.1fKiB  %8.1fms"
+                    % (
+                        edits,
+                        label,
+                        result["index"],
+                        result["retrieve"],
+                        result["bytes"] / 2**10,
+                        result["seconds"] * 1e3,
+                    )
+                )
+    Note.mapper_id_note.clear()
+    Note.tree = RedBlackTree()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Streamed index against the buffered one.
+
+Serves a page of a synthetic account from the local Simperium server with limited
+bandwidth, and compares `Note.diff` over a fully read index with `Note.sync_index`, which
+applies each entry as soon as it is received. Reports when the first note is built and
+when all are. The parse alone is then measured under tracemalloc, entries dropped once
+parsed, to show the memory it needs on top of the notes.
+
+Usage:
+    python benchmarks/bench_stream.py [notes] [bandwidth_bytes_per_second]
+"""
+
+import gc
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Callable, Dict
+from unittest import mock
+
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BASE_DIR not in sys.path:
+    sys.path.insert(0, BASE_DIR)
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+if BENCHMARKS_DIR not in sys.path:
+    sys.path.insert(0, BENCHMARKS_DIR)
+
+import _headless  # noqa: E402
+
+
+_headless.install()
+
+from synthetic import AccountSpec, generate_notes  # noqa: E402
+
+import api  # noqa: E402
+from models import Note  # noqa: E402
+from utils.jsonstream import ArrayStreamParser  # noqa: E402
+from utils.simperium import Faults, SimperiumServer  # noqa: E402
+from utils.tree.redblacktree import rbtree as RedBlackTree  # noqa: E402
+
+
+CHUNK_SIZE = 64 * 1024
+
+
+def timed(sync: Callable[[], Any]) -> Dict[str, float]:
+    Note.mapper_id_note.clear()
+    Note.tree = RedBlackTree()
+    gc.collect()
+    first = []
+    diff_entry = Note._diff_entry.__func__  # type: ignore
+
+    def record(cls, *args):
+        if not first:
+            first.append(time.perf_counter())
+        return diff_entry(cls, *args)
+
+    start_time = time.perf_counter()
+    with mock.patch.object(Note, "_diff_entry", classmethod(record)):
+        sync()
+    total = time.perf_counter() - start_time
+    return {"first": first[0] - start_time, "total": total, "notes": len(Note.mapper_id_note)}
+
+
+def buffered(limit: int):
+    status, msg, result = Note.API.index(limit, True)
+    assert status == 0, msg
+    Note.diff(result["index"], complete="mark" not in result)
+
+
+def parse_memory(body: bytes, stream: bool) -> int:
+    gc.collect()
+    tracemalloc.start()
+    if stream:
+        parser = ArrayStreamParser("index")
+        for start in range(0, len(body), CHUNK_SIZE):
+            parser.feed(body[start : start + CHUNK_SIZE])
+        parser.close()
+    else:
+        # Like `Response.data`, the parsed index stays alive while the notes are built
+        json.loads(body)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def main():
+    # One page, the most an index request returns
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    bandwidth = int(sys.argv[2]) if len(sys.argv) > 2 else 4 * 2**20
+    notes = generate_notes(AccountSpec(notes=count))
+    with tempfile.TemporaryDirectory() as tmp_dir, SimperiumServer(faults=Faults(bandwidth=bandwidth)) as server:
+        for note in notes:
+            server.store.put(note["id"], note["d"])
+        with mock.patch.object(api.URL, "BASE", server.url), mock.patch.object(
+            api, "SIMPLENOTE_TOKEN_FILE", os.path.join(tmp_dir, "token.pkl")
+        ):
+            Note._API = api.Simplenote("bench@example.com", "secret")
+            print("%s notes, %.1fMiB/s" % (count, bandwidth / 2**20))
+            for label, sync in (
+                ("buffered", lambda: buffered(count)),
+                ("streamed", lambda: Note.sync_index(limit=count)),
+            ):
+                result = timed(sync)
+                print(
+                    "%-9s first note %7.1fms  all %7.1fms  %s notes"
+                    % (label, result["first"] * 1e3, result["total"] * 1e3, result["notes"])
+                )
+            Note.reset_api()
+
+    body = json.dumps({"index": notes, "current": "synthetic"}).encode()
+    print("parse of a %.1fMiB body, peak without the notes" % (len(body) / 2**20))
+    for label, stream in (("json.loads", False), ("streamed", True)):
+        print("%-10s peak %7.1fMiB" % (label, parse_memory(body, stream) / 2**20))
+
+
+if __name__ == "__main__":
+    main()
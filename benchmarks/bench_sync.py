@@ -0,0 +1,199 @@
+"""
+End-to-end sync benchmark against synthetic accounts.
+
+Each scenario runs `NotesIndicator` -> `SimplenoteSyncCommand.merge_note` -> the note list
+of `SimplenoteListCommand` twice: an initial sync into an empty cache, then an incremental
+sync after another client edited 5% of the notes. Times are the best of `--repeat` runs,
+memory is measured in a separate run under tracemalloc.
+
+Usage:
+    python benchmarks/bench_sync.py [--scenarios small,medium] [--json results.json] [--baseline baseline.json]
+
+With `--baseline`, results are compared to the file, which is created if it does not exist.
+"""
+
+import argparse
+import gc
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional
+from unittest import mock
+
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BASE_DIR not in sys.path:
+    sys.path.insert(0, BASE_DIR)
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+if BENCHMARKS_DIR not in sys.path:
+    sys.path.insert(0, BENCHMARKS_DIR)
+
+import _headless  # noqa: E402
+
+
+_headless.install()
+
+from synthetic import AccountSpec, SyntheticSimplenote, generate_notes  # noqa: E402
+
+import _config  # noqa: E402, F401
+from models import Note  # noqa: E402
+from operations import NotesIndicator  # noqa: E402
+import simplenotecommands  # noqa: E402
+from utils.tree.redblacktree import rbtree as RedBlackTree  # noqa: E402
+
+
+SCENARIOS: Dict[str, AccountSpec] = {
+    "small": AccountSpec(notes=500),
+    "medium": AccountSpec(notes=5000),
+    "large": AccountSpec(notes=20000, median_size=3000),
+    "pinned": AccountSpec(notes=5000, pinned_ratio=0.5, tags=300),
+}
+EDIT_RATIO = 0.05
+
+
+def reset():
+    Note.mapper_id_note.clear()
+    Note.tree = RedBlackTree()
+    gc.collect()
+
+
+def sync(limit: int) -> Dict[str, float]:
+    """One sync cycle, returns the seconds spent per step"""
+    costs: Dict[str, float] = {}
+    start_time = time.perf_counter()
+    indicator = NotesIndicator(sync_note_number=limit)
+    indicator.run()
+    if isinstance(indicator.result, Exception):
+        raise indicator.result
+    costs["fetch"] = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    simplenotecommands.SimplenoteSyncCommand().merge_note(indicator.result.updated)
+    costs["merge"] = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    simplenotecommands.SimplenoteListCommand().run()
+    costs["list"] = time.perf_counter() - start_time
+    costs["total"] = sum(costs.values())
+    return costs
+
+
+def run_scenario(spec: AccountSpec, measure: Callable[[Callable[[], Any]], Dict[str, Any]]) -> Dict[str, Any]:
+    notes = generate_notes(spec)
+    api = SyntheticSimplenote(notes, seed=spec.seed)
+    results: Dict[str, Any] = {}
+    with mock.patch.object(Note, "API", api), mock.patch.object(simplenotecommands, "SIMPLENOTE_STARTED", True):
+        reset()
+        results["initial"] = measure(lambda: sync(spec.notes))
+        api.edit(EDIT_RATIO)
+        results["incremental"] = measure(lambda: sync(spec.notes))
+    reset()
+    return results
+
+
+def measure_time(fn: Callable[[], Dict[str, float]]) -> Dict[str, Any]:
+    return fn()
+
+
+def measure_memory(fn: Callable[[], Any]) -> Dict[str, Any]:
+    collections = sum(stat["collections"] for stat in gc.get_stats())
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    fn()
+    after = tracemalloc.take_snapshot()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    retained = after.compare_to(before, "filename")
+    return {
+        "peak_bytes": peak,
+        "retained_bytes": sum(stat.size_diff for stat in retained),
+        "retained_blocks": sum(stat.count_diff for stat in retained),
+        "gc_collections": sum(stat["collections"] for stat in gc.get_stats()) - collections,
+    }
+
+
+def benchmark(name: str, spec: AccountSpec, repeat: int) -> Dict[str, Any]:
+    best: Dict[str, Dict[str, float]] = {}
+    for _ in range(repeat):
+        for phase, costs in run_scenario(spec, measure_time).items():
+            if phase not in best or costs["total"] < best[phase]["total"]:
+                best[phase] = costs
+    memory = run_scenario(spec, measure_memory)
+    result: Dict[str, Any] = {"spec": spec._asdict()}
+    for phase, costs in best.items():
+        result[phase] = dict(costs, notes_per_second=spec.notes / costs["total"], **memory[phase])
+    return result
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any]) -> List[str]:
+    lines = ["%-22s %-12s %12s %12s %8s" % ("scenario", "metric", "baseline", "current", "change")]
+    for name, scenario in results["scenarios"].items():
+        base_scenario = baseline.get("scenarios", {}).get(name)
+        if base_scenario is None:
+            continue
+        for phase in ("initial", "incremental"):
+            for metric in ("total", "peak_bytes", "retained_blocks"):
+                base_value = base_scenario[phase][metric]
+                value = scenario[phase][metric]
+                change = (value - base_value) / base_value * 100 if base_value else 0.0
+                lines.append(
+                    "%-22s %-12s %12.4g %12.4g %+7.1f%%" % ("%s/%s" % (name, phase), metric, base_value, value, change)
+                )
+    return lines
+
+
+def report(name: str, result: Dict[str, Any]):
+    for phase in ("initial", "incremental"):
+        phase_result = result[phase]
+        print(
+            "%-8s %-12s %8.1fms (fetch %7.1f merge %7.1f list %7.1f)  %9.0f notes/s  peak %7.1fMiB  gc %d"
+            % (
+                name,
+                phase,
+                phase_result["total"] * 1e3,
+                phase_result["fetch"] * 1e3,
+                phase_result["merge"] * 1e3,
+                phase_result["list"] * 1e3,
+                phase_result["notes_per_second"],
+                phase_result["peak_bytes"] / 2**20,
+                phase_result["gc_collections"],
+            )
+        )
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", default="small,medium", help="among: %s" % ",".join(SCENARIOS))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", help="compare to this results file, created if missing")
+    args = parser.parse_args(argv)
+
+    results: Dict[str, Any] = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "scenarios": {},
+    }
+    for name in args.scenarios.split(","):
+        results["scenarios"][name] = benchmark(name, SCENARIOS[name], args.repeat)
+        report(name, results["scenarios"][name])
+
+    if args.json:
+        with open(args.json, "w") as fh:
+            json.dump(results, fh, indent=2)
+    if args.baseline:
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as fh:
+                print("\n".join(compare(results, json.load(fh))))
+        else:
+            with open(args.baseline, "w") as fh:
+                json.dump(results, fh, indent=2)
+            print("Baseline written to %s" % args.baseline)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Cost of the request logging during a sync at INFO level, eager messages vs `utils.logger.structured`.
+
+A sync is emulated against a local HTTP server: one retrieve and one modify per note, with
+note bodies of `--size` characters. "eager" formats every field like the previous
+`logger.debug(f"url: ..., data: {data}")` calls did, "lazy" is the current code.
+
+Usage:
+    python benchmarks/bench_sync_logging.py [notes] [size]
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from typing import Any
+
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BASE_DIR not in sys.path:
+    sys.path.insert(0, BASE_DIR)
+
+from utils import request as request_module  # noqa: E402
+from utils.logger import structured  # noqa: E402
+
+
+class NoteHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    body = b"{}"
+
+    def reply(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(self.body)))
+        self.send_header("X-Simperium-Version", "2")
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def do_GET(self):
+        self.reply()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.reply()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def eager_debug(logger: logging.Logger, event: str, **fields: Any):
+    logger.debug(", ".join("%s: %s" % (key, value) for key, value in fields.items()))
+
+
+def sync(url: str, notes: int, content: str) -> float:
+    session = request_module.Session()
+    start_time = time.perf_counter()
+    for index in range(notes):
+        note_url = "%s/note/%032x" % (url, index)
+        request_module.request(note_url, session=session)
+        request_module.request(note_url, method="POST", data={"content": content, "tags": []}, session=session)
+    return time.perf_counter() - start_time
+
+
+def main():
+    notes = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    size = int(sys.argv[2]) if len(sys.argv) > 2 else 50000
+    content = "x" * size
+    NoteHandler.body = json.dumps({"content": content, "tags": [], "deleted": False}).encode()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), NoteHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = "http://127.0.0.1:%s" % server.server_address[1]
+    logging.basicConfig(level=logging.INFO, stream=open(os.devnull, "w"))
+
+    print("%s notes of %s characters, root logger at INFO, best of 3 alternating rounds" % (notes, size))
+    costs = {}
+    try:
+        for _ in range(3):
+            for name, debug in (("eager", eager_debug), ("lazy", structured.debug)):
+                request_module.structured.debug = debug  # type: ignore
+                cost = sync(url, notes, content)
+                costs[name] = min(costs.get(name, float("inf")), cost)
+    finally:
+        request_module.structured.debug = structured.debug  # type: ignore
+        server.shutdown()
+    for name, cost in costs.items():
+        print("%-6s %8.1fms  %6.1fus/request" % (name, cost * 1e3, cost / notes / 2 * 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+Synthetic Simplenote accounts for benchmarks.
+
+`generate_notes(AccountSpec(notes=5000))` builds index entries shaped like the ones the
+Simperium API returns. `SyntheticSimplenote` serves them with the `Simplenote` API
+interface, and `edit` changes a share of them the way another client would.
+"""
+
+import copy
+import json
+import random
+import string
+import time
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+import uuid
+
+from utils.jsonstream import ArrayStreamParser
+
+
+__all__ = ["AccountSpec", "generate_notes", "SyntheticSimplenote"]
+
+
+_WORDS_RNG = random.Random(0)
+WORDS = ["".join(_WORDS_RNG.choice(string.ascii_lowercase) for _ in range(1 + index % 9)) for index in range(2000)]
+
+
+class AccountSpec(NamedTuple):
+    notes: int = 1000
+    # Note sizes follow a log-normal distribution: median `median_size` characters
+    median_size: int = 1500
+    size_sigma: float = 1.0
+    max_size: int = 200000
+    tags: int = 30
+    max_tags_per_note: int = 3
+    pinned_ratio: float = 0.05
+    markdown_ratio: float = 0.3
+    deleted_ratio: float = 0.02
+    seed: int = 0
+
+
+def _text(rng: random.Random, size: int) -> str:
+    words: List[str] = []
+    length = 0
+    while length < size:
+        word = rng.choice(WORDS)
+        words.append(word)
+        length += len(word) + 1
+        if rng.random() < 0.08:
+            words.append("\n")
+    return " ".join(words)[:size]
+
+
+def _note(rng: random.Random, spec: AccountSpec, note_id: str, tags: List[str], now: float) -> Dict[str, Any]:
+    size = min(int(rng.lognormvariate(0, spec.size_sigma) * spec.median_size), spec.max_size)
+    title = _text(rng, rng.randint(8, 60)).replace("\n", " ").strip() or "untitled"
+    system_tags = []
+    if rng.random() < spec.pinned_ratio:
+        system_tags.append("pinned")
+    if rng.random() < spec.markdown_ratio:
+        system_tags.append("markdown")
+    creation_date = now - rng.uniform(0, 5 * 365 * 86400)
+    return {
+        "id": note_id,
+        "v": rng.randint(1, 50),
+        "d": {
+            "tags": rng.sample(tags, rng.randint(0, min(spec.max_tags_per_note, len(tags)))),
+            "deleted": rng.random() < spec.deleted_ratio,
+            "shareURL": "",
+            "publishURL": "",
+            "systemTags": system_tags,
+            "content": "%s\n%s" % (title, _text(rng, size)),
+            "modificationDate": rng.uniform(creation_date, now),
+            "creationDate": creation_date,
+        },
+    }
+
+
+def generate_notes(spec: AccountSpec) -> List[Dict[str, Any]]:
+    """Index entries of a synthetic account, the same `spec` always gives the same notes"""
+    rng = random.Random(spec.seed)
+    tags = ["%s-%d" % (rng.choice(WORDS), index) for index in range(spec.tags)]
+    now = 1718520576.0
+    return [_note(rng, spec, str(uuid.UUID(int=rng.getrandbits(128))), tags, now) for _ in range(spec.notes)]
+
+
+class SyntheticSimplenote:
+    """In-memory stand-in of `api.Simplenote` serving a synthetic account.
+
+    The index is decoded from JSON on every call, like the real client decodes the response body,
+    and streamed in 64KiB chunks when `on_entry` is given.
+    """
+
+    def __init__(self, notes: List[Dict[str, Any]], seed: int = 0):
+        self.notes: Dict[str, Dict[str, Any]] = {note["id"]: note for note in notes}
+        self.rng = random.Random(seed)
+        self.calls: List[Tuple[str, str]] = []
+        # (limit, data) -> encoded index
+        self._bodies: Dict[Tuple[int, bool], str] = {}
+
+    def index(self, limit: int = 1000, data: bool = False, on_entry: Optional[Callable[[Dict[str, Any]], Any]] = None):
+        self.calls.append(("index", str(limit)))
+        body = self._bodies.get((limit, data))
+        if body is None:
+            notes = list(self.notes.values())[:limit]
+            if not data:
+                notes = [{"id": note["id"], "v": note["v"]} for note in notes]
+            body = self._bodies[(limit, data)] = json.dumps({"index": notes, "current": "synthetic"})
+        if on_entry is None:
+            return 0, "OK", json.loads(body)
+        parser = ArrayStreamParser("index")
+        raw = body.encode()
+        for start in range(0, len(raw), 64 * 1024):
+            for entry in parser.feed(raw[start : start + 64 * 1024]):
+                on_entry(entry)
+        for entry in parser.close():
+            on_entry(entry)
+        return 0, "OK", dict(parser.fields, index=[])
+
+    def retrieve(self, note_id: str, version: Optional[int] = None):
+        self.calls.append(("retrieve", note_id))
+        return 0, "OK", copy.deepcopy(self.notes[note_id])
+
+    def modify(self, note: Dict[str, Any], note_id: Optional[str] = None, version: Optional[int] = None):
+        note_id = note_id or str(uuid.uuid4())
+        self.calls.append(("modify", note_id))
+        current = self.notes.setdefault(note_id, {"id": note_id, "v": 0, "d": {}})
+        current["v"] += 1
+        current["d"] = dict(current["d"], **note)
+        self._bodies.clear()
+        return 0, "OK", copy.deepcopy(current)
+
+    def edit(self, ratio: float) -> List[str]:
+        """Change the content of `ratio` of the notes as another client would, returns their ids"""
+        edited = self.rng.sample(list(self.notes), int(len(self.notes) * ratio))
+        for note_id in edited:
+            note = self.notes[note_id]
+            note["v"] += 1
+            note["d"]["content"] += "\nedited %s" % note["v"]
+            note["d"]["modificationDate"] = time.time()
+        self._bodies.clear()
+        return edited
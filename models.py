@@ -1,17 +1,21 @@
 from __future__ import annotations
 
+from concurrent.futures import Future
 from importlib import import_module
 import logging
 import os
 import re
 import string
 import time
-from typing import Any, ClassVar, Dict, List, Optional, TypedDict
+from typing import Any, Callable, ClassVar, Dict, List, NamedTuple, Optional, Pattern, Set, Tuple, TypedDict
 from uuid import uuid4
 
-from api import Simplenote
-from settings import get_settings
+from api import URL, Simplenote
+from settings import snapshot
+from utils import trace
 from utils.decorator import class_property
+from utils.fs import FileWriter
+from utils.merge import MergeResult, merge3
 from utils.tree.redblacktree import rbtree as RedBlackTree
 
 
@@ -23,8 +27,8 @@ logger = logging.getLogger()
 
 SIMPLENOTE_DEFAULT_NOTE_TITLE = "untitled"
 SIMPLENOTE_BASE_DIR = os.path.abspath(os.path.dirname(__file__))
+# Created by the first note written, see `FileWriter.write`
 SIMPLENOTE_NOTES_DIR = os.path.join(SIMPLENOTE_BASE_DIR, "notes")
-os.makedirs(SIMPLENOTE_NOTES_DIR, exist_ok=True)
 SIMPLENOTE_SETTINGS_FILE = "simplenote.sublime-settings"
 # SIMPLENOTE_SETTINGS_FILE = os.path.join(SIMPLENOTE_BASE_DIR, _SIMPLENOTE_SETTINGS_FILE)
 
@@ -32,6 +36,9 @@ SIMPLENOTE_SETTINGS_FILE = "simplenote.sublime-settings"
 # Take out invalid characters from title and use that as base for the name
 VALID_CHARS = "-_.() %s%s" % (string.ascii_letters, string.digits)
 
+# Note files are written atomically, and only when their content changed
+WRITER = FileWriter()
+
 
 class _Note:
     """Data class for a note object"""
@@ -87,6 +94,18 @@ class _Note:
     def _nest_dict(self) -> Dict[str, Any]:
         return {filed: getattr(self, filed) for filed in self.__serialize_fields}
 
+    def update(self, fields: Dict[str, Any]) -> List[str]:
+        """Set the fields whose value differs, returns their names"""
+        changed = []
+        for field in self.__serialize_fields:
+            if field not in fields:
+                continue
+            value = fields[field]
+            if getattr(self, field) != value:
+                setattr(self, field, value)
+                changed.append(field)
+        return changed
+
 
 class NoteType(TypedDict):
     tags: List[str]
@@ -99,11 +118,42 @@ class NoteType(TypedDict):
     creationDate: float
 
 
+class IndexDiff(NamedTuple):
+    """What an index changed locally, notes only ever appear in one of the sets"""
+
+    added: List["Note"]
+    changed: List["Note"]
+    deleted: List["Note"]
+
+    @property
+    def updated(self) -> List["Note"]:
+        return self.added + self.changed
+
+    @property
+    def changes(self) -> int:
+        return len(self.added) + len(self.changed) + len(self.deleted)
+
+
+class IndexPlan(NamedTuple):
+    """What a version-only index found: ids to retrieve, unknown or newer on the server, and deleted notes"""
+
+    added: List[str]
+    stale: List[str]
+    deleted: List["Note"]
+
+    @property
+    def retrieve(self) -> List[str]:
+        return self.added + self.stale
+
+
 class Note:
     mapper_id_note: ClassVar[Dict[str, "Note"]] = dict()
     # TODO: use weakref
     # mapper_id_note: ClassVar[WeakValueDictionary[str, "Note"]] = WeakValueDictionary()
     tree: ClassVar[RedBlackTree] = RedBlackTree()
+    _API: ClassVar[Optional[Simplenote]] = None
+    # Change version of the bucket as of the last index or applied change
+    cv: ClassVar[str] = ""
 
     def __new__(cls, id: str = "", **kwargs):
         if id not in Note.mapper_id_note:
@@ -123,14 +173,23 @@ class Note:
         # Note.tree.remove(self.d.modificationDate)
         self.v: int = v
         _d = getattr(self, "d", None)
-        if isinstance(_d, _Note):
-            old_modificationDate = _d.modificationDate
-            Note.tree.remove(old_modificationDate)
         d["_note"] = self
-        self.d: _Note = _Note(**d)
-        Note.tree.insert(self.d.modificationDate, self)
+        with trace.span("Note.tree"):
+            if isinstance(_d, _Note):
+                old_modificationDate = _d.modificationDate
+                Note.tree.remove(old_modificationDate)
+            self.d: _Note = _Note(**d)
+            Note.tree.insert(self.d.modificationDate, self)
         # TODO:
         self._content = self.__dict__.get("_content", "")
+        if "_base" not in self.__dict__:
+            # Server version and content the local copy was last synced to, the base of three-way merges
+            self._base_v: int = v
+            self._base: str = self.d.content
+        # `d.content` holds a local edit the server has not confirmed yet
+        self._pending = False
+        # The pending local edit, held while a newer remote version took its place in `d.content`
+        self._local: Optional[str] = None
 
     # TODO:
     # def __setattr__(self, name: str, value: Any) -> None:
@@ -145,31 +204,177 @@ class Note:
     #     return self.d.modificationDate == value.d.modificationDate
     #     return self.id == value.id
 
+    @classmethod
+    def upsert(
+        cls, id: str = "", v: int = 0, d: Optional[Dict[str, Any]] = None, confirmed: bool = False, **kwargs
+    ) -> "Note":
+        """The note of a server payload, a known note is updated in place instead of rebuilt"""
+        note = Note.mapper_id_note.get(id)
+        if note is None:
+            return Note(id=id, v=v, d=d if d is not None else {})
+        note.update(v, d or {}, confirmed=confirmed)
+        return note
+
+    def update(self, v: int, d: Dict[str, Any], confirmed: bool = False) -> List[str]:
+        """Apply the fields of version `v` that differ, returns their names.
+
+        Only the response to our own upload, `confirmed`, settles a pending local edit. Otherwise
+        a newer remote content leaves the edit held in `_local`, the local side of the next merge.
+        """
+        if confirmed:
+            self._pending, self._local = False, None
+        if v == self.v:
+            return []
+        self.v = v
+        local = self.d.content
+        modificationDate = self.d.modificationDate
+        changed = self.d.update(d)
+        if self._pending and "content" in changed and self._local is None:
+            self._local = local
+        if "modificationDate" in changed:
+            with trace.span("Note.tree"):
+                Note.tree.remove(modificationDate)
+                Note.tree.insert(self.d.modificationDate, self)
+        return changed
+
     @class_property
     def API(cls) -> Simplenote:
-        username = get_settings("username")
-        password = get_settings("password")
-        if not isinstance(username, str) or not isinstance(password, str):
-            logger.info("Missing username or password, Please configure Simplenote settings")
-            raise Exception("Missing username or password")
-        return Simplenote(password, password)
+        if Note._API is None:
+            settings = snapshot()
+            if not settings.username or not settings.password:
+                logger.info("Missing username or password, Please configure Simplenote settings")
+                raise Exception("Missing username or password")
+            URL.set_base(settings.api_url)
+            Note._API = Simplenote(settings.username, settings.password)
+        return Note._API
+
+    @staticmethod
+    def reset_api():
+        """Drop the cached client, the next `Note.API` access reads the credentials again"""
+        Note._API = None
 
     @classmethod
-    def index(cls, limit: int = 1000, data: bool = True) -> List["Note"]:
-        status, msg, result = cls.API.index(limit, data)
+    def _index(
+        cls, limit: int, data: bool, on_entry: Optional[Callable[[Dict[str, Any]], Any]] = None
+    ) -> Dict[str, Any]:
+        status, msg, result = cls.API.index(limit, data, on_entry=on_entry)
         assert status == 0, msg
         assert isinstance(result, dict)
         assert "index" in result
-        _notes = result.get("index", [])
-        assert isinstance(_notes, list)
-        return [Note(**note) for note in _notes]
+        assert isinstance(result.get("index", []), list)
+        Note.cv = result.get("current", Note.cv)
+        return result
+
+    @classmethod
+    def index(cls, limit: int = 1000, data: bool = True) -> List["Note"]:
+        _notes = cls._index(limit, data).get("index", [])
+        with trace.span("Note.construct", notes=len(_notes)):
+            return [Note.upsert(**note) for note in _notes]
+
+    @classmethod
+    def sync_index(cls, limit: int = 1000, data: bool = True) -> IndexDiff:
+        """Fetch the index and apply only what changed since the previous one.
+
+        Entries are applied one by one while the body is received. If the transfer fails
+        half way, the notes applied so far are returned so they still reach the views.
+        """
+        diff = IndexDiff([], [], [])
+        seen: Set[str] = set()
+        try:
+            result = cls._index(limit, data, on_entry=lambda entry: cls._diff_entry(entry, diff, seen))
+        except Exception as err:
+            if not diff.changes:
+                raise
+            logger.warning("Index interrupted after %s notes: %s" % (len(seen), err))
+            return diff
+        # Without a `mark` the index lists every note, the ones missing from it were deleted
+        if "mark" not in result:
+            diff.deleted.extend(cls._forget_missing(seen))
+        return diff
+
+    @classmethod
+    def plan_index(cls, limit: int = 1000) -> IndexPlan:
+        """Fetch the index without note data, returns the ids whose server version is newer than the local one.
+
+        Nothing is built from the entries, the notes to retrieve keep their local version
+        until they are. Notes missing from a complete index are forgotten like `sync_index` does.
+        """
+        plan = IndexPlan([], [], [])
+        seen: Set[str] = set()
+
+        def on_entry(entry: Dict[str, Any]):
+            note_id = entry.get("id", "")
+            seen.add(note_id)
+            local = Note.mapper_id_note.get(note_id)
+            if local is None:
+                plan.added.append(note_id)
+            elif entry.get("v", 0) > local.v:
+                plan.stale.append(note_id)
+
+        result = cls._index(limit, False, on_entry=on_entry)
+        if "mark" not in result:
+            plan.deleted.extend(cls._forget_missing(seen))
+        return plan
+
+    @classmethod
+    def diff(cls, entries: List[Dict[str, Any]], complete: bool = False) -> IndexDiff:
+        """Compare index entries with the local versions, only new and re-versioned notes are built"""
+        diff = IndexDiff([], [], [])
+        with trace.span("Note.diff", notes=len(entries)):
+            seen: Set[str] = set()
+            for entry in entries:
+                cls._diff_entry(entry, diff, seen)
+            if complete:
+                diff.deleted.extend(cls._forget_missing(seen))
+        return diff
+
+    @classmethod
+    def _diff_entry(cls, entry: Dict[str, Any], diff: IndexDiff, seen: Set[str]):
+        note_id = entry.get("id", "")
+        seen.add(note_id)
+        local = Note.mapper_id_note.get(note_id)
+        if local is None:
+            diff.added.append(Note(**entry))
+        elif local.v != entry.get("v"):
+            local.update(entry.get("v", 0), entry.get("d", {}))
+            diff.changed.append(local)
+
+    @classmethod
+    def _forget_missing(cls, seen: Set[str]) -> List["Note"]:
+        # Version 0 notes were created here and are not uploaded yet
+        missing = [note_id for note_id, note in Note.mapper_id_note.items() if note_id not in seen and note.v]
+        return [note for note in map(cls.forget, missing) if note is not None]
+
+    @classmethod
+    def forget(cls, note_id: str) -> Optional["Note"]:
+        """Drop a note from the identity map and the tree, returns it"""
+        note = Note.mapper_id_note.pop(note_id, None)
+        if note is not None:
+            Note.tree.remove(note.d.modificationDate)
+        return note
+
+    @classmethod
+    def apply_changes(cls, changes: List[Dict[str, Any]]) -> Tuple[List["Note"], List["Note"]]:
+        """Apply change objects of the change feed, returns the updated and the removed notes"""
+        updated: List[Note] = []
+        removed: List[Note] = []
+        for change in changes:
+            note_id = change.get("id")
+            if change.get("o") == "-":
+                note = cls.forget(note_id)
+                if note is not None:
+                    removed.append(note)
+            elif isinstance(change.get("d"), dict):
+                updated.append(Note.upsert(id=note_id, v=change.get("ev", 0), d=change["d"]))
+            Note.cv = change.get("cv", Note.cv)
+        return updated, removed
 
     @classmethod
     def retrieve(cls, note_id: str) -> "Note":
         status, msg, _note = cls.API.retrieve(note_id)
         assert status == 0, msg
         assert isinstance(_note, dict)
-        return Note(**_note)
+        return Note.upsert(**_note)
 
     def create(self) -> "Note":
         status, msg, _note = self.API.modify(self.d._nest_dict(), self.id)
@@ -182,7 +387,7 @@ class Note:
         status, msg, _note = self.API.modify(self.d._nest_dict(), self.id, version)
         assert status == 0, msg
         assert isinstance(_note, dict)
-        self = Note(**_note)
+        self = Note.upsert(confirmed=True, **_note)
         return self
 
     @classmethod
@@ -203,22 +408,46 @@ class Note:
         status, msg, _note = self.API.modify(self.d._nest_dict(), self.id)
         assert status == 0, "Error deleting note"
         assert isinstance(_note, dict)
-        self = Note(**_note)
+        self = Note.upsert(**_note)
         return self
 
     def delete(self) -> "Note":
         status, msg, _note = self.API.delete(self.id)
         assert status == 0, "Error deleting note"
         assert isinstance(_note, dict)
-        self = Note(**_note)
+        self = Note.upsert(**_note)
         return self
 
+    def merge(self, local: str, prefer: Optional[str] = None) -> MergeResult:
+        """Three-way merge local edits into the note content.
+
+        `_base` is the last server content synced locally and acts as the base, `d.content`
+        holds the remote side. The merged result replaces `d.content`, ready to be uploaded
+        once with `modify`, and the remote side becomes the base of the next merge.
+        """
+        remote = self.d.content
+        result = merge3(self._base, local, remote, prefer=prefer)
+        self._base_v, self._base = self.v, remote
+        self.content = result.content
+        return result
+
+    def discard(self):
+        """Drop the pending local edit, the remote content in `d.content` wins"""
+        self._pending, self._local = False, None
+
+    @property
+    def remote_changed(self) -> bool:
+        """The server moved past the version local edits are based on"""
+        return self.v > self._base_v
+
     @property
     def need_flush(self) -> bool:
         return self._content != self.d.content
 
     def flush(self):
         self._content = self.d.content
+        if not self._pending:
+            self._base_v, self._base = self.v, self.d.content
 
     @property
     def content(self) -> str:
@@ -227,6 +456,7 @@ class Note:
     @content.setter
     def content(self, value: str):
         self.d.content = value
+        self._pending, self._local = True, None
 
     @property
     def _title(self):
@@ -266,21 +496,21 @@ class Note:
         return filename
 
     @staticmethod
-    def get_filename(id: str, title: str) -> str:
-        title_extension_map: List[Dict[str, str]] = get_settings("title_extension_map")
-        if not isinstance(title_extension_map, list):
-            logger.info(
-                "`title_extension_map` must be a list. Please check settings file: %s." % SIMPLENOTE_SETTINGS_FILE
-            )
+    def get_title_extensions() -> List[Tuple[Pattern[str], str]]:
+        """`title_extension_map` as (pattern, extension) pairs, compiled once per settings change"""
+        return snapshot().title_extensions
+
+    @staticmethod
+    def get_filename(id: str, title: str, title_extensions: Optional[List[Tuple[Pattern[str], str]]] = None) -> str:
+        if title_extensions is None:
+            title_extensions = Note.get_title_extensions()
         base = "".join(c for c in title if c in VALID_CHARS)
         # Determine extension based on title
         extension = ""
-        if title_extension_map:
-            for item in title_extension_map:
-                pattern = re.compile(item["title_regex"], re.UNICODE)
-                if re.search(pattern, title):
-                    extension = "." + item["extension"]
-                    break
+        for pattern, _extension in title_extensions:
+            if pattern.search(title):
+                extension = "." + _extension
+                break
         return base + " (" + id + ")" + extension
 
     @property
@@ -296,13 +526,13 @@ class Note:
         return os.path.join(SIMPLENOTE_NOTES_DIR, filename)
 
     @staticmethod
-    def write_content_to_path(filepath: str, content: str = ""):
-        with open(filepath, "wb") as f:
-            try:
-                f.write(content.encode("utf-8"))
-            except Exception as err:
-                logger.exception(err)
-                raise err
+    @trace.traced("Note.write")
+    def write_content_to_path(filepath: str, content: str = "") -> bool:
+        try:
+            return WRITER.write(filepath, content.encode("utf-8"))
+        except Exception as err:
+            logger.exception(err)
+            raise err
 
     # @classmethod
     # def _open(cls, filepath: str):
@@ -316,10 +546,22 @@ class Note:
         self.write_content_to_path(filepath, self.content)
         return filepath
 
+    def open_async(self) -> Future:
+        """Like `open`, on the background writer thread, the future resolves to whether the file was written"""
+        return WRITER.schedule(self.write_content_to_path, self.filepath, self.content)
+
+    @staticmethod
+    def _move(src: str, dst: str):
+        try:
+            WRITER.move(src, dst)
+        except FileNotFoundError as err:
+            logger.debug(err)
+
     @staticmethod
     def _close(filepath: str):
         if not filepath:
             return
+        WRITER.forget(filepath)
         try:
             os.remove(filepath)
         except (OSError, FileNotFoundError) as err:
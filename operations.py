@@ -1,11 +1,17 @@
 from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
 import logging
-from threading import Event, Lock, Semaphore, Thread
-from typing import Any, Callable, Dict, List, Optional
+from threading import Event, Lock, Thread
+from typing import Any, Callable, ClassVar, Dict, List, NamedTuple, Optional, Tuple, Union
 
 import sublime
 
-from models import Note
+from models import IndexDiff, Note
+from utils import metrics, trace
+from utils.journal import Journal
+from utils.logger import structured
+from utils.merge import MergeResult, merge3
 from utils.patterns.singleton.base import Singleton
 from utils.sublime import remove_status, show_message
 
@@ -17,6 +23,12 @@ __all__ = [
     "NoteUpdater",
     "NoteDeleter",
     "MultipleNoteDownloader",
+    "MultipleNoteModifier",
+    "BulkResult",
+    "JournalReplayer",
+    "ReplayResult",
+    "ChangeApplier",
+    "ChangeFeed",
     "OperationManager",
 ]
 
@@ -28,6 +40,12 @@ class Operation(Thread):
     callback_kwargs: Dict[str, Any]
     exception_callback: Optional[Callable[..., Any]]
 
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # Time the body of every operation
+        if "run" in cls.__dict__:
+            cls.run = metrics.timed("operation.%s" % cls.__name__)(cls.run)  # type: ignore
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.callback = None
@@ -51,23 +69,89 @@ class Operation(Thread):
             elif self.exception_callback:
                 self.exception_callback(self.result)
             else:
-                logger.debug(str(self.result))
+                structured.debug(logger, "operation failed", operation=self.__class__.__name__, error=self.result)
+
+
+class _VersionConflict(IOError):
+    """The server holds a newer version than the one the change is based on"""
+
+
+def _modify(api, note_id: str, body: Dict[str, Any], version: Optional[int] = None) -> Dict[str, Any]:
+    status, msg, payload = api.modify(body, note_id, version)
+    if status != 0:
+        if getattr(msg, "code", None) == 412:
+            raise _VersionConflict(msg)
+        raise IOError(msg)
+    return payload
+
+
+def _retrieve(api, note_id: str) -> Dict[str, Any]:
+    status, msg, payload = api.retrieve(note_id)
+    if status != 0:
+        raise IOError(msg)
+    return payload
+
+
+def _retrieve_notes(api, note_ids: List[str], max_workers: int) -> Tuple[List[Note], List[Tuple[str, Exception]]]:
+    """Retrieve notes through a bounded pool, returns the notes and the failed ids"""
+    retrieved: List[Note] = []
+    failed: List[Tuple[str, Exception]] = []
+    if not note_ids:
+        return retrieved, failed
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(_retrieve, api, note_id): note_id for note_id in note_ids}
+        # Update notes on this thread only, `Note.tree` is not thread safe
+        for future in as_completed(futures):
+            try:
+                retrieved.append(Note.upsert(**future.result()))
+            except Exception as err:
+                failed.append((futures[future], err))
+    return retrieved, failed
 
 
 class NotesIndicator(Operation):
+    """Sync the notes with the index.
 
-    def __init__(self, *args, sync_note_number: int = 1000, **kwargs):
+    Once notes are known locally, the index is fetched without data and only the notes at a
+    newer version on the server are retrieved, an unchanged account costs one small request.
+    The first sync, or one with more than `max_retrievals` stale notes, fetches the index with data.
+    """
+
+    def __init__(self, *args, sync_note_number: int = 1000, max_workers: int = 9, max_retrievals: int = 100, **kwargs):
         super().__init__(*args, **kwargs)
         self.sync_note_number = sync_note_number
+        self.max_workers = max_workers
+        self.max_retrievals = max_retrievals
 
+    @trace.traced("NotesIndicator.run")
     def run(self):
         try:
-            result: List[Note] = Note.index(limit=self.sync_note_number, data=True)
+            if Note.mapper_id_note:
+                result = self.sync_selective()
+            else:
+                result = Note.sync_index(limit=self.sync_note_number, data=True)
             self.result = result
         except Exception as err:
             logger.exception(err)
             self.result = err
 
+    def sync_selective(self) -> IndexDiff:
+        plan = Note.plan_index(limit=self.sync_note_number)
+        if len(plan.retrieve) > self.max_retrievals:
+            # One index with data costs less than that many requests
+            diff = Note.sync_index(limit=self.sync_note_number, data=True)
+            return IndexDiff(diff.added, diff.changed, plan.deleted + diff.deleted)
+        retrieved, failed = _retrieve_notes(Note.API, plan.retrieve, self.max_workers)
+        for note_id, err in failed:
+            # Still stale locally, the next sync retrieves it again
+            logger.warning(("Retrieve failed", note_id, err))
+        added = set(plan.added)
+        return IndexDiff(
+            [note for note in retrieved if note.id in added],
+            [note for note in retrieved if note.id not in added],
+            plan.deleted,
+        )
+
 
 class NoteCreator(Operation):
 
@@ -83,14 +167,20 @@ class NoteCreator(Operation):
 
 class NoteUpdater(Operation):
 
-    def __init__(self, *args, note: Optional[Note] = None, **kwargs):
+    def __init__(self, *args, note: Optional[Note] = None, journal: Optional[Journal] = None, **kwargs):
         super().__init__(*args, **kwargs)
         assert isinstance(note, Note)
         self.note: Note = note
+        self.journal = journal
 
     def run(self):
         try:
+            seq = 0
+            if self.journal is not None:
+                seq = self.journal.append(self.note.id, self.note._base_v, self.note._base, self.note.d._nest_dict())
             note: Note = self.note.modify()
+            if self.journal is not None:
+                self.journal.commit(note.id, seq)
             self.result = note
         except Exception as err:
             logger.exception(err)
@@ -112,44 +202,276 @@ class NoteDeleter(Operation):
 
 
 class MultipleNoteDownloader(Operation):
+    """Retrieve notes, given as notes or ids, through a bounded pool of concurrent requests"""
 
-    def __init__(self, notes: List[Note], *args, semaphore: int = 9, **kwargs):
+    def __init__(self, notes: List[Union[Note, str]], *args, semaphore: int = 9, **kwargs):
         super().__init__(*args, **kwargs)
         self.semaphore = semaphore
+        self.note_ids: List[str] = [note.id if isinstance(note, Note) else note for note in notes]
+
+    def run(self):
+        try:
+            retrieved, failed = _retrieve_notes(Note.API, self.note_ids, self.semaphore)
+        except Exception as err:
+            logger.exception(err)
+            self.result = err
+            return
+        if failed:
+            self.result = failed[0][1]
+            return
+        self.result = retrieved
+
+
+class BulkResult(NamedTuple):
+    succeeded: List[Note]
+    failed: List[Tuple[Note, Exception]]
+
+
+class MultipleNoteModifier(Operation):
+    """Apply one action to a set of notes through a bounded pool of concurrent requests.
+
+    Each note costs a single `modify` request holding only the changed field, on top of the
+    local version. If the server moved past it, the action is applied again to the latest
+    version. Notes already in the wanted state cost nothing. Failures are collected instead
+    of aborting the batch.
+    """
+
+    actions = ("trash", "restore", "tag", "untag")
+
+    def __init__(self, notes: List[Note], *args, action: str = "trash", tag: str = "", max_workers: int = 9, **kwargs):
+        super().__init__(*args, **kwargs)
+        assert action in self.actions, "Invalid action %s, expected one of %s" % (action, self.actions)
+        assert action not in ("tag", "untag") or tag, "Action %s needs a tag" % action
         self.notes: List[Note] = notes
+        self.action = action
+        self.tag = tag
+        self.max_workers = max_workers
+        self.done = 0
+
+    @property
+    def progress(self) -> str:
+        return "%s/%s" % (self.done, len(self.notes))
+
+    def body(self, d: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Return the fields the action changes in the note data `d`, or `None` if the note is already up to date"""
+        if self.action in ("trash", "restore"):
+            deleted = self.action == "trash"
+            if d.get("deleted", False) == deleted:
+                return None
+            return {"deleted": deleted}
+        tags = d.get("tags", [])
+        if self.action == "tag":
+            if self.tag in tags:
+                return None
+            return {"tags": tags + [self.tag]}
+        if self.tag not in tags:
+            return None
+        return {"tags": [tag for tag in tags if tag != self.tag]}
+
+    def apply(self, api, note_id: str, version: Optional[int], body: Dict[str, Any]) -> Dict[str, Any]:
+        """Upload `body` on top of `version`, once more on top of the latest version if the server moved"""
+        try:
+            return _modify(api, note_id, body, version)
+        except _VersionConflict:
+            latest = _retrieve(api, note_id)
+            latest_body = self.body(latest["d"])
+            if latest_body is None:
+                return latest
+            return _modify(api, note_id, latest_body, latest["v"])
+
+    def run(self):
+        succeeded: List[Note] = []
+        failed: List[Tuple[Note, Exception]] = []
+        try:
+            api = Note.API
+        except Exception as err:
+            logger.exception(err)
+            self.result = err
+            return
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {}
+            for note in self.notes:
+                body = self.body(note.d._nest_dict())
+                if body is None:
+                    succeeded.append(note)
+                    self.done += 1
+                    continue
+                # Only the changed field is sent, on top of the local version: a newer server copy is not overwritten
+                futures[executor.submit(self.apply, api, note.id, note.v or None, body)] = note
+            # Update notes on this thread only, `Note.tree` is not thread safe
+            for future in as_completed(futures):
+                note = futures[future]
+                try:
+                    succeeded.append(Note.upsert(**future.result()))
+                except Exception as err:
+                    failed.append((note, err))
+                self.done += 1
+        self.result = BulkResult(succeeded, failed)
+
+
+class ReplayResult(NamedTuple):
+    uploaded: List[Note]
+    # Changes left in the journal, their merge with the server content still has conflicts
+    conflicted: List[Tuple[Note, MergeResult]]
+
+
+class JournalReplayer(Operation):
+    """Upload the changes left in the journal, coalesced to one request per note.
+
+    Each change is sent on top of the version it was made on, holding only the content, so
+    tags and flags changed on the server meanwhile are kept. If the server moved past it, the
+    change is merged into the latest version and sent again. Conflicting merges are never
+    uploaded, they are reported once and wait in the journal until the note is saved again.
+    """
+
+    # Note ID -> journal seq of the waiting change whose conflict was already reported
+    reported: ClassVar[Dict[str, int]] = {}
+
+    def __init__(self, journal: Journal, *args, prefer: Optional[str] = None, max_workers: int = 9, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.journal = journal
+        self.prefer = prefer
+        self.max_workers = max_workers
+
+    @classmethod
+    def pending(cls, journal: Journal) -> List[Dict[str, Any]]:
+        """The journal entries left to replay, without the conflicts already reported"""
+        return [entry for entry in journal.pending() if cls.reported.get(entry["id"]) != entry["seq"]]
+
+    def upload(self, api, entry: Dict[str, Any]) -> Tuple[Dict[str, Any], Optional[MergeResult]]:
+        """Upload the change of `entry`, merged into the latest version if the server moved.
+
+        Returns the server payload and the merge result, if any. On conflicts the payload is
+        the latest version, untouched.
+        """
+        if not entry["v"]:
+            # Never uploaded, every field is local
+            return _modify(api, entry["id"], dict(entry["d"])), None
+        content = entry["d"].get("content", "")
+        try:
+            return _modify(api, entry["id"], {"content": content}, entry["v"]), None
+        except _VersionConflict:
+            latest = _retrieve(api, entry["id"])
+        merged = merge3(entry["base"], content, latest["d"].get("content", ""), prefer=self.prefer)
+        if merged.conflicts:
+            return latest, merged
+        return _modify(api, entry["id"], {"content": merged.content}, latest["v"]), merged
+
+    def run(self):
+        entries = self.pending(self.journal)
+        uploaded: List[Note] = []
+        conflicted: List[Tuple[Note, MergeResult]] = []
+        try:
+            api = Note.API
+        except Exception as err:
+            logger.exception(err)
+            self.result = err
+            return
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(self.upload, api, entry): entry for entry in entries}
+            for future in as_completed(futures):
+                entry = futures[future]
+                try:
+                    payload, merged = future.result()
+                except Exception as err:
+                    logger.warning(("Journal replay failed, keeping the change", entry["id"], err))
+                    continue
+                if merged is not None and merged.conflicts:
+                    # Never upload conflict markers, the change stays until the note is saved again
+                    self.reported[entry["id"]] = entry["seq"]
+                    conflicted.append((Note.upsert(**payload), merged))
+                    continue
+                uploaded.append(Note.upsert(confirmed=True, **payload))
+                self.journal.commit(entry["id"], entry["seq"])
+        self.journal.compact()
+        logger.info("Journal replayed %s/%s notes, %s conflicted" % (len(uploaded), len(entries), len(conflicted)))
+        self.result = ReplayResult(uploaded, conflicted)
+
+
+class ChangeApplier(Operation):
+    """Apply a batch of the change feed, queued so notes are only changed by one operation at a time"""
+
+    def __init__(self, changes: List[Dict[str, Any]], *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.changes = changes
+
+    def run(self):
+        try:
+            self.result = Note.apply_changes(self.changes)
+        except Exception as err:
+            logger.exception(err)
+            self.result = err
+
+
+class ChangeFeed(Thread):
+    """Long-poll the changes made after `Note.cv` and apply them as they come.
+
+    Unlike operations, the feed runs for as long as the plugin does and is not queued.
+    It only fetches: each batch is applied by a `ChangeApplier` queued from the main
+    thread, then `callback(updated, removed)` runs on the main thread. While the server
+    is unreachable `connected` is False and the feed retries with a growing delay.
+    """
+
+    MAX_RETRY_DELAY = 60
+
+    def __init__(self, callback: Optional[Callable[[List[Note], List[Note]], Any]] = None):
+        super().__init__(name="SimplenoteChangeFeed", daemon=True)
+        self.callback = callback
+        self.connected = False
+        # Change version of the last fetched batch, ahead of `Note.cv` until the batch is applied
+        self.cv = ""
+        self._stop_event = Event()
+
+    def stop(self):
+        self._stop_event.set()
+
+    @property
+    def stopped(self) -> bool:
+        return self._stop_event.is_set()
 
     def run(self):
-        sem = Semaphore(self.semaphore)
-        done_event = Event()
-
-        def note_retriever(note_id: str, results: List[Note]):
-            with sem:
-                note = Note.retrieve(note_id)
-                results.append(note)
-                done_event.set()
-
-        threads: List[Thread] = []
-        results: List[Note] = []
-        for note in self.notes:
-            assert isinstance(note, Note)
-            assert isinstance(note.id, str)
-            new_thread = Thread(
-                target=note_retriever,
-                args=(
-                    note.id,
-                    results,
-                ),
-            )
-            threads.append(new_thread)
-            new_thread.start()
-
-        _ = [th.join() for th in threads]
-
-        for result in results:
-            if isinstance(result, Exception):
-                self.result = result
-                return
-        self.result = results
+        retry_delay = 1
+        while not self.stopped:
+            cv = self.cv or Note.cv
+            if not cv:
+                # Starts from the first index
+                self._stop_event.wait(1)
+                continue
+            try:
+                status, msg, changes = Note.API.changes(cv)
+            except Exception as err:
+                status, msg, changes = -1, err, []
+            if self.stopped:
+                break
+            if status != 0:
+                if self.connected:
+                    logger.info("Change feed disconnected: %s" % msg)
+                self.connected = False
+                metrics.counter("feed.errors").inc()
+                self._stop_event.wait(retry_delay)
+                retry_delay = min(retry_delay * 2, self.MAX_RETRY_DELAY)
+                continue
+            self.connected = True
+            retry_delay = 1
+            if not changes:
+                continue
+            metrics.counter("feed.changes").inc(len(changes))
+            self.cv = next((change["cv"] for change in reversed(changes) if change.get("cv")), cv)
+            sublime.set_timeout(partial(self.apply, changes), 0)
+
+    def apply(self, changes: List[Dict[str, Any]]):
+        """Queue a fetched batch, on the main thread"""
+        applier = ChangeApplier(changes)
+        applier.set_callback(self.on_applied)
+        OperationManager().add_operation(applier)
+
+    def on_applied(self, result: Tuple[List[Note], List[Note]]):
+        updated, removed = result
+        structured.debug(logger, "changes", updated=len(updated), removed=len(removed))
+        if self.callback is not None and (updated or removed):
+            self.callback(updated, removed)
 
 
 class OperationManager(Singleton):
@@ -178,6 +500,7 @@ class OperationManager(Singleton):
 
     def add_operation(self, operation: Operation):
         self.operations.append(operation)
+        metrics.gauge("operations.queued").set(len(self.operations))
         if not self.running:
             self.run()
 
@@ -189,6 +512,9 @@ class OperationManager(Singleton):
         # If it's still running, update the status
         if self.current_operation.is_alive():
             text = "Simplenote: %s staring" % self.current_operation.__class__.__name__
+            progress = getattr(self.current_operation, "progress", "")
+            if progress:
+                text = "%s %s" % (text, progress)
         else:
             # If not running, show finished text call callback with result and do the next operation
             text = "Simplenote: %s finished" % self.current_operation.__class__.__name__
@@ -210,5 +536,6 @@ class OperationManager(Singleton):
 
     def start_next_operation(self):
         self.current_operation = self.operations.popleft()
+        metrics.gauge("operations.queued").set(len(self.operations))
         logger.info(self.current_operation.__class__.__name__)
         self.current_operation.start()
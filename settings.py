@@ -1,26 +1,191 @@
+"""
+Plugin settings, read once into a `Snapshot`.
+
+`snapshot()` loads the settings on first use and registers an `add_on_change` callback,
+so each edit of the settings file replaces the snapshot instead of every caller going
+through `Settings.get`. Values are validated and derived values precomputed: hot paths
+read plain attributes, e.g. `snapshot().title_extensions`.
+"""
+
+import logging
+import re
+from typing import Any, Callable, Dict, List, Optional, Pattern, Tuple
+
+
+__all__ = [
+    "SIMPLENOTE_SETTINGS_FILE",
+    "Snapshot",
+    "snapshot",
+    "refresh",
+    "add_listener",
+    "remove_listener",
+    "reset",
+    "get_settings",
+]
+
+
+logger = logging.getLogger()
+
+
+SIMPLENOTE_SETTINGS_FILE = "simplenote.sublime-settings"
+# `add_on_change` tag of the settings object
+_ON_CHANGE_TAG = "simplenote_snapshot"
+
 SETTINGS = None
+_SNAPSHOT: Optional["Snapshot"] = None
+# tag -> callback(old, new), run after every refresh
+_LISTENERS: Dict[str, Callable[[Optional["Snapshot"], "Snapshot"], Any]] = {}
 
+_KIND_NAMES = {str: "a string", int: "an integer", bool: "true or false"}
 
-# def init_settings(reload_if_needed: Optional(Callable) = None):
-#     global SETTINGS
-#     if SETTINGS is None:
-#         SETTINGS = sublime.load_settings("simplenote.sublime-settings")
-#         # logger.debug(("SETTINGS.__dict__: ", SETTINGS.__dict__))
-#         # logger.debug(("SETTINGS.username: ", SETTINGS.get("username")))
-#     if reload_if_needed:
-#         SETTINGS.clear_on_change("username")
-#         SETTINGS.clear_on_change("password")
-#         SETTINGS.add_on_change("username", reload_if_needed)
-#         SETTINGS.add_on_change("password", reload_if_needed)
 
+class Snapshot:
+    """Validated settings values, invalid ones are replaced by their default and reported in `errors`"""
 
-def get_settings(key: str, default=None):
+    __slots__ = (
+        "raw",
+        "errors",
+        "username",
+        "password",
+        "api_url",
+        "autostart",
+        "sync_every",
+        "sync_every_max",
+        "sync_idle_pause",
+        "sync_note_number",
+        "bulk_concurrency",
+        "change_feed",
+        "trace_sync",
+        "conflict_preference",
+        "autosave_debounce_ms",
+        "status_interval",
+        "title_extensions",
+    )
+
+    def __init__(self, raw: Dict[str, Any]):
+        self.raw = raw
+        self.errors: List[str] = []
+        self.username: str = self._get("username", str, "")
+        self.password: str = self._get("password", str, "")
+        self.api_url: str = self._get("api_url", str, "")
+        self.autostart: bool = bool(raw.get("autostart", False))
+        self.sync_every: int = self._get("sync_every", int, 0)
+        self.sync_every_max: int = self._get("sync_every_max", int, 600)
+        self.sync_idle_pause: int = self._get("sync_idle_pause", int, 0)
+        self.sync_note_number: int = self._get("sync_note_number", int, 1000)
+        self.bulk_concurrency: int = self._get("bulk_concurrency", int, 9, minimum=1)
+        self.change_feed: bool = self._get("change_feed", bool, True)
+        self.trace_sync: bool = self._get("trace_sync", bool, False)
+        # Side winning conflicting hunks of a three-way merge
+        self.conflict_preference: Optional[str] = None
+        if self._get("on_conflict_use_server", bool, False):
+            self.conflict_preference = "remote"
+        elif self._get("on_conflict_leave_alone", bool, False):
+            self.conflict_preference = "local"
+        self.autosave_debounce_ms: int = self._get("autosave_debounce_time", int, 1) * 1000
+        # Seconds between two status bar updates
+        self.status_interval: float = self._get("status_refresh_ms", int, 250, minimum=0) / 1000
+        self.title_extensions: List[Tuple[Pattern[str], str]] = self._title_extensions()
+
+    def _get(self, key: str, kind: type, default: Any, minimum: Optional[int] = None) -> Any:
+        value = self.raw.get(key, default)
+        # bool is an int, but `"sync_every": true` is a mistake
+        valid = isinstance(value, kind) and (kind is bool or not isinstance(value, bool))
+        if valid and minimum is not None and value < minimum:
+            valid = False
+        if not valid:
+            self.errors.append("`%s` must be %s, got %r" % (key, _KIND_NAMES.get(kind, kind.__name__), value))
+            return default
+        return value
+
+    def _title_extensions(self) -> List[Tuple[Pattern[str], str]]:
+        title_extension_map = self.raw.get("title_extension_map", [])
+        if not isinstance(title_extension_map, list):
+            self.errors.append("`title_extension_map` must be a list")
+            return []
+        title_extensions = []
+        for item in title_extension_map:
+            try:
+                title_extensions.append((re.compile(item["title_regex"], re.UNICODE), item["extension"]))
+            except (KeyError, TypeError, re.error) as err:
+                self.errors.append("Invalid `title_extension_map` item %r: %s" % (item, err))
+        return title_extensions
+
+    @property
+    def credentials(self) -> Tuple[str, str, str]:
+        return self.username, self.password, self.api_url
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self.raw.get(key, default)
+
+
+def _load():
     global SETTINGS
     if SETTINGS is None:
         import sublime
 
-        SETTINGS = sublime.load_settings("simplenote.sublime-settings")
-    return SETTINGS.get(key, default)
+        SETTINGS = sublime.load_settings(SIMPLENOTE_SETTINGS_FILE)
+        SETTINGS.clear_on_change(_ON_CHANGE_TAG)
+        SETTINGS.add_on_change(_ON_CHANGE_TAG, refresh)
+    return SETTINGS
+
+
+# Read one by one where `Settings.to_dict` is missing, before build 4078
+_KEYS = (
+    "username password api_url autostart sync_every sync_every_max sync_idle_pause sync_note_number "
+    "bulk_concurrency change_feed trace_sync on_conflict_use_server on_conflict_leave_alone "
+    "autosave_debounce_time status_refresh_ms title_extension_map note_syntax"
+).split()
+
+
+def _read(settings) -> Dict[str, Any]:
+    to_dict = getattr(settings, "to_dict", None)
+    if to_dict is not None:
+        return to_dict()
+    return {key: settings.get(key) for key in _KEYS if settings.has(key)}
+
+
+def refresh() -> Snapshot:
+    """Build a new snapshot from the settings, then notify the listeners"""
+    global _SNAPSHOT
+    old, new = _SNAPSHOT, Snapshot(_read(_load()))
+    _SNAPSHOT = new
+    for error in new.errors:
+        logger.warning("%s. Please check settings file: %s" % (error, SIMPLENOTE_SETTINGS_FILE))
+    for callback in list(_LISTENERS.values()):
+        try:
+            callback(old, new)
+        except Exception as err:
+            logger.exception(err)
+    return new
+
+
+def snapshot() -> Snapshot:
+    """The current settings, loaded on first use"""
+    return _SNAPSHOT or refresh()
+
+
+def add_listener(tag: str, callback: Callable[[Optional[Snapshot], Snapshot], Any]):
+    """Run `callback(old, new)` after every refresh, replacing the callback registered under `tag`"""
+    _LISTENERS[tag] = callback
+
+
+def remove_listener(tag: str):
+    _LISTENERS.pop(tag, None)
+
+
+def reset():
+    """Forget the settings object and the snapshot, the next `snapshot()` loads them again"""
+    global SETTINGS, _SNAPSHOT
+    if SETTINGS is not None:
+        SETTINGS.clear_on_change(_ON_CHANGE_TAG)
+    SETTINGS = None
+    _SNAPSHOT = None
+
+
+def get_settings(key: str, default=None):
+    """The raw value of `key` in the current snapshot"""
+    return snapshot().raw.get(key, default)
 
 
 # Settings = type(
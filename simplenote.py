@@ -1,25 +1,35 @@
 from datetime import datetime
-from functools import partial
+from functools import lru_cache, partial
 import logging
 import os
 import pickle
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional, Set
 
 # https://www.sublimetext.com/docs/api_reference.html
 import sublime
 
-from models import SIMPLENOTE_NOTES_DIR, Note
+from models import SIMPLENOTE_NOTES_DIR, WRITER, Note
+from settings import snapshot
+from utils import trace
+from utils.fs import remove_orphans
+from utils.journal import Journal
 from utils.patterns.singleton.base import Singleton
 from utils.sublime import close_view, open_view
 
 
 __all__: List[str] = [
     "SIMPLENOTE_SETTINGS_FILE",
+    "get_cache_dir",
+    "get_cache_filepath",
+    "get_journal",
     "Local",
     "load_notes",
     "clear_orphaned_filepaths",
     "sort_notes",
     "on_note_changed",
+    "on_note_conflicted",
+    "get_view_content",
+    "get_conflict_preference",
 ]
 
 
@@ -27,12 +37,31 @@ logger = logging.getLogger()
 
 
 SIMPLENOTE_PROJECT_NAME = "Simplenote"
-SIMPLENOTE_CACHE_DIR = os.path.join(sublime.cache_path(), SIMPLENOTE_PROJECT_NAME)
-os.makedirs(SIMPLENOTE_CACHE_DIR, exist_ok=True)
-SIMPLENOTE_NOTE_CACHE_FILE = os.path.join(SIMPLENOTE_CACHE_DIR, "note_cache.pkl")
+SIMPLENOTE_NOTE_CACHE_FILENAME = "note_cache.pkl"
+SIMPLENOTE_JOURNAL_FILENAME = "journal.jsonl"
+# Chrome trace of the last sync, written when `trace_sync` is set
+SIMPLENOTE_TRACE_FILENAME = "sync.trace.json"
 SIMPLENOTE_SETTINGS_FILE = "simplenote.sublime-settings"
 
 
+@lru_cache(maxsize=None)
+def get_cache_dir() -> str:
+    """Resolve (and create) the cache directory on first use, `sublime.cache_path` is not needed at import"""
+    cache_dir = os.path.join(sublime.cache_path(), SIMPLENOTE_PROJECT_NAME)
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+
+def get_cache_filepath(filename: str) -> str:
+    return os.path.join(get_cache_dir(), filename)
+
+
+@lru_cache(maxsize=None)
+def get_journal() -> Journal:
+    """Local changes waiting for upload, replayed after the next successful sync"""
+    return Journal(get_cache_filepath(SIMPLENOTE_JOURNAL_FILENAME))
+
+
 class _BaseManager(Singleton):
     pass
 
@@ -68,7 +97,7 @@ class Local(_BaseManager):
     @classmethod
     def save_objects(cls):
         return
-        cls._save_objects(SIMPLENOTE_NOTE_CACHE_FILE, cls._objects)
+        cls._save_objects(get_cache_filepath(SIMPLENOTE_NOTE_CACHE_FILENAME), cls._objects)
 
     @staticmethod
     def dict_to_model(note: Dict[str, Any]) -> Note:
@@ -89,6 +118,7 @@ class Local(_BaseManager):
 
 
 def load_notes():
+    SIMPLENOTE_NOTE_CACHE_FILE = get_cache_filepath(SIMPLENOTE_NOTE_CACHE_FILENAME)
     try:
         with open(SIMPLENOTE_NOTE_CACHE_FILE, "rb") as cache_file:
             Note.mapper_id_note = pickle.load(cache_file, encoding="utf-8")
@@ -99,13 +129,31 @@ def load_notes():
             logger.debug((f"Created new objects cache file: {SIMPLENOTE_NOTE_CACHE_FILE}"))
 
 
+def _expected_filenames() -> Set[str]:
+    """The file names of the known notes and of the views open in the notes directory"""
+    title_extensions = Note.get_title_extensions()
+    expected = set()
+    for note in list(Note.mapper_id_note.values()):
+        expected.add(note.get_filename(note.id, note._title, title_extensions))
+        expected.add(note.get_filename(note.id, note.title, title_extensions))
+    for window in sublime.windows():
+        for view in window.views():
+            view_filepath = view.file_name()
+            if isinstance(view_filepath, str) and os.path.dirname(view_filepath) == SIMPLENOTE_NOTES_DIR:
+                expected.add(os.path.basename(view_filepath))
+    return expected
+
+
 def clear_orphaned_filepaths():
-    list__filepath = [note.filename for note in Note.mapper_id_note.values()]
-    if not os.path.exists(SIMPLENOTE_NOTES_DIR):
-        os.makedirs(SIMPLENOTE_NOTES_DIR)
-    for filepath in os.listdir(SIMPLENOTE_NOTES_DIR):
-        if filepath not in list__filepath:
-            os.remove(os.path.join(SIMPLENOTE_NOTES_DIR, filepath))
+    """Remove the files of the notes directory that belong to no note, nor to any open view.
+
+    Meant to run on the async thread once the first index filled `Note.mapper_id_note`. Notes
+    and views may change meanwhile, so each file is checked again right before it is removed.
+    """
+    removed = remove_orphans(
+        SIMPLENOTE_NOTES_DIR, _expected_filenames(), keep=lambda filename: filename in _expected_filenames()
+    )
+    logger.debug("Removed %s orphaned note files" % removed)
 
 
 def sort_notes(a_note: Note, b_note: Note):
@@ -119,6 +167,21 @@ def sort_notes(a_note: Note, b_note: Note):
         return (date_a > date_b) - (date_a < date_b)
 
 
+def get_view_content(note: Note) -> Optional[str]:
+    """Return the buffer content of the view showing the note, if any window has it open"""
+    for window in sublime.windows():
+        view = window.find_open_file(note._filepath)
+        if isinstance(view, sublime.View):
+            return view.substr(sublime.Region(0, view.size()))
+    return None
+
+
+def get_conflict_preference() -> Optional[str]:
+    """Map the `on_conflict_*` settings to the side winning conflicting hunks of a three-way merge"""
+    return snapshot().conflict_preference
+
+
+@trace.traced()
 def on_note_changed(note: Note):
     old_window = sublime.active_window()
     old_view = old_window.find_open_file(note._filepath)
@@ -129,10 +192,11 @@ def on_note_changed(note: Note):
 
     if note._filepath == note.filepath:
         note.flush()
-        note.open()
+        note.open_async()
         return
 
-    note._close(note._filepath)
+    # The title changed: rename the file, then only rewrite it if the content differs
+    note._move(note._filepath, note.filepath)
     note.flush()
     close_view(old_view)
     note.open()
@@ -150,4 +214,18 @@ def on_note_changed(note: Note):
         else:
             old_window.focus_view(old_active_view)
 
-    sublime.set_timeout(partial(new_view.run_command, "revert"), 0)
+
+def _revert_views(filepath: str):
+    for window in sublime.windows():
+        view = window.find_open_file(filepath)
+        if isinstance(view, sublime.View):
+            view.run_command("revert")
+
+
+def on_note_conflicted(note: Note):
+    """Show a merge left with conflict markers in the note instead of uploading it, saving it resolved uploads it"""
+    on_note_changed(note)
+    # Written even when no view of the active window shows the note, skipped if already current
+    note.open_async()
+    # Saved or not, the views only hold the local side of the merge, reload them once the file is written
+    WRITER.schedule(sublime.set_timeout, partial(_revert_views, note.filepath), 0)
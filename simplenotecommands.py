@@ -1,16 +1,39 @@
-from functools import cached_property
 import logging
 from threading import Lock
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional
 
 import sublime
 import sublime_plugin
 
-from models import Note
-from operations import NoteCreator, NoteDeleter, NotesIndicator, NoteUpdater, OperationManager
-from settings import get_settings
-from simplenote import clear_orphaned_filepaths, on_note_changed
-from utils.sublime import close_view, open_view, show_message
+from models import WRITER, IndexDiff, Note
+from operations import (
+    BulkResult,
+    ChangeFeed,
+    JournalReplayer,
+    MultipleNoteModifier,
+    NoteCreator,
+    NoteDeleter,
+    NotesIndicator,
+    NoteUpdater,
+    OperationManager,
+    ReplayResult,
+)
+import settings
+from settings import Snapshot, snapshot
+from simplenote import (
+    SIMPLENOTE_TRACE_FILENAME,
+    clear_orphaned_filepaths,
+    get_cache_filepath,
+    get_conflict_preference,
+    get_journal,
+    get_view_content,
+    on_note_changed,
+    on_note_conflicted,
+)
+from utils import metrics, startup, trace
+from utils.logger import init as logger_init
+from utils.scheduler import SyncScheduler
+from utils.sublime import REPORTER, close_view, open_view, show_message, show_panel
 
 
 __all__ = [
@@ -19,10 +42,18 @@ __all__ = [
     "SimplenoteSyncCommand",
     "SimplenoteCreateCommand",
     "SimplenoteDeleteCommand",
+    "SimplenoteBulkCommand",
+    "SimplenoteMetricsCommand",
+    "SimplenoteStartupReportCommand",
+    "SCHEDULER",
+    "CHANGE_FEED",
     "sync",
+    "schedule_sync",
+    "resume_sync",
     "start",
     "reload_if_needed",
     "plugin_loaded",
+    "plugin_unloaded",
 ]
 
 
@@ -31,22 +62,25 @@ logger = logging.getLogger()
 
 SIMPLENOTE_RELOAD_CALLS = -1
 SIMPLENOTE_STARTED = False
+# Seconds before trying again when a sync is due while other operations run
+SYNC_BUSY_RETRY = 5
+SCHEDULER = SyncScheduler()
+# Incremented by `schedule_sync`, only the latest scheduled sync runs
+SYNC_TIMER = 0
+CHANGE_FEED: Optional[ChangeFeed] = None
+# Orphaned note files are only known once an index listed the notes
+ORPHANS_CLEARED = False
 
 
 class SimplenoteViewCommand(sublime_plugin.EventListener):
 
     waiting_to_save: List[Dict[str, Any]] = []
 
-    @cached_property
+    @property
     def autosave_debounce_time(self) -> int:
-        _autosave_debounce_time = get_settings("autosave_debounce_time", default=1)
-        if not isinstance(_autosave_debounce_time, int):
-            show_message(
-                "autosave_debounce_time is not an int: %s, Please check your settings" % type(autosave_debounce_time)
-            )
-            _autosave_debounce_time = 1
-        return _autosave_debounce_time * 1000
+        return snapshot().autosave_debounce_ms
 
+    @metrics.timed("listener.on_close")
     def on_close(self, view: sublime.View):
         """
         A method that handles the closing of a view. Retrieves the file name from the view, gets the corresponding note using the file name, closes the note, removes the '_view' attribute from the note, and logs the note information.
@@ -59,6 +93,7 @@ class SimplenoteViewCommand(sublime_plugin.EventListener):
         assert isinstance(note, Note), "note is not a Note: %s" % type(note)
         # note.close()
 
+    @metrics.timed("listener.on_modified")
     def on_modified(self, view: sublime.View):
 
         def flush_saves():
@@ -83,6 +118,8 @@ class SimplenoteViewCommand(sublime_plugin.EventListener):
         note = Note.get_note_from_filepath(view_filepath)
         if not isinstance(note, Note):
             return
+        SCHEDULER.touch()
+        resume_sync()
 
         found = False
         for entry in SimplenoteViewCommand.waiting_to_save:
@@ -99,6 +136,16 @@ class SimplenoteViewCommand(sublime_plugin.EventListener):
             SimplenoteViewCommand.waiting_to_save.append(new_entry)
         sublime.set_timeout(flush_saves, self.autosave_debounce_time)
 
+    @metrics.timed("listener.on_activated")
+    def on_activated(self, view: sublime.View):
+        SCHEDULER.focus(True)
+        REPORTER.apply(view)
+        resume_sync()
+
+    @metrics.timed("listener.on_deactivated")
+    def on_deactivated(self, view: sublime.View):
+        SCHEDULER.focus(False)
+
     # def on_load(self, view: sublime.View):
     #     note_syntax = get_settings("note_syntax")
     #     if not isinstance(note_syntax, str):
@@ -106,6 +153,7 @@ class SimplenoteViewCommand(sublime_plugin.EventListener):
     #         return
     #     view.set_syntax_file(note_syntax)
 
+    @metrics.timed("listener.on_post_save")
     def on_post_save(self, view: sublime.View):
         view_filepath = view.file_name()
         if not isinstance(view_filepath, str):
@@ -117,8 +165,16 @@ class SimplenoteViewCommand(sublime_plugin.EventListener):
         view_content = view.substr(sublime.Region(0, view.size()))
         if note.d.content == view_content:
             return
-        note.content = view_content
-        note_updater = NoteUpdater(note=note)
+        SCHEDULER.changed()
+        if note.remote_changed:
+            # The server changed the note since the local edits' base, merge instead of overwriting
+            result = note.merge(view_content, prefer=get_conflict_preference())
+            if result.conflicts:
+                on_note_conflicted(note)
+                return
+        else:
+            note.content = view_content
+        note_updater = NoteUpdater(note=note, journal=get_journal())
         note_updater.set_callback(on_note_changed)
         OperationManager().add_operation(note_updater)
 
@@ -160,20 +216,104 @@ class SimplenoteListCommand(sublime_plugin.ApplicationCommand):
 class SimplenoteSyncCommand(sublime_plugin.ApplicationCommand):
 
     def merge_note(self, updated_notes: List[Note]):
+        with trace.span("SimplenoteSyncCommand.merge_note", notes=len(updated_notes)):
+            self._merge_note(updated_notes)
+        self.save_trace()
+
+    @staticmethod
+    def save_trace():
+        """Stop the trace started by `run`, if any, it is saved after the note files already queued are written"""
+        if trace.TRACER.enabled:
+            WRITER.schedule(trace.save, get_cache_filepath(SIMPLENOTE_TRACE_FILENAME))
+
+    def _merge_note(self, updated_notes: List[Note]):
+        prefer = get_conflict_preference()
         for note in updated_notes:
+            if not note.need_flush:
+                continue
+            local_content = get_view_content(note)
+            if local_content is None or local_content == note._content:
+                # Nothing newer in a view, only the pending edit a newer remote version replaced, if any
+                local_content = note._local
+            if local_content is None or local_content == note.d.content:
+                on_note_changed(note)
+                continue
+            # Both sides changed since the last sync
+            if prefer == "remote":
+                note.discard()
+                on_note_changed(note)
+                continue
+            if prefer == "local":
+                logger.info("Conflict left alone: %s" % note.id)
+                continue
+            result = note.merge(local_content)
+            logger.info(("Merged note", note.id, "conflicts:", result.conflicts))
+            if result.conflicts:
+                on_note_conflicted(note)
+                continue
+            note_updater = NoteUpdater(note=note, journal=get_journal())
+            note_updater.set_callback(on_note_changed)
+            OperationManager().add_operation(note_updater)
+
+        journal = get_journal()
+        if JournalReplayer.pending(journal):
+            # Back online, upload what was saved while the previous uploads failed
+            journal_replayer = JournalReplayer(journal, prefer=prefer)
+            journal_replayer.set_callback(self.merge_replayed_notes)
+            OperationManager().add_operation(journal_replayer)
+
+    def merge_replayed_notes(self, result: ReplayResult):
+        for note in result.uploaded:
             if note.need_flush:
                 on_note_changed(note)
+        if result.conflicted:
+            # Shown instead of uploaded, resolving and saving the note replaces the waiting change
+            show_panel(
+                "simplenote_conflicts",
+                "\n\n".join(
+                    "# %s (%s)\n%s" % (note.title, note.id, merged.content) for note, merged in result.conflicted
+                ),
+            )
+            show_message("Simplenote: %s offline changes conflict with the server" % len(result.conflicted))
 
     def run(self):
+        if snapshot().trace_sync:
+            trace.start()
+        with trace.span("SimplenoteSyncCommand.run"):
+            self._run()
+
+    def _run(self):
         show_message(self.__class__.__name__)
-        sync_note_number = get_settings("sync_note_number", 1000)
-        if not isinstance(sync_note_number, int):
-            show_message("`sync_note_number` must be an integer. Please check settings file.")
-            return
-        note_indicator = NotesIndicator(sync_note_number=sync_note_number)
-        note_indicator.set_callback(self.merge_note)
+        settings = snapshot()
+        note_indicator = NotesIndicator(
+            sync_note_number=settings.sync_note_number, max_workers=settings.bulk_concurrency
+        )
+        note_indicator.set_callback(self.on_index)
+        note_indicator.set_exception_callback(self.on_index_failed)
         OperationManager().add_operation(note_indicator)
 
+    def on_index(self, diff: IndexDiff):
+        global ORPHANS_CLEARED
+        SCHEDULER.synced(diff.changes)
+        self.merge_note(diff.updated)
+        remove_notes(diff.deleted)
+        if not ORPHANS_CLEARED:
+            ORPHANS_CLEARED = True
+            sublime.set_timeout_async(clear_orphaned_filepaths, 0)
+        self.schedule_next()
+
+    def on_index_failed(self, err: Exception):
+        logger.debug(("Sync failed", err))
+        self.save_trace()
+        # Offline or failing server, back off as if nothing changed
+        SCHEDULER.synced(0)
+        self.schedule_next()
+
+    @staticmethod
+    def schedule_next():
+        if SIMPLENOTE_STARTED and SCHEDULER.min_interval > 0:
+            schedule_sync(next_sync_interval())
+
 
 class SimplenoteCreateCommand(sublime_plugin.ApplicationCommand):
 
@@ -207,26 +347,181 @@ class SimplenoteDeleteCommand(sublime_plugin.ApplicationCommand):
         OperationManager().add_operation(note_deleter)
 
 
+class SimplenoteBulkCommand(sublime_plugin.ApplicationCommand):
+    """Trash, restore, tag or untag every note of a tag or of a search result"""
+
+    SEARCH_CAPTION = "Search notes..."
+
+    def run(self, action: str = "trash"):
+        if action not in MultipleNoteModifier.actions:
+            show_message("Unknown bulk action: %s" % action)
+            return
+        self.action = action
+        deleted = action == "restore"
+        self.notes: List[Note] = [note for note in Note.mapper_id_note.values() if note.d.deleted == deleted]
+        mapper_tag_notes: Dict[str, List[Note]] = {}
+        for note in self.notes:
+            for tag in note.d.tags:
+                mapper_tag_notes.setdefault(tag, []).append(note)
+        self.note_sets: List[List[Note]] = [[]]
+        captions: List[str] = [self.SEARCH_CAPTION]
+        for tag, notes in sorted(mapper_tag_notes.items()):
+            self.note_sets.append(notes)
+            captions.append("#%s (%s notes)" % (tag, len(notes)))
+
+        sublime.active_window().show_quick_panel(
+            captions,
+            self.on_select,
+            placeholder="Select the notes to %s" % action,
+        )
+
+    def on_select(self, selected_index: int):
+        if selected_index < 0:
+            return
+        if selected_index == 0:
+            sublime.active_window().show_input_panel("Search notes:", "", self.on_search, None, None)
+            return
+        self.on_notes_selected(self.note_sets[selected_index])
+
+    def on_search(self, query: str):
+        query = query.casefold()
+        self.on_notes_selected([note for note in self.notes if query in note.d.content.casefold()])
+
+    def on_notes_selected(self, notes: List[Note]):
+        if not notes:
+            show_message("Simplenote: no notes selected")
+            return
+        self.selected_notes = notes
+        if self.action in ("tag", "untag"):
+            sublime.active_window().show_input_panel("Tag to %s:" % self.action, "", self.submit, None, None)
+            return
+        self.submit("")
+
+    def submit(self, tag: str):
+        tag = tag.strip()
+        if self.action in ("tag", "untag") and not tag:
+            return
+        if not sublime.ok_cancel_dialog("Simplenote: %s %s notes?" % (self.action, len(self.selected_notes))):
+            return
+        max_workers = snapshot().bulk_concurrency
+        note_modifier = MultipleNoteModifier(self.selected_notes, action=self.action, tag=tag, max_workers=max_workers)
+        note_modifier.set_callback(self.handle_result)
+        OperationManager().add_operation(note_modifier)
+
+    def handle_result(self, result: BulkResult):
+        if self.action == "trash":
+            for note in result.succeeded:
+                for window in sublime.windows():
+                    view = window.find_open_file(note.filepath)
+                    if isinstance(view, sublime.View):
+                        close_view(view)
+                note.close()
+        for note, err in result.failed:
+            logger.warning(("Bulk %s failed" % self.action, note.id, err))
+        show_message(
+            "Simplenote: %s %s notes, %s failed" % (self.action, len(result.succeeded), len(result.failed))
+        )
+
+
+def configure_scheduler() -> bool:
+    """Apply the sync interval settings, returns whether automatic syncing is on"""
+    current = snapshot()
+    SCHEDULER.configure(current.sync_every, current.sync_every_max, current.sync_idle_pause)
+    return current.sync_every > 0
+
+
+def schedule_sync(seconds: float):
+    """Run `sync` in `seconds`, replacing the sync scheduled before"""
+    global SYNC_TIMER
+    SYNC_TIMER += 1
+    timer = SYNC_TIMER
+
+    def run():
+        if timer == SYNC_TIMER:
+            sync()
+
+    sublime.set_timeout(run, int(seconds * 1000))
+
+
+def next_sync_interval() -> float:
+    # The change feed brings remote changes as they happen, polling is only a safety net then
+    if CHANGE_FEED is not None and CHANGE_FEED.connected:
+        return SCHEDULER.max_interval
+    return SCHEDULER.interval
+
+
+def remove_notes(notes: List[Note]):
+    """Close the clean views and remove the files of notes deleted on the server"""
+    for note in notes:
+        logger.info("Note deleted on the server: %s" % note.id)
+        dirty = False
+        for window in sublime.windows():
+            view = window.find_open_file(note.filepath)
+            if not isinstance(view, sublime.View):
+                continue
+            if view.is_dirty():
+                # Unsaved edits stay, saving them creates the note again
+                dirty = True
+            else:
+                close_view(view)
+        if not dirty:
+            note.close()
+
+
+def on_feed_changes(updated_notes: List[Note], removed_notes: List[Note]):
+    SCHEDULER.synced(len(updated_notes) + len(removed_notes))
+    SimplenoteSyncCommand().merge_note(updated_notes)
+    remove_notes(removed_notes)
+
+
+def start_change_feed():
+    global CHANGE_FEED
+    if not snapshot().change_feed:
+        return
+    if CHANGE_FEED is None or not CHANGE_FEED.is_alive():
+        CHANGE_FEED = ChangeFeed(on_feed_changes)
+        CHANGE_FEED.start()
+
+
+def stop_change_feed():
+    global CHANGE_FEED
+    if CHANGE_FEED is not None:
+        CHANGE_FEED.stop()
+        CHANGE_FEED = None
+
+
+def resume_sync():
+    """Schedule the sync skipped while paused, once the editor is in use again"""
+    delay = SCHEDULER.wake()
+    if delay is not None and SIMPLENOTE_STARTED:
+        logger.debug(("Sync resumed in", delay))
+        schedule_sync(delay)
+
+
 def sync():
-    manager = OperationManager()
-    if not manager.running:
-        sublime.run_command("simplenote_sync")
-    else:
-        logger.debug("Sync omitted")
-
-    sync_every = get_settings("sync_every", 0)
-    logger.debug(("Simplenote sync_every", sync_every))
-    if not isinstance(sync_every, int):
-        show_message("`sync_every` must be an integer. Please check settings file.")
+    auto_sync = configure_scheduler()
+    if auto_sync and SCHEDULER.paused:
+        # Resumed by `resume_sync` on the next activity
+        logger.debug("Sync paused")
+        SCHEDULER.sleep()
         return
 
-    if sync_every > 0:
-        sublime.set_timeout(sync, sync_every * 1000)
+    manager = OperationManager()
+    if manager.running:
+        logger.debug("Sync postponed")
+        if auto_sync:
+            schedule_sync(SYNC_BUSY_RETRY)
+        return
+    sublime.run_command("simplenote_sync")
+    if auto_sync:
+        # Replaced by the interval adapted to the result, once the sync finishes
+        schedule_sync(next_sync_interval())
 
 
 def start():
     global SIMPLENOTE_STARTED
     sync()
+    start_change_feed()
     SIMPLENOTE_STARTED = True
     return SIMPLENOTE_STARTED
 
@@ -240,25 +535,56 @@ def reload_if_needed():
         logger.debug("Simplenote Reload call %s" % SIMPLENOTE_RELOAD_CALLS)
         return
 
-    autostart = get_settings("autostart")
-    if bool(autostart):
-        autostart = True
+    autostart = snapshot().autostart
     logger.debug(("Simplenote Reloading", autostart))
     if autostart:
         sublime.set_timeout(start, 2000)
         logger.debug("Auto Starting")
 
 
+class SimplenoteMetricsCommand(sublime_plugin.ApplicationCommand):
+    """Show request, operation and callback latencies and the traffic since startup"""
+
+    def run(self):
+        show_panel("simplenote_metrics", metrics.report())
+
+
+class SimplenoteStartupReportCommand(sublime_plugin.ApplicationCommand):
+    """Show what the plugin startup cost, per imported module"""
+
+    def run(self):
+        show_panel("simplenote_startup", startup.report())
+
+
 def plugin_loaded():
+    with startup.measure("logging.configure"):
+        logger_init.configure()
+    with startup.measure("plugin_loaded"):
+        _plugin_loaded()
+    # Startup is over, stop timing imports
+    startup.uninstall()
+    logger.debug("Simplenote startup:\n%s" % startup.report())
+
+
+def _plugin_loaded():
     # load_notes()
     logger.debug(("Loaded notes number: ", len(Note.mapper_id_note)))
-    clear_orphaned_filepaths()
 
-    # logger.debug(("SETTINGS.__dict__: ", SETTINGS.__dict__))
-    # logger.debug(("SETTINGS.username: ", SETTINGS.get("username")))
-    # SETTINGS.clear_on_change("username")
-    # SETTINGS.clear_on_change("password")
-    # SETTINGS.add_on_change("username", reload_if_needed)
-    # SETTINGS.add_on_change("password", reload_if_needed)
+    settings.add_listener("simplenotecommands", on_settings_changed)
+    on_settings_changed(None, snapshot())
 
     reload_if_needed()
+
+
+def on_settings_changed(old: Optional[Snapshot], new: Snapshot):
+    if new.errors:
+        show_message("Simplenote: %s. Please check settings file." % "; ".join(new.errors))
+    if old is not None and old.credentials != new.credentials:
+        # `Note.API` keeps the session while the credentials do not change
+        Note.reset_api()
+    REPORTER.interval = new.status_interval
+    configure_scheduler()
+
+
+def plugin_unloaded():
+    stop_change_feed()
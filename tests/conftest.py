@@ -0,0 +1,9 @@
+import os
+import sys
+
+
+# Outside Sublime Text, `sublime` and `sublime_plugin` are the stand-ins of tests/stubs
+try:
+    import sublime  # noqa: F401
+except ImportError:
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "stubs"))
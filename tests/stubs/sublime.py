@@ -0,0 +1,539 @@
+"""
+Headless stand-in of the `sublime` module, for running the plugin outside Sublime Text.
+
+Covers the part of https://www.sublimetext.com/docs/api_reference.html the plugin uses:
+windows and views backed by an in-memory buffer, regions, settings loaded from the package
+with `add_on_change`, quick and input panels, and `set_timeout` driven by `CLOCK`. Timeouts
+only run when the test advances the clock:
+
+    sublime.set_timeout(callback, 1000)
+    sublime.CLOCK.advance(1000)  # runs callback
+
+`reset()` closes every window and forgets timeouts, settings and dialogs.
+"""
+
+from collections import Counter
+import heapq
+import itertools
+import json
+import os
+import re
+import tempfile
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+__all__ = [
+    "Region",
+    "Settings",
+    "View",
+    "Window",
+    "Clock",
+    "CLOCK",
+    "reset",
+]
+
+
+# The package directory, settings files are looked up there
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+KEEP_OPEN_ON_FOCUS_LOST = 2
+MONOSPACE_FONT = 1
+WANT_EVENT = 32
+
+
+class Region:
+
+    def __init__(self, a: int, b: Optional[int] = None):
+        self.a = a
+        self.b = a if b is None else b
+
+    def __repr__(self) -> str:
+        return "Region(%s, %s)" % (self.a, self.b)
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, Region) and (self.a, self.b) == (other.a, other.b)
+
+    def __len__(self) -> int:
+        return self.size()
+
+    def begin(self) -> int:
+        return min(self.a, self.b)
+
+    def end(self) -> int:
+        return max(self.a, self.b)
+
+    def size(self) -> int:
+        return abs(self.b - self.a)
+
+    def empty(self) -> bool:
+        return self.a == self.b
+
+    def contains(self, point: int) -> bool:
+        return self.begin() <= point <= self.end()
+
+
+class Clock:
+    """Virtual milliseconds for `set_timeout`, callbacks run in due order while advancing"""
+
+    def __init__(self):
+        self.now = 0
+        self._counter = itertools.count()
+        # (due, sequence, callback), the sequence keeps callbacks due together in call order
+        self._pending: List[Tuple[int, int, Callable[[], Any]]] = []
+
+    def schedule(self, callback: Callable[[], Any], delay: int = 0):
+        heapq.heappush(self._pending, (self.now + max(0, int(delay)), next(self._counter), callback))
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def advance(self, ms: int = 0) -> int:
+        """Move the clock `ms` forward, running the callbacks due by then, returns how many ran"""
+        target = self.now + ms
+        ran = 0
+        while self._pending and self._pending[0][0] <= target:
+            due, _, callback = heapq.heappop(self._pending)
+            self.now = max(self.now, due)
+            callback()
+            ran += 1
+        self.now = target
+        return ran
+
+    def run_all(self, limit: int = 10000) -> int:
+        """Advance until nothing is pending, periodic callbacks stop after `limit` runs"""
+        ran = 0
+        while self._pending and ran < limit:
+            ran += self.advance(max(0, self._pending[0][0] - self.now))
+        return ran
+
+    def clear(self):
+        self._pending.clear()
+        self.now = 0
+
+
+CLOCK = Clock()
+
+
+def _strip_comments(text: str) -> str:
+    """Settings files are JSON with comments and trailing commas"""
+    pattern = re.compile(r'("(?:\\.|[^"\\])*")|//[^\n]*|/\*.*?\*/', re.DOTALL)
+    text = pattern.sub(lambda match: match.group(1) or "", text)
+    return re.sub(r",(\s*[}\]])", r"\1", text)
+
+
+class Settings:
+
+    def __init__(self, name: str = ""):
+        self.name = name
+        self.values: Dict[str, Any] = {}
+        # tag -> callback
+        self._on_change: Dict[str, Callable[[], Any]] = {}
+        filepath = os.path.join(PACKAGE_DIR, name) if name else ""
+        if filepath and os.path.isfile(filepath):
+            with open(filepath, encoding="utf-8") as fh:
+                self.values = json.loads(_strip_comments(fh.read()))
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self.values.get(key, default)
+
+    def has(self, key: str) -> bool:
+        return key in self.values
+
+    def set(self, key: str, value: Any):
+        self.values[key] = value
+        self._changed()
+
+    def erase(self, key: str):
+        if self.values.pop(key, None) is not None:
+            self._changed()
+
+    def update(self, values: Dict[str, Any]):
+        """Replace several values with one change notification, like editing the settings file"""
+        self.values.update(values)
+        self._changed()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(self.values)
+
+    def add_on_change(self, tag: str, callback: Callable[[], Any]):
+        self._on_change[tag] = callback
+
+    def clear_on_change(self, tag: str):
+        self._on_change.pop(tag, None)
+
+    def _changed(self):
+        for callback in list(self._on_change.values()):
+            callback()
+
+
+class View:
+    _ids = itertools.count(1)
+
+    def __init__(self, window: Optional["Window"] = None, file_name: Optional[str] = None, content: str = ""):
+        self.view_id = next(View._ids)
+        self._window = window
+        self._file_name = file_name
+        self._content = content
+        self._scratch = False
+        self._dirty = False
+        self._name = ""
+        self._settings = Settings()
+        self._status: Dict[str, str] = {}
+        self.syntax = ""
+        self.closed = False
+
+    def __repr__(self) -> str:
+        return "View(%s, %r)" % (self.view_id, self._file_name)
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, View) and self.view_id == other.view_id
+
+    def __hash__(self) -> int:
+        return self.view_id
+
+    def id(self) -> int:
+        return self.view_id
+
+    def is_valid(self) -> bool:
+        return not self.closed
+
+    def window(self) -> Optional["Window"]:
+        return None if self.closed else self._window
+
+    def file_name(self) -> Optional[str]:
+        return self._file_name
+
+    def name(self) -> str:
+        return self._name
+
+    def set_name(self, name: str):
+        self._name = name
+
+    def size(self) -> int:
+        return len(self._content)
+
+    def substr(self, region) -> str:
+        if isinstance(region, int):
+            return self._content[region : region + 1]
+        return self._content[region.begin() : region.end()]
+
+    def settings(self) -> Settings:
+        return self._settings
+
+    def is_dirty(self) -> bool:
+        return self._dirty
+
+    def is_scratch(self) -> bool:
+        return self._scratch
+
+    def set_scratch(self, scratch: bool):
+        self._scratch = scratch
+
+    def set_syntax_file(self, syntax: str):
+        self.syntax = syntax
+
+    def set_status(self, key: str, value: str):
+        api_calls["View.set_status"] += 1
+        self._status[key] = value
+
+    def get_status(self, key: str) -> str:
+        return self._status.get(key, "")
+
+    def erase_status(self, key: str):
+        api_calls["View.erase_status"] += 1
+        self._status.pop(key, None)
+
+    def set_content(self, content: str):
+        """Replace the buffer as typing would: the view turns dirty and `on_modified` runs"""
+        self._content = content
+        self._dirty = True
+        _dispatch("on_modified", self)
+
+    def revert(self):
+        """Reload the buffer from the file, the way Sublime Text follows external changes"""
+        if self._file_name and os.path.isfile(self._file_name):
+            with open(self._file_name, encoding="utf-8") as fh:
+                self._content = fh.read()
+        self._dirty = False
+
+    def save(self):
+        if self._file_name is None:
+            return
+        _dispatch("on_pre_save", self)
+        with open(self._file_name, "w", encoding="utf-8", newline="") as fh:
+            fh.write(self._content)
+        self._dirty = False
+        _dispatch("on_post_save", self)
+
+    def close(self) -> bool:
+        if self._window is not None:
+            return self._window._close_view(self)
+        return False
+
+    def run_command(self, cmd: str, args: Optional[Dict[str, Any]] = None):
+        args = args or {}
+        if cmd == "save":
+            self.save()
+        elif cmd in ("append", "insert"):
+            self.set_content(self._content + args.get("characters", ""))
+        elif cmd == "revert":
+            self.revert()
+        _record_command(self, cmd, args)
+
+
+class Window:
+    _ids = itertools.count(1)
+
+    def __init__(self):
+        self.window_id = next(Window._ids)
+        self._views: List[View] = []
+        self._active: Optional[View] = None
+        self._panels: Dict[str, View] = {}
+        self.active_panel_name: Optional[str] = None
+        # The last quick and input panels shown, see `select` and `submit`
+        self.quick_panel: Optional[Dict[str, Any]] = None
+        self.input_panel: Optional[Dict[str, Any]] = None
+
+    def __repr__(self) -> str:
+        return "Window(%s)" % self.window_id
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, Window) and self.window_id == other.window_id
+
+    def __hash__(self) -> int:
+        return self.window_id
+
+    def id(self) -> int:
+        return self.window_id
+
+    def views(self) -> List[View]:
+        return list(self._views)
+
+    def active_view(self) -> Optional[View]:
+        return self._active
+
+    def focus_view(self, view: View):
+        if view in self._views:
+            self._active = view
+            _dispatch("on_activated", view)
+
+    def new_file(self) -> View:
+        view = View(self)
+        self._views.append(view)
+        self._active = view
+        _dispatch("on_new", view)
+        return view
+
+    def find_open_file(self, filepath: str) -> Optional[View]:
+        for view in self._views:
+            if view.file_name() == filepath:
+                return view
+        return None
+
+    def open_file(self, filepath: str, flags: int = 0) -> View:
+        view = self.find_open_file(filepath)
+        if view is None:
+            view = View(self, filepath)
+            view.revert()
+            self._views.append(view)
+            _dispatch("on_load", view)
+        self.focus_view(view)
+        return view
+
+    def _close_view(self, view: View) -> bool:
+        if view not in self._views:
+            return False
+        _dispatch("on_pre_close", view)
+        self._views.remove(view)
+        view.closed = True
+        if self._active == view:
+            self._active = self._views[-1] if self._views else None
+        _dispatch("on_close", view)
+        return True
+
+    def create_output_panel(self, name: str, unlisted: bool = False) -> View:
+        panel = self._panels[name] = View(self)
+        return panel
+
+    def find_output_panel(self, name: str) -> Optional[View]:
+        return self._panels.get(name)
+
+    def active_panel(self) -> Optional[str]:
+        return self.active_panel_name
+
+    def show_quick_panel(
+        self,
+        items: List[Any],
+        on_select: Callable[[int], Any],
+        flags: int = 0,
+        selected_index: int = -1,
+        on_highlight: Optional[Callable[[int], Any]] = None,
+        placeholder: str = "",
+    ):
+        self.quick_panel = {
+            "items": items,
+            "on_select": on_select,
+            "flags": flags,
+            "selected_index": selected_index,
+            "on_highlight": on_highlight,
+            "placeholder": placeholder,
+        }
+
+    def select(self, index: int):
+        """Pick the item `index` of the open quick panel, -1 to cancel it"""
+        panel = self.quick_panel
+        assert panel is not None, "no quick panel is open"
+        self.quick_panel = None
+        panel["on_select"](index)
+
+    def show_input_panel(
+        self,
+        caption: str,
+        initial_text: str,
+        on_done: Optional[Callable[[str], Any]],
+        on_change: Optional[Callable[[str], Any]],
+        on_cancel: Optional[Callable[[], Any]],
+    ) -> View:
+        self.input_panel = {"caption": caption, "on_done": on_done, "on_change": on_change, "on_cancel": on_cancel}
+        return View(self, content=initial_text)
+
+    def submit(self, text: str):
+        """Validate the open input panel with `text`"""
+        panel = self.input_panel
+        assert panel is not None, "no input panel is open"
+        self.input_panel = None
+        if panel["on_done"] is not None:
+            panel["on_done"](text)
+
+    def run_command(self, cmd: str, args: Optional[Dict[str, Any]] = None):
+        args = args or {}
+        if cmd == "close_file" and self._active is not None:
+            self._close_view(self._active)
+        elif cmd == "show_panel":
+            self.active_panel_name = args.get("panel")
+        elif cmd == "hide_panel":
+            self.active_panel_name = None
+        _record_command(self, cmd, args)
+
+
+# What the plugin asked for, for the tests to check
+api_calls: Counter = Counter()
+status_messages: List[str] = []
+dialogs: List[str] = []
+commands: List[Tuple[Any, str, Dict[str, Any]]] = []
+# Answer of `ok_cancel_dialog`
+ok_cancel_answer = True
+
+_windows: List[Window] = []
+_settings: Dict[str, Settings] = {}
+_cache_dir: Optional[str] = None
+
+
+def _record_command(target: Any, cmd: str, args: Dict[str, Any]):
+    commands.append((target, cmd, args))
+
+
+def _dispatch(event: str, view: View):
+    import sublime_plugin
+
+    sublime_plugin.dispatch(event, view)
+
+
+def version() -> str:
+    return "4180"
+
+
+def platform() -> str:
+    return "linux"
+
+
+def arch() -> str:
+    return "x64"
+
+
+def windows() -> List[Window]:
+    return list(_windows)
+
+
+def active_window() -> Window:
+    if not _windows:
+        _windows.append(Window())
+    return _windows[0]
+
+
+def new_window() -> Window:
+    window = Window()
+    _windows.append(window)
+    return window
+
+
+def cache_path() -> str:
+    global _cache_dir
+    if _cache_dir is None:
+        _cache_dir = tempfile.mkdtemp(prefix="sublime-cache-")
+    return _cache_dir
+
+
+def packages_path() -> str:
+    return os.path.dirname(PACKAGE_DIR)
+
+
+def load_settings(name: str) -> Settings:
+    if name not in _settings:
+        _settings[name] = Settings(name)
+    return _settings[name]
+
+
+def save_settings(name: str):
+    pass
+
+
+def set_timeout(callback: Callable[[], Any], delay: int = 0):
+    CLOCK.schedule(callback, delay)
+
+
+def set_timeout_async(callback: Callable[[], Any], delay: int = 0):
+    CLOCK.schedule(callback, delay)
+
+
+def status_message(message: str):
+    status_messages.append(message)
+
+
+def message_dialog(message: str):
+    dialogs.append(message)
+
+
+def error_message(message: str):
+    dialogs.append(message)
+
+
+def ok_cancel_dialog(message: str, ok_title: str = "", title: str = "") -> bool:
+    dialogs.append(message)
+    return ok_cancel_answer
+
+
+def run_command(cmd: str, args: Optional[Dict[str, Any]] = None):
+    import sublime_plugin
+
+    command = sublime_plugin.application_command(cmd)
+    if command is not None:
+        command.run(**(args or {}))
+    _record_command(None, cmd, args or {})
+
+
+def reset():
+    """Close every window and forget timeouts, settings, messages and listeners"""
+    import sublime_plugin
+
+    global ok_cancel_answer
+    _windows.clear()
+    _settings.clear()
+    CLOCK.clear()
+    api_calls.clear()
+    status_messages.clear()
+    dialogs.clear()
+    commands.clear()
+    ok_cancel_answer = True
+    sublime_plugin.clear()
@@ -0,0 +1,100 @@
+"""
+Headless stand-in of the `sublime_plugin` module.
+
+Sublime Text instantiates the listeners and commands of a plugin when it loads it, here
+`register` does: `register(simplenotecommands)` picks them from the module. View events
+of the `sublime` stand-in are then delivered to the listeners, and `sublime.run_command`
+runs the application commands.
+"""
+
+import re
+import types
+from typing import Any, Dict, List, Optional
+
+
+__all__ = [
+    "EventListener",
+    "ApplicationCommand",
+    "WindowCommand",
+    "TextCommand",
+    "register",
+    "dispatch",
+    "application_command",
+    "clear",
+]
+
+
+class EventListener:
+    pass
+
+
+class ApplicationCommand:
+
+    def is_enabled(self) -> bool:
+        return True
+
+    def run(self, **kwargs):
+        pass
+
+
+class WindowCommand:
+
+    def __init__(self, window):
+        self.window = window
+
+    def run(self, **kwargs):
+        pass
+
+
+class TextCommand:
+
+    def __init__(self, view):
+        self.view = view
+
+    def run(self, edit, **kwargs):
+        pass
+
+
+event_listeners: List[EventListener] = []
+# command name -> command class
+application_commands: Dict[str, type] = {}
+
+
+def command_name(cls: type) -> str:
+    """`SimplenoteSyncCommand` -> `simplenote_sync`, the way Sublime Text names commands"""
+    name = cls.__name__
+    if name.endswith("Command"):
+        name = name[: -len("Command")]
+    return re.sub(r"(?<=[a-z0-9])(?=[A-Z])", "_", name).lower()
+
+
+def register(*objects: Any):
+    """Load listeners and application commands, from classes or from every class of a module"""
+    classes: List[Any] = []
+    for obj in objects:
+        if isinstance(obj, types.ModuleType):
+            classes.extend(value for value in vars(obj).values() if isinstance(value, type))
+        else:
+            classes.append(obj)
+    for cls in classes:
+        if issubclass(cls, EventListener) and cls is not EventListener:
+            event_listeners.append(cls())
+        if issubclass(cls, ApplicationCommand) and cls is not ApplicationCommand:
+            application_commands[command_name(cls)] = cls
+
+
+def dispatch(event: str, view: Any):
+    for listener in list(event_listeners):
+        callback = getattr(listener, event, None)
+        if callback is not None:
+            callback(view)
+
+
+def application_command(name: str) -> Optional[ApplicationCommand]:
+    cls = application_commands.get(name)
+    return None if cls is None else cls()
+
+
+def clear():
+    event_listeners.clear()
+    application_commands.clear()
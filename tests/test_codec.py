@@ -0,0 +1,76 @@
+from email.message import Message
+import logging
+from unittest import TestCase, main, mock
+
+from utils import codec
+from utils.request import Response
+
+
+logger = logging.getLogger()
+
+
+class TestCodec(TestCase):
+
+    def tearDown(self):
+        codec.use()
+
+    def test_backends(self):
+        note = {"content": "# SimplenoteTitle\n\n中文 ✓", "tags": ["work"], "deleted": False, "modificationDate": 1.5}
+        backends = codec.available()
+        logger.info(("codec", codec.NAME, list(backends)))
+        assert "json" in backends
+        assert codec.NAME == next(iter(backends))
+        for name in backends:
+            assert codec.use(name) == name
+            body = codec.dumps(note)
+            assert isinstance(body, bytes)
+            assert codec.loads(body) == note
+            assert codec.loads(body.decode()) == note
+            with self.assertRaises(ValueError):
+                codec.loads("{")
+
+    def test_unknown(self):
+        with self.assertRaises(ValueError):
+            codec.use("pickle")
+        assert codec.NAME in codec.available()
+
+    def test_response_parsed_once(self):
+        response = Response(status=200, headers=Message(), body='{"index": [], "current": "1"}')
+        with mock.patch.object(codec, "loads", wraps=codec.loads) as loads:
+            assert response.data == {"index": [], "current": "1"}
+            assert response.data is response.json()
+        assert loads.call_count == 1
+        assert Response(status=500, headers=Message(), body="Internal Server Error").data == {}
+
+    def test_response_views(self):
+        body = '{"content": "café"}'.encode("utf-8")
+        response = Response(status=200, headers=Message(), body=body)
+        assert response.view.obj is body
+        assert response.text == '{"content": "café"}'
+        assert response.text is response.text
+        # The bytes are kept as received
+        assert response.body is body
+
+        headers = Message()
+        headers["Content-Type"] = "application/json; charset=latin-1"
+        response = Response(status=200, headers=headers, body='{"content": "café"}'.encode("latin-1"))
+        assert response.charset == "latin-1"
+        assert response.data == {"content": "café"}
+
+        # Bytes invalid in their charset are only replaced in the text
+        body = b'{"content": "caf\xe9"}'
+        response = Response(status=200, headers=Message(), body=body)
+        assert response.text == '{"content": "caf\ufffd"}'
+        assert response.body is body
+
+    def test_response_head(self):
+        body = b"x" * 100000
+        response = Response(status=200, headers=Message(), body=body)
+        assert response.head(10) == "xxxxxxxxxx...<100000 bytes>"
+        assert response.head() == "x" * 160 + "...<100000 bytes>"
+        assert Response(status=200, headers=Message(), body=b"{}").head() == "{}"
+        assert Response(status=500, headers=Message(), body="Internal Server Error").head(8) == "Internal...<21 chars>"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+import logging
+import os
+import tempfile
+import time
+from unittest import TestCase, main
+
+from utils.fs import FileWriter, remove_orphans
+
+
+logger = logging.getLogger()
+
+
+class TestFileWriter(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.filepath = os.path.join(self.tmp_dir.name, "note (001).md")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_skip_unchanged(self):
+        writer = FileWriter()
+        assert writer.write(self.filepath, b"# SimplenoteTitle")
+        os.utime(self.filepath, ns=(0, 0))
+        writer.forget(self.filepath)
+        assert not writer.write(self.filepath, b"# SimplenoteTitle")
+        assert os.stat(self.filepath).st_mtime_ns == 0
+        assert writer.write(self.filepath, b"# SimplenoteTitle\n\nSimplenoteBody")
+        with open(self.filepath, "rb") as fh:
+            assert fh.read() == b"# SimplenoteTitle\n\nSimplenoteBody"
+        assert os.listdir(self.tmp_dir.name) == ["note (001).md"]
+
+    def test_external_change(self):
+        writer = FileWriter()
+        writer.write(self.filepath, b"abc")
+        with open(self.filepath, "wb") as fh:
+            fh.write(b"xyz")
+        assert writer.write(self.filepath, b"abc")
+
+    def test_submit_and_move(self):
+        writer = FileWriter()
+        assert writer.submit(self.filepath, b"content").result()
+        assert not writer.submit(self.filepath, b"content").result()
+        new_filepath = os.path.join(self.tmp_dir.name, "renamed (001).md")
+        writer.move(self.filepath, new_filepath)
+        assert not writer.write(new_filepath, b"content")
+        assert not os.path.exists(self.filepath)
+
+
+class TestRemoveOrphans(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_remove_orphans(self):
+        expected = set()
+        for index in range(25000):
+            filename = "note %s (%032x).md" % (index, index)
+            if index % 5 == 0:
+                expected.add(filename)
+            with open(os.path.join(self.tmp_dir.name, filename), "wb"):
+                pass
+        os.mkdir(os.path.join(self.tmp_dir.name, "subdir"))
+
+        start_time = time.perf_counter()
+        removed = remove_orphans(self.tmp_dir.name, expected)
+        cost_seconds = time.perf_counter() - start_time
+        logger.info("Removed %s stale files in %.3f(s)" % (removed, cost_seconds))
+        assert removed == 20000
+        assert set(os.listdir(self.tmp_dir.name)) == expected | {"subdir"}
+        assert cost_seconds < 10
+
+    def test_remove_orphans_keep(self):
+        for filename in ("orphan.md", "late.md"):
+            with open(os.path.join(self.tmp_dir.name, filename), "wb"):
+                pass
+        # Expected since the scan started
+        assert remove_orphans(self.tmp_dir.name, set(), keep=lambda filename: filename == "late.md") == 1
+        assert os.listdir(self.tmp_dir.name) == ["late.md"]
+
+    def test_missing_directory(self):
+        assert remove_orphans(os.path.join(self.tmp_dir.name, "missing"), set()) == 0
+
+
+if __name__ == "__main__":
+    main()
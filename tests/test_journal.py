@@ -0,0 +1,71 @@
+import logging
+import os
+import tempfile
+from unittest import TestCase, main
+
+from utils.journal import Journal
+
+
+logger = logging.getLogger()
+
+
+class TestJournal(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.filepath = os.path.join(self.tmp_dir.name, "journal.jsonl")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_coalesce(self):
+        journal = Journal(self.filepath)
+        for index in range(10):
+            journal.append("001", 1, "base", {"content": "save %s" % index})
+        journal.append("002", 4, "other", {"content": "other save"})
+        pending = journal.pending()
+        logger.info(pending)
+        assert len(pending) == 2
+        assert pending[0]["id"] == "001"
+        assert pending[0]["d"]["content"] == "save 9"
+        assert pending[0]["base"] == "base"
+        assert pending[0]["v"] == 1
+
+    def test_commit(self):
+        journal = Journal(self.filepath)
+        seq = journal.append("001", 1, "base", {"content": "first"})
+        later_seq = journal.append("002", 1, "base", {"content": "second"})
+        journal.append("002", 1, "base", {"content": "third"})
+        journal.commit("001", seq)
+        journal.commit("002", later_seq)
+        pending = journal.pending()
+        assert [entry["id"] for entry in pending] == ["002"]
+        assert pending[0]["d"]["content"] == "third"
+
+    def test_durable(self):
+        journal = Journal(self.filepath)
+        seq = journal.append("001", 1, "base", {"content": "first"})
+        journal.append("002", 1, "base", {"content": "second"})
+        journal.commit("001", seq)
+        with open(self.filepath, "a") as fh:
+            fh.write('{"seq": 4, "id": "003"')
+
+        reloaded = Journal(self.filepath)
+        assert [entry["id"] for entry in reloaded.pending()] == ["002"]
+        assert reloaded.append("004", 1, "", {}) > seq
+        # The change appended after the torn line survives the next reload
+        assert [entry["id"] for entry in Journal(self.filepath).pending()] == ["002", "004"]
+
+    def test_compact(self):
+        journal = Journal(self.filepath)
+        for index in range(100):
+            seq = journal.append("%03d" % (index % 5), 1, "base", {"content": "save %s" % index})
+        journal.commit("004", seq)
+        journal.compact()
+        with open(self.filepath) as fh:
+            assert len(fh.readlines()) == 4
+        assert len(Journal(self.filepath)) == 4
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+import json
+import logging
+import time
+from unittest import TestCase, main
+
+from utils.jsonstream import ArrayStreamParser
+
+
+logger = logging.getLogger()
+
+
+class TestArrayStreamParser(TestCase):
+
+    def setUp(self):
+        self.entries = [
+            {"id": "%036d" % index, "v": index, "d": {"content": '# Note %s\n\n中文 ✓ \\"[]{}' % index, "tags": []}}
+            for index in range(50)
+        ]
+        self.document = {"current": 1.5e3, "index": self.entries, "mark": "é", "other": [1, {"a": None}]}
+
+    def parse(self, body: bytes, chunk_size: int) -> ArrayStreamParser:
+        parser = ArrayStreamParser("index")
+        entries = []
+        for start in range(0, len(body), chunk_size):
+            entries += parser.feed(body[start : start + chunk_size])
+        entries += parser.close()
+        assert entries == self.entries
+        return parser
+
+    def test_chunks(self):
+        for indent in (None, 2):
+            body = json.dumps(self.document, ensure_ascii=False, indent=indent).encode()
+            for chunk_size in (1, 3, 64, len(body)):
+                parser = self.parse(body, chunk_size)
+                assert parser.done and parser.count == len(self.entries)
+                assert parser.fields == {"current": 1500.0, "mark": "é", "other": [1, {"a": None}]}
+
+    def test_yields_early(self):
+        body = json.dumps(self.document).encode()
+        parser = ArrayStreamParser("index")
+        entries = parser.feed(body[: len(body) // 2])
+        assert 0 < len(entries) < len(self.entries)
+        assert entries == self.entries[: len(entries)]
+
+    def test_invalid(self):
+        for body in (b'{"index": [{"id": 1}', b'{"index": [{"id": 1}} ', b'["index"]', b""):
+            parser = ArrayStreamParser("index")
+            with self.assertRaises(ValueError):
+                parser.feed(body)
+                parser.close()
+
+    def test_cost(self):
+        body = json.dumps({"index": self.entries * 100, "current": "1"}).encode()
+        start_time = time.perf_counter()
+        self.parse_all(body, 64 * 1024)
+        stream_seconds = time.perf_counter() - start_time
+        start_time = time.perf_counter()
+        json.loads(body)
+        loads_seconds = time.perf_counter() - start_time
+        logger.info(
+            "%s bytes, stream %.3f(ms), json.loads %.3f(ms)" % (len(body), stream_seconds * 1e3, loads_seconds * 1e3)
+        )
+        assert stream_seconds < loads_seconds * 10 + 0.05
+
+    @staticmethod
+    def parse_all(body: bytes, chunk_size: int) -> int:
+        parser = ArrayStreamParser("index")
+        for start in range(0, len(body), chunk_size):
+            parser.feed(body[start : start + chunk_size])
+        parser.close()
+        return parser.count
+
+
+if __name__ == "__main__":
+    main()
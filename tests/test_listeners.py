@@ -0,0 +1,253 @@
+import logging
+import os
+import tempfile
+import time
+from typing import Tuple
+from unittest import TestCase, main, mock
+import uuid
+
+import sublime
+import sublime_plugin
+
+import models
+from models import Note
+from operations import NoteUpdater, OperationManager
+import simplenote
+import simplenotecommands
+from utils import metrics
+from utils import sublime as sublime_utils
+from utils.sublime import StatusReporter, show_message
+from utils.tree.redblacktree import rbtree as RedBlackTree
+
+
+logger = logging.getLogger()
+
+
+class TestListeners(TestCase):
+
+    def setUp(self):
+        sublime.reset()
+        sublime_plugin.register(simplenotecommands.SimplenoteViewCommand)
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.patches = [
+            mock.patch.object(models, "SIMPLENOTE_NOTES_DIR", self.tmp_dir.name),
+            mock.patch.object(OperationManager, "add_operation"),
+            mock.patch.object(simplenotecommands, "SIMPLENOTE_STARTED", True),
+            mock.patch.object(Note, "tree", RedBlackTree()),
+            mock.patch.object(sublime_utils, "REPORTER", StatusReporter(clock=self.clock)),
+        ]
+        for patch in self.patches:
+            patch.start()
+        self.add_operation = OperationManager.add_operation
+        self.window = sublime.active_window()
+
+    def tearDown(self):
+        for patch in reversed(self.patches):
+            patch.stop()
+        sublime.reset()
+        Note.mapper_id_note.clear()
+        self.tmp_dir.cleanup()
+
+    @staticmethod
+    def clock() -> float:
+        return sublime.CLOCK.now / 1000
+
+    def open_note(self, content: str) -> Tuple[Note, sublime.View]:
+        note = Note(id=str(uuid.uuid4()), v=1, d={"content": content})
+        note.flush()
+        return note, self.window.open_file(note.open())
+
+    def test_debounced_save(self):
+        note, view = self.open_note("# SimplenoteTitle\n\nSimplenoteBody")
+        for character in "abc":
+            view.run_command("append", {"characters": character})
+        assert view.is_dirty()
+        sublime.CLOCK.advance(999)
+        assert view.is_dirty()
+        # Three edits, one save once the last debounce is over
+        sublime.CLOCK.advance(1)
+        assert not view.is_dirty()
+        assert self.add_operation.call_count == 1
+        updater = self.add_operation.call_args[0][0]
+        assert isinstance(updater, NoteUpdater)
+        assert note.d.content == "# SimplenoteTitle\n\nSimplenoteBodyabc"
+
+    def test_activation_timed(self):
+        activated = metrics.histogram("listener.on_activated").count
+        deactivated = metrics.histogram("listener.on_deactivated").count
+        _, view = self.open_note("# SimplenoteTitle")
+        simplenotecommands.SimplenoteViewCommand().on_deactivated(view)
+        assert metrics.histogram("listener.on_activated").count > activated
+        assert metrics.histogram("listener.on_deactivated").count > deactivated
+
+    def test_post_save_unchanged(self):
+        _, view = self.open_note("# SimplenoteTitle")
+        view.run_command("save")
+        assert self.add_operation.call_count == 0
+
+    def test_save_after_failed_upload(self):
+        note, view = self.open_note("hello world")
+        view.run_command("append", {"characters": "!"})
+        view.run_command("save")
+        updater = self.add_operation.call_args[0][0]
+        updater.journal = None
+        offline = mock.Mock(modify=mock.Mock(return_value=(-1, "offline", None)))
+        with mock.patch.object(Note, "API", offline):
+            updater.run()
+        assert isinstance(updater.result, Exception)
+
+        # The pending edit is not a remote change, the second save overwrites it
+        view.run_command("append", {"characters": "?"})
+        view.run_command("save")
+        assert note.d.content == "hello world!?"
+        assert self.add_operation.call_count == 2
+
+        # A remote change is merged against the last synced version
+        note.update(2, {"content": "Hello world"})
+        view.run_command("append", {"characters": "."})
+        view.run_command("save")
+        assert note.d.content == "Hello world!?."
+
+    def test_save_conflicted(self):
+        note, view = self.open_note("SimplenoteTitle\n\nfirst line\n")
+        note.update(2, {"content": "SimplenoteTitle\n\nremote line\n"})
+        view.set_content("SimplenoteTitle\n\nlocal line\n")
+        view.run_command("save")
+        # The markers are shown in the view instead of uploaded
+        models.WRITER.schedule(lambda: None).result()
+        sublime.CLOCK.advance(0)
+        assert self.add_operation.call_count == 0
+        assert "<<<<<<<" in view.substr(sublime.Region(0, view.size())) and not view.is_dirty()
+        with open(note.filepath, encoding="utf-8") as fh:
+            assert fh.read() == note.d.content
+
+        # Saving the resolved note uploads it
+        view.set_content("SimplenoteTitle\n\nmerged line\n")
+        view.run_command("save")
+        assert self.add_operation.call_count == 1
+        assert isinstance(self.add_operation.call_args[0][0], NoteUpdater)
+        assert note.d.content == "SimplenoteTitle\n\nmerged line\n"
+
+    def test_sync_conflicted(self):
+        note, view = self.open_note("SimplenoteTitle\n\nfirst line\n")
+        view.set_content("SimplenoteTitle\n\nlocal line\n")
+        note.update(2, {"content": "SimplenoteTitle\n\nremote line\n"})
+        simplenotecommands.SimplenoteSyncCommand()._merge_note([note])
+        models.WRITER.schedule(lambda: None).result()
+        sublime.CLOCK.advance(0)
+        assert not any(isinstance(call[0][0], NoteUpdater) for call in self.add_operation.call_args_list)
+        assert "<<<<<<<" in view.substr(sublime.Region(0, view.size())) and not view.is_dirty()
+
+    def test_sync_pending_edit(self):
+        note, view = self.open_note("SimplenoteTitle\n\nfirst line\nsecond line\n")
+        view.set_content("SimplenoteTitle\n\nfirst line!\nsecond line\n")
+        view.run_command("save")
+        view.close()
+        # A newer version arrives before the upload is confirmed, the closed note still holds the edit
+        note.update(2, {"content": "SimplenoteTitle\n\nfirst line\nsecond line?\n"})
+        simplenotecommands.SimplenoteSyncCommand()._merge_note([note])
+        assert note.d.content == "SimplenoteTitle\n\nfirst line!\nsecond line?\n"
+        assert isinstance(self.add_operation.call_args_list[1][0][0], NoteUpdater)
+
+    def test_note_changed_title(self):
+        note, view = self.open_note("# SimplenoteTitle\n\nSimplenoteBody")
+        old_filepath = note.filepath
+        note.d.content = "# SimplenoteNewTitle\n\nSimplenoteBody"
+        simplenote.on_note_changed(note)
+        assert not view.is_valid()
+        new_view = self.window.active_view()
+        assert new_view is not None and new_view.file_name() == note.filepath
+        assert new_view.substr(sublime.Region(0, new_view.size())) == note.d.content
+        assert not os.path.exists(old_filepath)
+
+    def test_clear_orphaned_filepaths(self):
+        note, _ = self.open_note("# SimplenoteTitle")
+        closed = Note(id=str(uuid.uuid4()), v=1, d={"content": "# Closed"})
+        closed.open()
+        draft = os.path.join(self.tmp_dir.name, "draft.md")
+        for filepath in (draft, os.path.join(self.tmp_dir.name, "orphan.md")):
+            with open(filepath, "w") as fh:
+                fh.write("# Orphan")
+        self.window.open_file(draft)
+        with mock.patch.object(simplenote, "SIMPLENOTE_NOTES_DIR", self.tmp_dir.name):
+            simplenote.clear_orphaned_filepaths()
+        # Files of mapped notes and of open views survive
+        assert sorted(os.listdir(self.tmp_dir.name)) == sorted(
+            os.path.basename(filepath) for filepath in (note.filepath, closed.filepath, draft)
+        )
+
+    def test_quick_panel(self):
+        note, _ = self.open_note("# SimplenoteTitle")
+        simplenotecommands.SimplenoteListCommand().run()
+        panel = self.window.quick_panel
+        assert panel is not None and len(panel["items"]) == 1
+        self.window.select(0)
+        assert self.window.active_view().file_name() == note.filepath
+
+    def test_latency(self):
+        views = [self.open_note("# Note %s\n\nSimplenoteBody" % index)[1] for index in range(500)]
+
+        start_time = time.perf_counter()
+        for view in views:
+            view.run_command("append", {"characters": "a"})
+        on_modified_seconds = (time.perf_counter() - start_time) / len(views)
+
+        sublime.api_calls.clear()
+        start_time = time.perf_counter()
+        show_message("Simplenote: syncing")
+        show_message_seconds = time.perf_counter() - start_time
+        set_status_calls = sublime.api_calls["View.set_status"]
+
+        start_time = time.perf_counter()
+        sublime.CLOCK.advance(1000)
+        on_post_save_seconds = (time.perf_counter() - start_time) / len(views)
+
+        logger.info(
+            "on_modified %.3f(ms), on_post_save %.3f(ms), show_message over %s views %.3f(ms)"
+            % (on_modified_seconds * 1e3, on_post_save_seconds * 1e3, len(views), show_message_seconds * 1e3)
+        )
+        assert self.add_operation.call_count == len(views)
+        assert self.window.active_view().get_status("Simplenote") == "Simplenote: syncing"
+        assert set_status_calls == 1
+        assert on_modified_seconds < 0.05
+        assert on_post_save_seconds < 0.05
+
+
+class TestStatusReporter(TestCase):
+
+    def setUp(self):
+        sublime.reset()
+        self.window = sublime.active_window()
+        self.views = [self.window.new_file() for _ in range(200)]
+        self.reporter = StatusReporter(interval=0.25, clock=lambda: sublime.CLOCK.now / 1000)
+
+    def tearDown(self):
+        sublime.reset()
+
+    def test_throttle(self):
+        for second in range(10):
+            for index in range(100):
+                self.reporter.show("Simplenote: MultipleNoteModifier staring %s/%s" % (second, index))
+            sublime.CLOCK.advance(1000)
+        active_view = self.window.active_view()
+        assert active_view.get_status("Simplenote") == "Simplenote: MultipleNoteModifier staring 9/99"
+        logger.info((self.reporter.stats, dict(sublime.api_calls)))
+        # One update when the first message of a second arrives, one for the last one
+        assert self.reporter.stats["messages"] == 1000
+        assert sublime.api_calls["View.set_status"] == 20
+        assert all(view.get_status("Simplenote") == "" for view in self.views[:-1])
+
+    def test_activated(self):
+        self.reporter.show("Simplenote: SimplenoteSyncCommand")
+        self.window.focus_view(self.views[0])
+        self.reporter.apply(self.views[0])
+        assert self.views[0].get_status("Simplenote") == "Simplenote: SimplenoteSyncCommand"
+
+        sublime.CLOCK.advance(1000)
+        self.reporter.show(None)
+        assert sublime.api_calls["View.erase_status"] == 2
+        assert all(view.get_status("Simplenote") == "" for view in self.views)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+import gzip
+import logging
+import os
+import tempfile
+from unittest import TestCase, main
+
+from utils.logger import structured
+from utils.logger.handlers import LazyTimedRotatingFileHandler, LevelRoutingHandler
+
+
+logger = logging.getLogger()
+
+
+class TestLevelRoutingHandler(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.filenames = {
+            level: os.path.join(self.tmp_dir.name, "%s.log" % level.lower()) for level in ("INFO", "WARNING", "ERROR")
+        }
+        self.logger = logging.Logger("test_level_routing")
+
+    def tearDown(self):
+        for handler in self.logger.handlers:
+            handler.close()
+        self.tmp_dir.cleanup()
+
+    def read(self, filename: str) -> str:
+        with open(os.path.join(self.tmp_dir.name, filename)) as fh:
+            return fh.read()
+
+    def test_route(self):
+        handler = LevelRoutingHandler(self.filenames)
+        self.logger.addHandler(handler)
+        self.logger.setLevel(logging.DEBUG)
+        for level in (logging.DEBUG, logging.INFO, logging.WARNING, logging.ERROR, logging.CRITICAL):
+            self.logger.log(level, "level %s", logging.getLevelName(level))
+        handler.flush()
+        assert sorted(os.listdir(self.tmp_dir.name)) == ["error.log", "info.log", "warning.log"]
+        assert self.read("info.log") == "level INFO\n"
+        assert self.read("warning.log") == "level WARNING\n"
+        assert self.read("error.log") == "level ERROR\n"
+
+    def test_invalid_level(self):
+        with self.assertRaises(ValueError):
+            LevelRoutingHandler({"VERBOSE": os.path.join(self.tmp_dir.name, "verbose.log")})
+
+    def test_rollover(self):
+        handler = LevelRoutingHandler(self.filenames, maxBytes=100, backupCount=2)
+        self.logger.addHandler(handler)
+        for index in range(10):
+            self.logger.warning("%02d %s", index, "x" * 36)
+        assert sorted(os.listdir(self.tmp_dir.name)) == ["warning.log", "warning.log.1", "warning.log.2"]
+        assert self.read("warning.log").startswith("08 ")
+        assert self.read("warning.log.1").startswith("06 ")
+        assert self.read("warning.log.2").startswith("04 ")
+        assert os.path.getsize(os.path.join(self.tmp_dir.name, "warning.log.1")) <= 100
+
+    def test_compress(self):
+        handler = LevelRoutingHandler(self.filenames, maxBytes=100, backupCount=2, compress=True)
+        self.logger.addHandler(handler)
+        for index in range(6):
+            self.logger.error("%02d %s", index, "x" * 36)
+        assert sorted(os.listdir(self.tmp_dir.name)) == ["error.log", "error.log.1.gz", "error.log.2.gz"]
+        with gzip.open(os.path.join(self.tmp_dir.name, "error.log.1.gz"), "rt") as fh:
+            archived = fh.read()
+        logger.info(archived)
+        assert archived.startswith("02 ")
+
+
+class TestLazyTimedRotatingFileHandler(TestCase):
+
+    def test_directory(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filename = os.path.join(tmp_dir, "logs", "default.log")
+            handler = LazyTimedRotatingFileHandler(filename, when="midnight", delay=True)
+            # Nothing is created before the first record
+            assert not os.path.exists(os.path.dirname(filename))
+            test_logger = logging.Logger("test_lazy_timed")
+            test_logger.addHandler(handler)
+            test_logger.warning("first record")
+            handler.close()
+            with open(filename) as fh:
+                assert fh.read() == "first record\n"
+
+
+class TestStructured(TestCase):
+
+    def setUp(self):
+        self.logger = logging.Logger("test_structured", level=logging.INFO)
+        self.records = []
+        handler = logging.Handler()
+        handler.emit = self.records.append  # type: ignore
+        self.logger.addHandler(handler)
+
+    def test_lazy(self):
+        calls = []
+        structured.debug(self.logger, "request", body=lambda: calls.append(1))
+        assert not self.records
+        structured.info(self.logger, "request", body=lambda: calls.append(1) or "content")
+        assert not calls
+        assert self.records[0].getMessage() == "request body=content"
+        assert calls == [1]
+        assert self.records[0].funcName == "test_lazy"
+
+    def test_summarize(self):
+        body = "x" * 100000
+        structured.info(
+            self.logger,
+            "request",
+            url="https://api.simperium.com",
+            headers={"X-Simperium-Token": "secret", "Accept": "*/*"},
+            password="secret",
+            body=body,
+        )
+        message = self.records[0].getMessage()
+        logger.info(message)
+        assert "secret" not in message
+        assert "password=***" in message
+        assert "'Accept': '*/*'" in message
+        assert "<100000 chars blake2b:" in message
+        assert len(message) < 600
+        assert structured.summarize(b"y" * 1000) == "<1000 bytes blake2b:%s>" % structured._fingerprint(b"y" * 1000)
+
+
+if __name__ == "__main__":
+    main()
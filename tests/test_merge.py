@@ -0,0 +1,190 @@
+import copy
+import logging
+import os
+import tempfile
+from typing import Any, Dict, List, Optional, Tuple
+from unittest import TestCase, main, mock
+from urllib.error import HTTPError
+
+from models import Note
+from operations import JournalReplayer
+from utils.journal import Journal
+from utils.merge import merge3
+
+
+logger = logging.getLogger()
+
+
+base = "SimplenoteTitle\n\nfirst line\nsecond line\nthird line\n"
+note_id = "c6efd3fb-2222-2222-2222-86e9441003d3"
+
+
+class FakeSimplenote:
+    """In-memory stand-in for the Simplenote web service, counting every call"""
+
+    def __init__(self):
+        self.calls: List[Tuple[str, str]] = []
+        self.notes: Dict[str, Dict[str, Any]] = {}
+
+    def put(self, note_id: str, content: Optional[str] = None, **fields: Any):
+        note = self.notes.setdefault(note_id, {"id": note_id, "v": 0, "d": {}})
+        note["v"] += 1
+        if content is not None:
+            fields["content"] = content
+        note["d"] = dict(note["d"], **fields)
+        note["d"]["modificationDate"] = float(note["v"])
+        return copy.deepcopy(note)
+
+    def retrieve(self, note_id: str, version: Optional[int] = None):
+        self.calls.append(("retrieve", note_id))
+        return 0, "OK", copy.deepcopy(self.notes[note_id])
+
+    def modify(self, note: Dict[str, Any], note_id: Optional[str] = None, version: Optional[int] = None):
+        assert isinstance(note_id, str)
+        self.calls.append(("modify", note_id))
+        if version is not None and note_id in self.notes and version != self.notes[note_id]["v"]:
+            return -1, HTTPError(note_id, 412, "Precondition Failed", None, None), {}  # type: ignore
+        return 0, "OK", self.put(note_id, **note)
+
+
+class TestMerge3(TestCase):
+
+    def test_one_side_changed(self):
+        local = base.replace("first", "1st")
+        assert merge3(base, local, base).content == local
+        assert merge3(base, base, local).content == local
+
+    def test_both_sides_different_lines(self):
+        local = base.replace("first", "1st")
+        remote = base.replace("third", "3rd")
+        result = merge3(base, local, remote)
+        assert result.conflicts == 0
+        assert result.content == "SimplenoteTitle\n\n1st line\nsecond line\n3rd line\n"
+
+    def test_same_line_falls_back_to_characters(self):
+        local = base.replace("second line", "second line!")
+        remote = base.replace("second line", "Second line")
+        result = merge3(base, local, remote)
+        assert result.conflicts == 0
+        assert "Second line!\n" in result.content
+
+    def test_conflict(self):
+        local = base.replace("second", "local")
+        remote = base.replace("second", "remote")
+        result = merge3(base, local, remote)
+        logger.info(result)
+        assert result.conflicts == 1
+        assert "<<<<<<< local\nlocal line\n=======\nremote line\n>>>>>>> remote\n" in result.content
+        assert merge3(base, local, remote, prefer="local").content == local
+        assert merge3(base, local, remote, prefer="remote").content == remote
+
+
+class TestNoteMerge(TestCase):
+
+    def setUp(self):
+        Note.mapper_id_note.clear()
+        self.server = FakeSimplenote()
+        self.patcher = mock.patch.object(Note, "API", self.server)
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+        Note.mapper_id_note.clear()
+
+    def test_merge_uploads_once(self):
+        note = Note.retrieve(self.server_note(base))
+        note.flush()
+        self.server.put(note_id, base.replace("third", "3rd"))
+        note = Note.retrieve(note_id)
+        assert note.need_flush
+        self.server.calls.clear()
+
+        result = note.merge(base.replace("first", "1st"))
+        assert result.conflicts == 0
+        merged = note.modify()
+        assert self.server.calls == [("modify", note_id)]
+        assert merged.d.content == "SimplenoteTitle\n\n1st line\nsecond line\n3rd line\n"
+        assert self.server.notes[note_id]["d"]["content"] == merged.d.content
+
+    def test_pending_edit_kept(self):
+        note = Note.retrieve(self.server_note(base))
+        note.flush()
+        # Saved locally, then a newer version arrives before the upload is confirmed
+        note.content = base.replace("first", "1st")
+        self.server.put(note_id, base.replace("third", "3rd"))
+        note = Note.retrieve(note_id)
+        assert note._pending and note._local == base.replace("first", "1st")
+        assert note.d.content == base.replace("third", "3rd")
+
+        assert note.merge(note._local).conflicts == 0
+        note.modify()
+        assert not note._pending and note._local is None
+        assert self.server.notes[note_id]["d"]["content"] == "SimplenoteTitle\n\n1st line\nsecond line\n3rd line\n"
+
+    def server_note(self, content: str) -> str:
+        self.server.put(note_id, content)
+        return note_id
+
+
+class TestJournalReplayer(TestCase):
+
+    def setUp(self):
+        Note.mapper_id_note.clear()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.journal = Journal(os.path.join(self.tmp_dir.name, "journal.jsonl"))
+        self.server = FakeSimplenote()
+        self.patcher = mock.patch.object(Note, "API", self.server)
+        self.patcher.start()
+        self.server.put(note_id, base)
+        self.server.put(note_id, base.replace("second", "remote"))
+        Note.retrieve(note_id)
+        # Saved offline on top of the first version
+        self.journal.append(note_id, 1, base, {"content": base.replace("second", "local")})
+
+    def tearDown(self):
+        self.patcher.stop()
+        Note.mapper_id_note.clear()
+        JournalReplayer.reported.clear()
+        self.tmp_dir.cleanup()
+
+    def replay(self, prefer=None):
+        replayer = JournalReplayer(self.journal, prefer=prefer)
+        replayer.run()
+        return replayer.result
+
+    def test_conflict_kept(self):
+        self.server.calls.clear()
+        result = self.replay()
+        assert result.uploaded == [] and len(result.conflicted) == 1
+        note, merged = result.conflicted[0]
+        assert note.id == note_id and merged.conflicts == 1
+        # Markers are never uploaded, the change stays in the journal
+        assert self.server.calls == [("modify", note_id), ("retrieve", note_id)]
+        assert self.server.notes[note_id]["v"] == 2
+        assert [entry["id"] for entry in self.journal.pending()] == [note_id]
+        # Reported once, until the note is saved again
+        self.server.calls.clear()
+        assert self.replay() == ([], []) and self.server.calls == []
+        self.journal.append(note_id, 2, base, {"content": base.replace("second", "resolved")})
+        assert [entry["id"] for entry in JournalReplayer.pending(self.journal)] == [note_id]
+
+    def test_prefer(self):
+        result = self.replay(prefer="local")
+        assert result.conflicted == [] and [note.id for note in result.uploaded] == [note_id]
+        assert self.server.notes[note_id]["d"]["content"] == base.replace("second", "local")
+        assert len(self.journal) == 0
+
+    def test_server_changes_kept(self):
+        # Edited apart from the server, which also changed the tags, of a note missing locally
+        self.journal.append(note_id, 1, base, {"content": base.replace("first", "local"), "tags": ["stale"]})
+        self.server.put(note_id, tags=["remote"])
+        Note.mapper_id_note.clear()
+        result = self.replay()
+        assert result.conflicted == [] and [note.id for note in result.uploaded] == [note_id]
+        d = self.server.notes[note_id]["d"]
+        assert d["content"] == base.replace("first", "local").replace("second", "remote")
+        assert d["tags"] == ["remote"]
+        assert self.server.notes[note_id]["v"] == 4 and len(self.journal) == 0
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+import logging
+from threading import Thread
+from unittest import TestCase, main
+
+from utils.metrics import Histogram, Registry
+
+
+logger = logging.getLogger()
+
+
+class TestHistogram(TestCase):
+
+    def test_percentile(self):
+        histogram = Histogram("request", buckets=(0.01, 0.1, 1.0))
+        for _ in range(90):
+            histogram.observe(0.005)
+        for _ in range(9):
+            histogram.observe(0.05)
+        histogram.observe(3.0)
+        assert histogram.count == 100
+        assert histogram.counts == [90, 9, 0, 1]
+        assert 0 < histogram.percentile(50) <= 0.01
+        assert 0.01 < histogram.percentile(95) <= 0.1
+        assert histogram.percentile(100) == 3.0
+        assert Histogram("empty").percentile(99) == 0.0
+
+    def test_threads(self):
+        histogram = Histogram("request")
+
+        def observe():
+            for _ in range(1000):
+                histogram.observe(0.001)
+
+        threads = [Thread(target=observe) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert histogram.count == sum(histogram.counts) == 8000
+
+
+class TestRegistry(TestCase):
+
+    def test_report(self):
+        registry = Registry()
+
+        @registry.timed("api.retrieve")
+        def retrieve(note_id: str) -> str:
+            return note_id
+
+        assert retrieve("001") == "001"
+        assert retrieve.__name__ == "retrieve"
+        registry.counter("http.bytes_sent").inc(2048)
+        registry.gauge("operations.queued").set(3)
+        assert registry.counter("http.bytes_sent") is registry.counter("http.bytes_sent")
+        report = registry.report()
+        logger.info(report)
+        assert "api.retrieve" in report
+        assert "2048" in report
+        assert "operations.queued" in report
+
+    def test_long_polls_apart(self):
+        registry = Registry()
+        registry.histogram("api.retrieve").observe(0.01)
+        registry.histogram("long_poll.api.changes").observe(25)
+        report = registry.report()
+        logger.info(report)
+        # The waits of the change feed are not mixed with the latencies of the other requests
+        assert report.index("api.retrieve") < report.index("long-poll") < report.index("long_poll.api.changes")
+        assert "long-poll" not in Registry().report()
+
+
+if __name__ == "__main__":
+    main()
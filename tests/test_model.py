@@ -1,9 +1,10 @@
 from importlib import import_module
 import logging
 from typing import Any
-from unittest import TestCase, main
+from unittest import TestCase, main, mock
 
 from models import Note, _Note
+from utils.tree.redblacktree import rbtree as RedBlackTree
 
 
 import_module("utils.logger.init")
@@ -191,5 +192,48 @@ class TestNote(TestCase):
         assert "_modificationDate" in note.d.__dict__
 
 
+class TestUpsert(TestCase):
+
+    def setUp(self):
+        self.patches = [
+            mock.patch.object(Note, "mapper_id_note", {}),
+            mock.patch.object(Note, "tree", RedBlackTree()),
+        ]
+        for patch in self.patches:
+            patch.start()
+        self.payload = {
+            "id": "c6efd3fb-2222-2222-2222-86e9441003d3",
+            "v": 1,
+            "d": {"tags": [], "content": "# SimplenoteTitle", "modificationDate": 1, "creationDate": 1},
+        }
+
+    def tearDown(self):
+        for patch in reversed(self.patches):
+            patch.stop()
+
+    def test_same_version(self):
+        note = Note.upsert(**self.payload)
+        d = note.d
+        note.d.content = "local edit"
+        assert Note.upsert(**dict(self.payload, d={"content": "# SimplenoteTitle"})) is note
+        # Same version, nothing is applied
+        assert note.d is d
+        assert note.d.content == "local edit"
+
+    def test_changed_fields(self):
+        note = Note.upsert(**self.payload)
+        d = note.d
+        changed = note.update(2, dict(self.payload["d"], tags=["work"], modificationDate=2))
+        assert sorted(changed) == ["modificationDate", "tags"]
+        assert note.d is d and note.v == 2
+        assert Note.tree.count == 1
+        assert Note.tree.find(2) is note
+        assert Note.tree.find(1) is None
+
+        # Fields missing from the payload are left alone
+        assert note.update(3, {"deleted": True}) == ["deleted"]
+        assert note.d.tags == ["work"] and note.d.content == "# SimplenoteTitle"
+
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,138 @@
+import logging
+import os
+import tempfile
+from unittest import TestCase, main, mock
+
+import sublime
+import sublime_plugin
+
+from models import IndexDiff
+from operations import OperationManager
+import settings
+import simplenotecommands
+from utils import trace
+from utils.scheduler import SyncScheduler
+
+
+logger = logging.getLogger()
+
+
+class TestSyncScheduler(TestCase):
+
+    def setUp(self):
+        self.now = 0.0
+        self.scheduler = SyncScheduler(30, 600, idle_timeout=900, clock=lambda: self.now)
+
+    def test_backoff(self):
+        intervals = []
+        for _ in range(7):
+            self.scheduler.synced(0)
+            intervals.append(self.scheduler.interval)
+        assert intervals == [60, 120, 240, 480, 600, 600, 600]
+        self.scheduler.synced(3)
+        assert self.scheduler.interval == 30
+        self.scheduler.synced(0)
+        self.scheduler.changed()
+        assert self.scheduler.interval == 30
+
+    def test_pause(self):
+        assert not self.scheduler.paused
+        self.scheduler.focus(False)
+        assert self.scheduler.paused
+        self.scheduler.focus(True)
+        self.now = 901
+        assert self.scheduler.paused
+        self.scheduler.touch()
+        assert not self.scheduler.paused
+
+    def test_wake(self):
+        assert self.scheduler.wake() is None
+        self.scheduler.synced(0)
+        self.scheduler.sleep()
+        self.now = 20
+        assert self.scheduler.wake() == 40
+        assert self.scheduler.wake() is None
+
+
+class TestSync(TestCase):
+
+    def setUp(self):
+        sublime.reset()
+        sublime_plugin.register(simplenotecommands.SimplenoteSyncCommand)
+        settings.reset()
+        self.settings = sublime.load_settings(settings.SIMPLENOTE_SETTINGS_FILE)
+        self.changes = 0
+        self.failure = None
+        self.patches = [
+            mock.patch.object(OperationManager, "add_operation", side_effect=self.run_operation),
+            mock.patch.object(simplenotecommands, "SIMPLENOTE_STARTED", True),
+            mock.patch.object(simplenotecommands, "SCHEDULER", SyncScheduler(clock=lambda: sublime.CLOCK.now / 1000)),
+        ]
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self):
+        for patch in reversed(self.patches):
+            patch.stop()
+        settings.reset()
+        sublime.reset()
+
+    def run_operation(self, operation):
+        if self.failure is not None:
+            operation.result = self.failure
+            operation.exception_callback(operation.result)
+            return
+        # Deleted notes count as changes without a view or a file to update
+        operation.result = IndexDiff([], [], [mock.Mock(filepath="") for _ in range(self.changes)])
+        operation.callback(operation.result, **operation.callback_kwargs)
+
+    def syncs(self) -> int:
+        return sum(1 for _, cmd, _ in sublime.commands if cmd == "simplenote_sync")
+
+    def test_idle_account(self):
+        self.settings.update({"sync_every": 30, "sync_every_max": 600, "sync_idle_pause": 0})
+        simplenotecommands.sync()
+        sublime.CLOCK.advance(2 * 3600 * 1000)
+        syncs = self.syncs()
+        logger.info("%s syncs in two hours without changes, %s at a fixed interval" % (syncs, 2 * 3600 // 30))
+        assert syncs < 2 * 3600 // 30 // 10
+
+        # A remote change brings the interval back to `sync_every`
+        self.changes = 1
+        sublime.CLOCK.advance(600 * 1000)
+        assert simplenotecommands.SCHEDULER.interval == 30
+
+    def test_paused(self):
+        self.settings.update({"sync_every": 30, "sync_every_max": 600, "sync_idle_pause": 0})
+        simplenotecommands.sync()
+        simplenotecommands.SCHEDULER.focus(False)
+        sublime.CLOCK.advance(3600 * 1000)
+        # The sync due 60s after the first one found the editor unfocused
+        assert self.syncs() == 1
+        assert sublime.CLOCK.pending == 0
+        simplenotecommands.SCHEDULER.focus(True)
+        simplenotecommands.resume_sync()
+        sublime.CLOCK.advance(0)
+        assert self.syncs() == 2
+
+    def test_disabled(self):
+        self.settings.update({"sync_every": 0})
+        simplenotecommands.sync()
+        sublime.CLOCK.advance(3600 * 1000)
+        assert self.syncs() == 1
+
+    def test_trace_failed_sync(self):
+        self.settings.update({"sync_every": 0, "trace_sync": True})
+        self.failure = IOError("offline")
+        self.addCleanup(trace.stop)
+        with tempfile.TemporaryDirectory() as tmp_dir, mock.patch.object(
+            simplenotecommands, "get_cache_filepath", lambda filename: os.path.join(tmp_dir, filename)
+        ), mock.patch.object(simplenotecommands.WRITER, "schedule", lambda fn, *args: fn(*args)):
+            simplenotecommands.sync()
+            # The tracer started by the sync does not keep recording until the next successful one
+            assert not trace.TRACER.enabled
+            assert os.path.exists(os.path.join(tmp_dir, simplenotecommands.SIMPLENOTE_TRACE_FILENAME))
+
+
+if __name__ == "__main__":
+    main()
@@ -2,7 +2,10 @@ import logging
 from typing import Any
 from unittest import TestCase
 
+import sublime
+
 from _config import CONFIG
+import settings
 from utils.tools import Json2Obj as Settings
 
 
@@ -32,3 +35,43 @@ class TestSettings(TestCase):
         assert isinstance(settings, dict)
         assert isinstance(settings, Settings)
         assert isinstance(settings.autostart, bool)
+
+
+class TestSnapshot(TestCase):
+
+    def setUp(self):
+        sublime.reset()
+        settings.reset()
+        self.settings = sublime.load_settings(settings.SIMPLENOTE_SETTINGS_FILE)
+
+    def tearDown(self):
+        settings.remove_listener("test")
+        settings.reset()
+        sublime.reset()
+
+    def test_defaults(self):
+        current = settings.snapshot()
+        assert current.errors == []
+        assert current.autosave_debounce_ms == 1000
+        assert current.conflict_preference is None
+        assert [extension for _, extension in current.title_extensions] == ["todo", "md"]
+        assert settings.snapshot() is current
+
+    def test_invalid(self):
+        self.settings.update({"sync_every": "30", "bulk_concurrency": 0, "title_extension_map": [{"title_regex": "["}]})
+        current = settings.snapshot()
+        assert current.sync_every == 0
+        assert current.bulk_concurrency == 9
+        assert current.title_extensions == []
+        assert len(current.errors) == 3
+
+    def test_on_change(self):
+        changes = []
+        settings.add_listener("test", lambda old, new: changes.append((old, new)))
+        first = settings.snapshot()
+        self.settings.set("on_conflict_use_server", True)
+        old, new = changes[-1]
+        assert old is first
+        assert settings.snapshot() is new
+        assert new.conflict_preference == "remote"
+        assert old.credentials == new.credentials
@@ -0,0 +1,435 @@
+import logging
+import os
+import tempfile
+import threading
+import time
+from unittest import TestCase, main, mock
+
+import sublime
+
+import api
+from api import URL, Simplenote
+from models import IndexDiff, Note
+from operations import BulkResult, ChangeFeed, MultipleNoteModifier, NotesIndicator, OperationManager
+from utils.simperium import Faults, SimperiumServer, SimperiumStore
+from utils.tree.redblacktree import rbtree as RedBlackTree
+
+
+logger = logging.getLogger()
+
+
+class TestSimperiumServer(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        cls.server = SimperiumServer(store=SimperiumStore({"user@example.com": "secret"})).start()
+        cls.patches = [
+            mock.patch.object(URL, "BASE", cls.server.url),
+            mock.patch.object(api, "SIMPLENOTE_TOKEN_FILE", os.path.join(cls.tmp_dir.name, "token.pkl")),
+        ]
+        for patch in cls.patches:
+            patch.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        for patch in cls.patches:
+            patch.stop()
+        cls.server.stop()
+        cls.tmp_dir.cleanup()
+
+    def setUp(self):
+        self.server.faults = Faults()
+        self.server.poll_timeout = 0.2
+        self.API = Simplenote(username="user@example.com", password="secret")
+        self.API._token = ""
+
+    def test_roundtrip(self):
+        status, msg, note = self.API.modify({"content": "SimplenoteTitle\n\nSimplenoteBody", "tags": []})
+        assert status == 0, msg
+        note_id = note["id"]
+        assert note["v"] == 1
+        status, msg, note = self.API.modify({"content": "SimplenoteTitle\n\nedited", "tags": []}, note_id)
+        assert note["v"] == 2
+        assert note["d"]["content"] == "SimplenoteTitle\n\nedited"
+
+        status, msg, note = self.API.retrieve(note_id, 1)
+        assert status == 0, msg
+        assert note["d"]["content"] == "SimplenoteTitle\n\nSimplenoteBody"
+
+        status, msg, index = self.API.index(limit=100, data=True)
+        assert status == 0, msg
+        entry = [entry for entry in index["index"] if entry["id"] == note_id][0]
+        assert entry["v"] == 2
+        assert entry["d"]["content"] == "SimplenoteTitle\n\nedited"
+
+        status, msg, _ = self.API.delete(note_id)
+        assert status == 0, msg
+        status, msg, _ = self.API.retrieve(note_id)
+        assert status == -1
+
+    def test_switch_account(self):
+        self.server.store.users["bob@example.com"] = "other"
+        self.addCleanup(self.server.store.users.pop, "bob@example.com")
+        status, msg, _ = self.API.index(limit=1)
+        assert status == 0, msg
+        # A new client once the credentials changed, as `Note.reset_api` leaves it
+        bob = Simplenote(username="bob@example.com", password="other")
+        status, msg, _ = bob.index(limit=1)
+        assert status == 0, msg
+        assert self.server.store.tokens[bob.token] == "bob@example.com"
+        assert Simplenote(username="bob@example.com", password="other").token == bob.token
+        # Another server never receives the stored token
+        with mock.patch.object(URL, "BASE", "http://127.0.0.1:1/1"), mock.patch.object(
+            Simplenote, "authenticate", return_value="0" * 32
+        ) as authenticate:
+            assert Simplenote(username="bob@example.com", password="other").token == "0" * 32
+        assert authenticate.call_count == 1
+
+    def test_version_conflict(self):
+        status, msg, note = self.API.modify({"content": "first"})
+        status, msg, _ = self.API.modify({"content": "stale"}, note["id"], version=note["v"] + 1)
+        assert status == -1
+        assert "412" in str(msg)
+
+    def test_index_pages(self):
+        store = SimperiumStore()
+        for index in range(25):
+            store.put("%03d" % index, {"content": str(index)})
+        page = store.index(10)
+        assert [entry["id"] for entry in page["index"]] == ["%03d" % index for index in range(10)]
+        assert "d" not in page["index"][0]
+        assert store.index(10, mark=page["mark"])["index"][0]["id"] == "010"
+        assert "mark" not in store.index(10, mark="020")
+
+    def test_wrong_password(self):
+        with self.assertRaises(IOError):
+            Simplenote.authenticate("user@example.com", "wrong")
+
+    def test_reauthenticate(self):
+        status, msg, _ = self.API.index(limit=1)
+        assert status == 0, msg
+        requests = self.API.session.stats["requests"]
+        self.server.store.expire_tokens()
+        status, msg, _ = self.API.index(limit=1)
+        assert status == 0, msg
+        # The rejected request, the authentication and the retry, all through the session
+        assert self.API.session.stats["requests"] == requests + 3
+
+    def test_faults(self):
+        self.API.index(limit=1)
+        self.server.faults.fail_next(1, 503)
+        status, msg, _ = self.API.index(limit=1)
+        assert status == -1
+        assert "503" in str(msg)
+
+        self.server.faults.latency = 0.05
+        start_time = time.perf_counter()
+        status, msg, _ = self.API.index(limit=1)
+        assert status == 0, msg
+        assert time.perf_counter() - start_time >= 0.05
+
+    def test_keep_alive(self):
+        self.API.index(limit=1)
+        connections = self.server.stats["connections"]
+        for _ in range(10):
+            self.API.index(limit=1)
+        logger.info(self.server.stats)
+        assert self.server.stats["connections"] == connections
+
+    def test_changes(self):
+        status, msg, index = self.API.index(limit=1)
+        cv = index["current"]
+        start_time = time.perf_counter()
+        status, msg, changes = self.API.changes(cv)
+        assert status == 0, msg
+        assert changes == []
+        assert time.perf_counter() - start_time >= 0.2
+
+        # The long-poll answers as soon as another client changes a note
+        self.server.poll_timeout = 5
+        timer = threading.Timer(0.05, self.server.store.put, ("001", {"content": "SimplenoteTitle"}))
+        timer.start()
+        start_time = time.perf_counter()
+        status, msg, changes = self.API.changes(cv)
+        assert status == 0, msg
+        assert time.perf_counter() - start_time < 1
+        assert [(change["id"], change["o"], change["ev"]) for change in changes] == [("001", "M", 1)]
+        assert changes[0]["d"]["content"] == "SimplenoteTitle"
+
+        self.server.store.delete("001")
+        status, msg, changes = self.API.changes(changes[-1]["cv"], data=False)
+        assert [(change["id"], change["o"]) for change in changes] == [("001", "-")]
+
+
+class TestIndexDiff(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.server = SimperiumServer().start()
+        self.patches = [
+            mock.patch.object(URL, "BASE", self.server.url),
+            mock.patch.object(api, "SIMPLENOTE_TOKEN_FILE", os.path.join(self.tmp_dir.name, "token.pkl")),
+            mock.patch.object(Note, "mapper_id_note", {}),
+            mock.patch.object(Note, "tree", RedBlackTree()),
+            mock.patch.object(Note, "cv", ""),
+        ]
+        for patch in self.patches:
+            patch.start()
+        Note._API = Simplenote(username="user@example.com", password="secret")
+        Note._API._token = ""
+        self.ids = ["00000000-0000-0000-0000-%012d" % index for index in range(3)]
+        for index, note_id in enumerate(self.ids):
+            self.server.store.put(note_id, {"content": "SimplenoteTitle %s" % index})
+
+    def tearDown(self):
+        self.server.stop()
+        Note.reset_api()
+        for patch in reversed(self.patches):
+            patch.stop()
+        self.tmp_dir.cleanup()
+
+    def test_diff(self):
+        diff = Note.sync_index(limit=10)
+        assert [note.id for note in diff.added] == self.ids
+        assert diff.changes == 3
+
+        diff = Note.sync_index(limit=10)
+        assert diff.changes == 0
+
+        self.server.store.put(self.ids[1], {"content": "SimplenoteTitle 1\n\nSimplenoteBody"})
+        self.server.store.delete(self.ids[2])
+        # Created locally, not uploaded yet
+        local = Note(id="00000000-0000-0000-0000-00000000000a", v=0, d={"content": "SimplenoteTitle"})
+        diff = Note.sync_index(limit=10)
+        assert [(note.id, note.v) for note in diff.changed] == [(self.ids[1], 2)]
+        assert [note.id for note in diff.deleted] == [self.ids[2]]
+        assert sorted(Note.mapper_id_note) == self.ids[:2] + [local.id]
+
+    def test_interrupted(self):
+        index = Note.API.index
+
+        def interrupted(limit, data, on_entry=None):
+            status, msg, result = index(limit, data)
+            on_entry(result["index"][0])
+            return -1, "Connection reset", []
+
+        with mock.patch.object(Note.API, "index", side_effect=interrupted):
+            diff = Note.sync_index(limit=10)
+        # The entry received before the failure is applied, nothing is deleted
+        assert [note.id for note in diff.added] == self.ids[:1]
+        assert diff.deleted == []
+
+    def test_incomplete(self):
+        Note.sync_index(limit=10)
+        self.server.store.delete(self.ids[0])
+        # A truncated index does not tell which notes were deleted
+        diff = Note.sync_index(limit=1)
+        assert "mark" in Note.API.index(limit=1)[2]
+        assert diff.deleted == []
+        assert self.ids[0] in Note.mapper_id_note
+
+    def sync(self, **kwargs) -> IndexDiff:
+        indicator = NotesIndicator(sync_note_number=10, **kwargs)
+        indicator.run()
+        assert isinstance(indicator.result, IndexDiff), indicator.result
+        return indicator.result
+
+    def test_selective(self):
+        self.sync()
+        with mock.patch.object(Note.API, "index", wraps=Note.API.index) as index, mock.patch.object(
+            Note.API, "retrieve", wraps=Note.API.retrieve
+        ) as retrieve:
+            diff = self.sync()
+            # An unchanged account costs one index request without data
+            assert diff.changes == 0
+            assert [call.args[:2] for call in index.call_args_list] == [(10, False)]
+            assert retrieve.call_count == 0
+
+            added = "00000000-0000-0000-0000-00000000000a"
+            self.server.store.put(added, {"content": "SimplenoteTitle a"})
+            self.server.store.put(self.ids[1], {"content": "SimplenoteTitle 1\n\nSimplenoteBody"})
+            self.server.store.delete(self.ids[2])
+            diff = self.sync()
+            assert sorted(call.args[0] for call in retrieve.call_args_list) == [self.ids[1], added]
+        assert [note.id for note in diff.added] == [added]
+        assert [(note.id, note.v) for note in diff.changed] == [(self.ids[1], 2)]
+        assert Note.mapper_id_note[self.ids[1]].d.content == "SimplenoteTitle 1\n\nSimplenoteBody"
+        assert [note.id for note in diff.deleted] == [self.ids[2]]
+
+    def test_selective_fallback(self):
+        self.sync()
+        for note_id in self.ids:
+            self.server.store.put(note_id, {"content": "SimplenoteTitle edited"})
+        with mock.patch.object(Note.API, "retrieve", wraps=Note.API.retrieve) as retrieve:
+            diff = self.sync(max_retrievals=2)
+        # Too many stale notes, the index with data replaces the retrievals
+        assert retrieve.call_count == 0
+        assert sorted(note.id for note in diff.changed) == self.ids
+
+
+class TestMultipleNoteModifier(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.server = SimperiumServer().start()
+        self.patches = [
+            mock.patch.object(URL, "BASE", self.server.url),
+            mock.patch.object(api, "SIMPLENOTE_TOKEN_FILE", os.path.join(self.tmp_dir.name, "token.pkl")),
+            mock.patch.object(Note, "mapper_id_note", {}),
+            mock.patch.object(Note, "tree", RedBlackTree()),
+            mock.patch.object(Note, "cv", ""),
+        ]
+        for patch in self.patches:
+            patch.start()
+        Note._API = Simplenote(username="user@example.com", password="secret")
+        Note._API._token = ""
+        self.ids = ["00000000-0000-0000-0000-%012d" % index for index in range(3)]
+        for index, note_id in enumerate(self.ids):
+            self.server.store.put(note_id, {"content": "SimplenoteTitle %s" % index, "tags": ["a"], "deleted": False})
+        Note.sync_index(limit=10)
+        self.notes = [Note.mapper_id_note[note_id] for note_id in self.ids]
+
+    def tearDown(self):
+        self.server.stop()
+        Note.reset_api()
+        for patch in reversed(self.patches):
+            patch.stop()
+        self.tmp_dir.cleanup()
+
+    def modify(self, notes, action: str, tag: str = "") -> BulkResult:
+        modifier = MultipleNoteModifier(notes, action=action, tag=tag, max_workers=1)
+        modifier.run()
+        assert isinstance(modifier.result, BulkResult), modifier.result
+        return modifier.result
+
+    def server_data(self, note_id: str):
+        found = self.server.store.get(note_id)
+        assert found is not None
+        return found[1]
+
+    def test_actions(self):
+        for action, tag, expected in (
+            ("trash", "", {"deleted": True, "tags": ["a"]}),
+            ("restore", "", {"deleted": False, "tags": ["a"]}),
+            ("tag", "b", {"deleted": False, "tags": ["a", "b"]}),
+            ("untag", "a", {"deleted": False, "tags": ["b"]}),
+        ):
+            result = self.modify(self.notes, action, tag)
+            assert len(result.succeeded) == 3 and result.failed == [], action
+            for note in self.notes:
+                data = self.server_data(note.id)
+                assert {"deleted": data["deleted"], "tags": data["tags"]} == expected, action
+                assert (note.d.deleted, note.d.tags) == (expected["deleted"], expected["tags"]), action
+
+    def test_already_in_state(self):
+        with mock.patch.object(Note.API, "modify", wraps=Note.API.modify) as modify:
+            result = self.modify(self.notes, "tag", "a")
+            assert len(result.succeeded) == 3
+            result = self.modify(self.notes, "restore")
+            assert len(result.succeeded) == 3
+        assert modify.call_count == 0
+
+    def test_newer_on_server(self):
+        stale, pending = self.notes[:2]
+        self.server.store.put(stale.id, {"content": "SimplenoteTitle 0\n\nedited", "tags": ["a", "c"]})
+        pending.content = "SimplenoteTitle 1\n\nnot uploaded"
+        result = self.modify([stale, pending], "tag", "b")
+        assert result.failed == []
+        # Neither the newer server content nor its tags are overwritten by the local copy
+        assert self.server_data(stale.id)["content"] == "SimplenoteTitle 0\n\nedited"
+        assert self.server_data(stale.id)["tags"] == ["a", "c", "b"]
+        assert (stale.v, stale.d.content) == (3, "SimplenoteTitle 0\n\nedited")
+        assert self.server_data(pending.id)["content"] == "SimplenoteTitle 1"
+
+    def test_failed(self):
+        self.server.faults.fail_next(1, 503)
+        result = self.modify(self.notes, "trash")
+        assert len(result.succeeded) == 2 and len(result.failed) == 1
+        note, err = result.failed[0]
+        assert note in self.notes and "503" in str(err)
+        assert not self.server_data(note.id)["deleted"]
+
+
+class TestChangeFeed(TestCase):
+
+    def setUp(self):
+        sublime.reset()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.server = SimperiumServer(poll_timeout=0.2).start()
+        self.patches = [
+            mock.patch.object(URL, "BASE", self.server.url),
+            mock.patch.object(api, "SIMPLENOTE_TOKEN_FILE", os.path.join(self.tmp_dir.name, "token.pkl")),
+            mock.patch.object(Note, "mapper_id_note", {}),
+            mock.patch.object(Note, "tree", RedBlackTree()),
+            mock.patch.object(Note, "cv", ""),
+            mock.patch.object(OperationManager, "add_operation", side_effect=self.run_operation),
+        ]
+        for patch in self.patches:
+            patch.start()
+        self.API = Simplenote(username="user@example.com", password="secret")
+        self.API._token = ""
+        Note._API = self.API
+        self.batches = []
+        self.feed = ChangeFeed(lambda updated, removed: self.batches.append((updated, removed)))
+
+    def tearDown(self):
+        self.feed.stop()
+        self.server.stop()
+        self.feed.join(5)
+        Note.reset_api()
+        for patch in reversed(self.patches):
+            patch.stop()
+        sublime.reset()
+        self.tmp_dir.cleanup()
+
+    def run_operation(self, operation):
+        # Like the operation manager, on the main thread that queued it
+        assert threading.current_thread() is threading.main_thread()
+        operation.start()
+        operation.join()
+
+    def wait_for(self, predicate, timeout: float = 5):
+        deadline = time.perf_counter() + timeout
+        while not predicate():
+            assert time.perf_counter() < deadline, "timed out"
+            time.sleep(0.01)
+            sublime.CLOCK.advance(0)
+
+    def test_feed(self):
+        note_id = "00000000-0000-0000-0000-000000000001"
+        self.server.store.put(note_id, {"content": "SimplenoteTitle\n\nSimplenoteBody"})
+        Note.index(limit=10)
+        assert Note.mapper_id_note[note_id].v == 1
+        self.feed.start()
+        self.wait_for(lambda: self.feed.connected)
+
+        with mock.patch.object(Note, "apply_changes", wraps=Note.apply_changes) as apply_changes:
+            self.server.store.put(note_id, {"content": "SimplenoteTitle\n\nedited"})
+            self.wait_for(lambda: self.batches)
+        # Fetched on the feed thread, applied by a queued operation
+        assert apply_changes.call_count == 1
+        assert OperationManager.add_operation.call_count == 1
+        updated, removed = self.batches.pop()
+        assert [note.id for note in updated] == [note_id] and removed == []
+        note = Note.mapper_id_note[note_id]
+        assert (note.v, note.d.content) == (2, "SimplenoteTitle\n\nedited")
+        # Not materialized yet, the callback merges it like a sync would
+        assert note.need_flush
+
+        self.server.store.delete(note_id)
+        self.wait_for(lambda: self.batches)
+        assert note_id not in Note.mapper_id_note
+
+    def test_fallback(self):
+        Note.cv = "%024x" % 0
+        self.feed.start()
+        self.wait_for(lambda: self.feed.connected)
+        self.server.faults.fail_next(100, 503)
+        self.wait_for(lambda: not self.feed.connected)
+        self.server.faults = Faults()
+        self.wait_for(lambda: self.feed.connected)
+
+
+if __name__ == "__main__":
+    main()
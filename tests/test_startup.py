@@ -0,0 +1,58 @@
+import logging
+import os
+import sys
+import tempfile
+from unittest import TestCase, main
+
+from utils import startup
+
+
+logger = logging.getLogger()
+
+
+class TestImportTimer(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        for name in ("timed_plugin", "timed_plugin_extra", "foreign_package"):
+            with open(os.path.join(self.tmp_dir.name, name + ".py"), "w") as fh:
+                fh.write("VALUE = %r\n" % name)
+        sys.path.insert(0, self.tmp_dir.name)
+        self.installed = startup.TIMER in sys.meta_path
+        self.prefixes = startup.TIMER.prefixes
+
+    def tearDown(self):
+        startup.uninstall()
+        if self.installed:
+            startup.install(self.prefixes)
+        sys.path.remove(self.tmp_dir.name)
+        for name in ("timed_plugin", "timed_plugin_extra", "foreign_package"):
+            sys.modules.pop(name, None)
+            startup.TIMER.costs.pop(name, None)
+        self.tmp_dir.cleanup()
+
+    def test_prefixes(self):
+        timer = startup.install(prefixes=("", "timed_plugin"))
+        assert sys.meta_path[0] is timer
+        import foreign_package
+        import timed_plugin
+        import timed_plugin_extra
+
+        assert "timed_plugin" in timer.costs
+        # Neither another package of the host, nor one only sharing the beginning of the name
+        assert "foreign_package" not in timer.costs and "timed_plugin_extra" not in timer.costs
+        assert not isinstance(foreign_package.__spec__.loader, startup._TimedLoader)
+        assert isinstance(timed_plugin.__spec__.loader, startup._TimedLoader)
+        assert timed_plugin_extra.VALUE == "timed_plugin_extra"
+
+    def test_uninstall(self):
+        startup.install(prefixes=("timed_plugin",))
+        startup.uninstall()
+        assert startup.TIMER not in sys.meta_path
+        import timed_plugin
+
+        assert "timed_plugin" not in startup.TIMER.costs
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+import json
+import logging
+import os
+import tempfile
+from threading import Thread
+from unittest import TestCase, main
+
+from utils.trace import Tracer
+
+
+logger = logging.getLogger()
+
+
+class TestTracer(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.filepath = os.path.join(self.tmp_dir.name, "sync.trace.json")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_disabled(self):
+        tracer = Tracer()
+        with tracer.span("SimplenoteSyncCommand.run"):
+            pass
+        assert tracer.stop() == []
+
+    def test_save(self):
+        tracer = Tracer()
+
+        @tracer.traced()
+        def on_note_changed(note_id: str) -> str:
+            with tracer.span("Note.write", id=note_id):
+                return note_id
+
+        tracer.start()
+        with tracer.span("SimplenoteSyncCommand.merge_note", notes=2):
+            on_note_changed("001")
+            thread = Thread(target=on_note_changed, args=("002",), name="SimplenoteWriter_0")
+            thread.start()
+            thread.join()
+        with self.assertRaises(ValueError):
+            with tracer.span("json.loads"):
+                raise ValueError("Expecting value")
+        tracer.save(self.filepath)
+        with tracer.span("after save"):
+            pass
+
+        with open(self.filepath) as fh:
+            trace = json.load(fh)
+        events = trace["traceEvents"]
+        logger.info(events)
+        spans = [event for event in events if event["ph"] == "X"]
+        names = [event["name"] for event in spans]
+        assert names.count("Note.write") == 2
+        assert "after save" not in names
+        merge = spans[names.index("SimplenoteSyncCommand.merge_note")]
+        assert all(merge["ts"] <= event["ts"] and event["dur"] <= merge["dur"] for event in spans[:4])
+        assert merge["args"] == {"notes": 2}
+        assert "Expecting value" in spans[names.index("json.loads")]["args"]["error"]
+        assert len({event["tid"] for event in spans}) == 2
+        thread_names = {event["args"]["name"] for event in events if event["ph"] == "M"}
+        assert "SimplenoteWriter_0" in thread_names
+
+
+if __name__ == "__main__":
+    main()
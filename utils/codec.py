@@ -0,0 +1,89 @@
+"""
+JSON codec of the request and response bodies.
+
+`orjson` is used when it is installed, the standard `json` module otherwise. `dumps` returns
+UTF-8 bytes ready to be sent, `loads` takes bytes or str and raises a `ValueError` subclass
+on invalid JSON whatever the backend. `PARSES_BYTES` tells whether `loads` reads bytes without
+decoding them to a str first.
+"""
+
+import json
+import logging
+from typing import Any, Callable, Dict, Optional, Tuple, Union
+
+
+__all__ = [
+    "NAME",
+    "PARSES_BYTES",
+    "loads",
+    "dumps",
+    "use",
+    "available",
+]
+
+
+logger = logging.getLogger()
+
+
+Loads = Callable[[Union[bytes, str]], Any]
+Dumps = Callable[[Any], bytes]
+
+
+Backend = Tuple[Loads, Dumps, bool]
+
+
+def _orjson() -> Backend:
+    import orjson
+
+    return orjson.loads, orjson.dumps, True
+
+
+def _json() -> Backend:
+    def dumps(obj: Any) -> bytes:
+        # Any keyword argument would build a new encoder per call instead of the cached default one
+        return json.dumps(obj).encode()
+
+    # `json.loads` decodes bytes to a str before parsing
+    return json.loads, dumps, False
+
+
+# In order of preference
+_BACKENDS: Dict[str, Callable[[], Backend]] = {
+    "orjson": _orjson,
+    "json": _json,
+}
+
+NAME = ""
+PARSES_BYTES = False
+loads: Loads = json.loads
+dumps: Dumps = _json()[1]
+
+
+def available() -> Dict[str, Backend]:
+    """The (loads, dumps, parses_bytes) of every installed backend"""
+    backends = {}
+    for name, load in _BACKENDS.items():
+        try:
+            backends[name] = load()
+        except ImportError:
+            continue
+    return backends
+
+
+def use(name: Optional[str] = None) -> str:
+    """Switch to the backend `name`, or to the fastest installed one, returns its name"""
+    global NAME, PARSES_BYTES, loads, dumps
+    for _name in [name] if name else list(_BACKENDS):
+        if _name not in _BACKENDS:
+            raise ValueError("Unknown JSON codec: %s" % _name)
+        try:
+            loads, dumps, PARSES_BYTES = _BACKENDS[_name]()
+        except ImportError:
+            continue
+        NAME = _name
+        logger.debug("JSON codec: %s" % NAME)
+        return NAME
+    raise ImportError("JSON codec is not installed: %s" % name)
+
+
+use()
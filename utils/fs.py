@@ -0,0 +1,138 @@
+"""
+File system helpers for the materialized note files.
+"""
+
+from concurrent.futures import Future, ThreadPoolExecutor
+import hashlib
+import logging
+import os
+import tempfile
+from threading import Lock
+from typing import AbstractSet, Any, Callable, Dict, Optional, Tuple
+
+
+__all__ = [
+    "atomic_write",
+    "remove_orphans",
+    "FileWriter",
+]
+
+
+logger = logging.getLogger()
+
+
+def atomic_write(filepath: str, data: bytes):
+    """Write to a temporary file next to `filepath` and rename it into place"""
+    directory, filename = os.path.split(filepath)
+    fd, tmp_filepath = tempfile.mkstemp(prefix=".%s." % filename, suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            fh.write(data)
+        os.replace(tmp_filepath, filepath)
+    except BaseException:
+        try:
+            os.remove(tmp_filepath)
+        except OSError:
+            pass
+        raise
+
+
+def remove_orphans(directory: str, expected: AbstractSet[str], keep: Optional[Callable[[str], bool]] = None) -> int:
+    """Remove the files of `directory` whose name is not in `expected`, returns how many were removed.
+
+    `keep` is asked again about each of them right before it is removed, for names expected since.
+    """
+    removed = 0
+    try:
+        entries = os.scandir(directory)
+    except FileNotFoundError:
+        return removed
+    with entries:
+        for entry in entries:
+            if entry.name in expected or not entry.is_file(follow_symlinks=False):
+                continue
+            if keep is not None and keep(entry.name):
+                continue
+            try:
+                os.remove(entry.path)
+                removed += 1
+            except OSError as err:
+                logger.warning(err)
+    return removed
+
+
+def _digest(data: bytes) -> bytes:
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+class FileWriter:
+    """Materialize files atomically, skipping the write when the file already holds the data.
+
+    The digest, size and mtime of every written file are remembered, so an unchanged
+    file is recognized from a single `stat` without reading it back. Writes can be
+    queued to one background thread, keeping them in order and off the UI thread.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        # filepath -> (digest, size, mtime_ns)
+        self._written: Dict[str, Tuple[bytes, int, int]] = {}
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def is_current(self, filepath: str, data: bytes, digest: Optional[bytes] = None) -> bool:
+        digest = digest or _digest(data)
+        try:
+            stat = os.stat(filepath)
+        except FileNotFoundError:
+            return False
+        if stat.st_size != len(data):
+            return False
+        with self._lock:
+            written = self._written.get(filepath)
+        if written is not None and written == (digest, stat.st_size, stat.st_mtime_ns):
+            return True
+        # Unknown or modified by someone else since, compare the actual content
+        with open(filepath, "rb") as fh:
+            current = _digest(fh.read()) == digest
+        if current:
+            self._remember(filepath, digest)
+        return current
+
+    def _remember(self, filepath: str, digest: bytes):
+        stat = os.stat(filepath)
+        with self._lock:
+            self._written[filepath] = (digest, stat.st_size, stat.st_mtime_ns)
+
+    def write(self, filepath: str, data: bytes) -> bool:
+        """Write `data` unless the file already holds it, returns whether the file was written"""
+        digest = _digest(data)
+        if self.is_current(filepath, data, digest):
+            return False
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        atomic_write(filepath, data)
+        self._remember(filepath, digest)
+        return True
+
+    def schedule(self, fn: Callable[..., Any], *args: Any) -> Future:
+        """Run `fn` on the background writer thread, after the writes queued before it"""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="SimplenoteWriter")
+            executor = self._executor
+        return executor.submit(fn, *args)
+
+    def submit(self, filepath: str, data: bytes) -> "Future[bool]":
+        """Queue `write` on the background writer thread"""
+        return self.schedule(self.write, filepath, data)
+
+    def move(self, src: str, dst: str):
+        """Rename a file, keeping what is known about its content"""
+        os.replace(src, dst)
+        with self._lock:
+            written = self._written.pop(src, None)
+            if written is not None:
+                self._written[dst] = written
+
+    def forget(self, filepath: str):
+        with self._lock:
+            self._written.pop(filepath, None)
@@ -0,0 +1,116 @@
+"""
+Write-ahead journal of local note changes.
+
+Every change is appended (and fsynced) before it is uploaded, and marked as committed
+once the server accepted it. Whatever is still pending after a crash or an offline
+session is replayed later, coalesced to one entry per note.
+"""
+
+import json
+import logging
+import os
+from threading import Lock
+from typing import Any, Dict, List
+
+
+__all__ = [
+    "Journal",
+]
+
+
+logger = logging.getLogger()
+
+
+class Journal:
+    """Append-only journal file, with an in-memory index of the pending entry of each note"""
+
+    def __init__(self, filepath: str):
+        self.filepath = filepath
+        self._lock = Lock()
+        self._seq = 0
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        self._load()
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def _load(self):
+        try:
+            with open(self.filepath, "rb+") as fh:
+                data = fh.read()
+                end = data.rfind(b"\n") + 1
+                if end < len(data):
+                    # The last line of an interrupted write, cut so the next append starts on a fresh line
+                    logger.warning("Dropping incomplete journal line: %r" % data[end : end + 80])
+                    fh.truncate(end)
+        except FileNotFoundError:
+            return
+        for line in data[:end].decode("utf-8", "replace").splitlines():
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                logger.warning("Skipping corrupted journal line: %r" % line[:80])
+                continue
+            self._apply(entry)
+
+    def _apply(self, entry: Dict[str, Any]):
+        self._seq = max(self._seq, entry.get("seq", 0))
+        note_id = entry["id"]
+        pending = self._pending.get(note_id)
+        if "commit" in entry:
+            if pending and pending["seq"] <= entry["commit"]:
+                del self._pending[note_id]
+            return
+        if pending:
+            # Coalesce: keep the base of the first pending change, the data of the last one
+            entry = dict(entry, v=pending["v"], base=pending["base"])
+        self._pending[note_id] = entry
+
+    def _write(self, *entries: Dict[str, Any]):
+        with open(self.filepath, "a", encoding="utf-8") as fh:
+            for entry in entries:
+                fh.write(json.dumps(entry) + "\n")
+            fh.flush()
+            os.fsync(fh.fileno())
+
+    def append(self, note_id: str, v: int, base: str, d: Dict[str, Any]) -> int:
+        """Durably record a local change
+
+        Arguments:
+            - note_id (string): ID of the changed note
+            - v (int): server version the change is based on
+            - base (string): content of that version, used to merge on replay
+            - d (dict): note data to upload
+
+        Returns:
+            The sequence number of the entry, to pass to `commit`
+        """
+        with self._lock:
+            self._seq += 1
+            entry = {"seq": self._seq, "id": note_id, "v": v, "base": base, "d": d}
+            self._write(entry)
+            self._apply(entry)
+            return self._seq
+
+    def commit(self, note_id: str, seq: int):
+        """Mark every change of the note up to `seq` as uploaded"""
+        with self._lock:
+            entry = {"id": note_id, "commit": seq}
+            self._write(entry)
+            self._apply(entry)
+
+    def pending(self) -> List[Dict[str, Any]]:
+        """Return one coalesced entry per note still waiting for upload, oldest first"""
+        with self._lock:
+            return sorted(self._pending.values(), key=lambda entry: entry["seq"])
+
+    def compact(self):
+        """Rewrite the journal with the pending entries only"""
+        with self._lock:
+            tmp_filepath = self.filepath + ".tmp"
+            with open(tmp_filepath, "w", encoding="utf-8") as fh:
+                for entry in sorted(self._pending.values(), key=lambda entry: entry["seq"]):
+                    fh.write(json.dumps(entry) + "\n")
+                fh.flush()
+                os.fsync(fh.fileno())
+            os.replace(tmp_filepath, self.filepath)
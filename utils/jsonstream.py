@@ -0,0 +1,162 @@
+"""
+Incremental parser of a JSON object holding one large array, e.g. an index response.
+
+`feed` takes the body bytes as they are received and returns the elements of the array
+completed so far, the other members of the object are collected in `fields`. Only the
+unparsed tail of the body is kept, memory is bounded by the largest element and a chunk.
+"""
+
+import codecs
+import json
+import logging
+from typing import Any, Dict, List, Tuple
+
+
+__all__ = [
+    "ArrayStreamParser",
+]
+
+
+logger = logging.getLogger()
+
+
+_WHITESPACE = " \t\n\r"
+_DELIMITERS = ",]}" + _WHITESPACE
+_DECODER = json.JSONDecoder()
+
+
+class _Incomplete(Exception):
+    """The next token is not fully received yet"""
+
+
+class ArrayStreamParser:
+
+    # What the parser expects next
+    _OBJECT, _KEY, _COLON, _VALUE, _ITEM, _ITEM_END, _MEMBER_END, _DONE = range(8)
+
+    def __init__(self, key: str = "index", encoding: str = "utf-8"):
+        self.key = key
+        # Members of the object other than the array
+        self.fields: Dict[str, Any] = {}
+        self.count = 0
+        self._decoder = codecs.getincrementaldecoder(encoding)()
+        self._buffer = ""
+        self._pos = 0
+        # Text received since the last attempt, joined to the buffer on the next one
+        self._chunks: List[str] = []
+        self._pending = 0
+        self._state = self._OBJECT
+        self._member = ""
+        self._final = False
+        # Pending characters needed before parsing again, doubles after each incomplete attempt
+        self._retry_at = 0
+
+    @property
+    def done(self) -> bool:
+        return self._state == self._DONE
+
+    def feed(self, chunk: bytes) -> List[Any]:
+        """Parse the next bytes of the body, returns the array elements they completed"""
+        text = self._decoder.decode(chunk)
+        self._chunks.append(text)
+        self._pending += len(text)
+        if len(self._buffer) - self._pos + self._pending < self._retry_at:
+            # Small chunks would parse a large element again and again
+            return []
+        return self._parse()
+
+    def close(self) -> List[Any]:
+        """The end of the body, raises a `ValueError` if the object is incomplete or invalid"""
+        self._chunks.append(self._decoder.decode(b"", final=True))
+        self._final = True
+        items = self._parse()
+        if not self.done:
+            raise ValueError("JSON body ended before the end of the object: %r" % self._buffer[-80:])
+        return items
+
+    def _parse(self) -> List[Any]:
+        self._buffer = self._buffer[self._pos :] + "".join(self._chunks)
+        self._pos = 0
+        self._chunks = []
+        self._pending = 0
+        items = []
+        while not self.done:
+            try:
+                self._step(items)
+            except _Incomplete:
+                self._retry_at = 2 * (len(self._buffer) - self._pos)
+                break
+        return items
+
+    def _next(self) -> str:
+        """Skip whitespace, returns the next character without consuming it"""
+        pos, buffer = self._pos, self._buffer
+        while pos < len(buffer) and buffer[pos] in _WHITESPACE:
+            pos += 1
+        self._pos = pos
+        if pos == len(buffer):
+            if self._final:
+                raise ValueError("JSON body ended before the end of the object")
+            raise _Incomplete()
+        return buffer[pos]
+
+    def _value(self) -> Tuple[Any, int]:
+        try:
+            value, end = _DECODER.raw_decode(self._buffer, self._pos)
+        except json.JSONDecodeError:
+            if self._final:
+                raise
+            raise _Incomplete()
+        # A number is complete once followed by a delimiter, "1." may go on as "1.5" in the next chunk
+        if isinstance(value, (int, float)) and not self._final:
+            if end == len(self._buffer) or self._buffer[end] not in _DELIMITERS:
+                raise _Incomplete()
+        return value, end
+
+    def _expect(self, char: str, expected: str):
+        if char not in expected:
+            raise ValueError("Expected one of %r at %r" % (expected, self._buffer[self._pos : self._pos + 80]))
+
+    def _step(self, items: List[Any]):
+        state = self._state
+        char = self._next()
+        if state == self._OBJECT:
+            self._expect(char, "{")
+            self._pos += 1
+            self._state = self._KEY
+        elif state == self._KEY:
+            if char == "}":
+                self._pos += 1
+                self._state = self._DONE
+                return
+            self._expect(char, '"')
+            self._member, self._pos = self._value()
+            self._state = self._COLON
+        elif state == self._COLON:
+            self._expect(char, ":")
+            self._pos += 1
+            self._state = self._VALUE
+        elif state == self._VALUE:
+            if self._member == self.key and char == "[":
+                self._pos += 1
+                self._state = self._ITEM
+                return
+            self.fields[self._member], self._pos = self._value()
+            self._state = self._MEMBER_END
+        elif state == self._ITEM:
+            if char == "]":
+                self._pos += 1
+                self._state = self._MEMBER_END
+                return
+            item, self._pos = self._value()
+            self.count += 1
+            items.append(item)
+            self._state = self._ITEM_END
+        elif state == self._ITEM_END:
+            self._expect(char, ",]")
+            self._pos += 1
+            self._state = self._ITEM if char == "," else self._MEMBER_END
+        elif state == self._MEMBER_END:
+            self._expect(char, ",}")
+            self._pos += 1
+            self._state = self._KEY if char == "," else self._DONE
@@ -1,9 +1,22 @@
+import gzip
+import logging
 from logging import LogRecord, StreamHandler
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
+import os
 from pprint import pformat
-from typing import Any, Callable, Dict, Tuple
+from queue import SimpleQueue
+import shutil
+import threading
+from typing import Any, BinaryIO, Callable, Dict, Optional, Tuple
 
 
-__all__ = ["JsonHandler"]
+__all__ = [
+    "JsonHandler",
+    "AsyncQueueHandler",
+    "enqueue_handlers",
+    "LevelRoutingHandler",
+    "LazyTimedRotatingFileHandler",
+]
 
 
 class JsonHandler(StreamHandler):
@@ -23,6 +36,179 @@ class JsonHandler(StreamHandler):
         # pprint(_dict)
 
 
+class AsyncQueueHandler(QueueHandler):
+    """Put records on a queue, the wrapped handlers run on one background listener thread.
+
+    Records are passed as is instead of being pre-formatted like `QueueHandler.prepare`
+    does: the queue never leaves the process, so filters, formatting, highlighting and
+    file I/O all happen on the listener thread. The listener starts with the first record.
+    """
+
+    def __init__(self, *handlers: logging.Handler):
+        queue: SimpleQueue = SimpleQueue()
+        super().__init__(queue)  # type: ignore
+        self.listener = QueueListener(queue, *handlers, respect_handler_level=True)
+        self._started = False
+        self._lock_start = threading.Lock()
+
+    def prepare(self, record: LogRecord) -> LogRecord:
+        return record
+
+    def enqueue(self, record: LogRecord):
+        if not self._started:
+            with self._lock_start:
+                if not self._started:
+                    self.listener.start()
+                    self._started = True
+        super().enqueue(record)
+
+    def flush(self):
+        """Wait until every queued record went through the handlers"""
+        if self._started:
+            self.listener.stop()
+            self._started = False
+
+    def close(self):
+        self.flush()
+        for handler in self.listener.handlers:
+            handler.close()
+        super().close()
+
+
+def enqueue_handlers(logger: logging.Logger) -> Optional[AsyncQueueHandler]:
+    """Move the handlers of `logger` behind an `AsyncQueueHandler`"""
+    handlers = [handler for handler in logger.handlers if not isinstance(handler, AsyncQueueHandler)]
+    if not handlers:
+        return None
+    for handler in handlers:
+        logger.removeHandler(handler)
+    queue_handler = AsyncQueueHandler(*handlers)
+    logger.addHandler(queue_handler)
+    return queue_handler
+
+
+class LazyTimedRotatingFileHandler(TimedRotatingFileHandler):
+    """`TimedRotatingFileHandler` creating the directory of its file when it opens it, not at startup"""
+
+    def _open(self):
+        os.makedirs(os.path.dirname(self.baseFilename), exist_ok=True)
+        return super()._open()
+
+
+class _LevelFile:
+    """One rotating log file of `LevelRoutingHandler`"""
+
+    def __init__(self, filename: str):
+        self.filename: str = os.path.abspath(filename)
+        self.stream: Optional[BinaryIO] = None
+        self.size: int = 0
+
+    def open(self) -> BinaryIO:
+        if self.stream is None:
+            os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+            self.stream = open(self.filename, "ab")
+            self.size = self.stream.tell()
+        return self.stream
+
+    def close(self):
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+
+
+class LevelRoutingHandler(logging.Handler):
+    """Write each record to the file of its exact level, records of other levels are dropped.
+
+    Replaces one file handler per level guarded by a `LevelMatchFilter`: the record is
+    routed with one dict lookup and formatted once. A file is rotated when it would grow
+    past `maxBytes`, keeping `backupCount` archives, gzipped if `compress` is set.
+    """
+
+    terminator = "\n"
+
+    def __init__(
+        self,
+        filenames: Dict[str, str],
+        maxBytes: int = 0,
+        backupCount: int = 0,
+        encoding: str = "utf8",
+        compress: bool = False,
+        delay: bool = True,
+        level: int = logging.NOTSET,
+    ):
+        super().__init__(level)
+        self.maxBytes: int = maxBytes
+        self.backupCount: int = backupCount
+        self.encoding: str = encoding
+        self.compress: bool = compress
+        # levelno -> file, `filenames` is keyed by level name
+        self.files: Dict[int, _LevelFile] = {}
+        for level_name, filename in filenames.items():
+            levelno = logging.getLevelName(level_name.upper())
+            if not isinstance(levelno, int):
+                raise ValueError(f"Invalid level: {level_name}")
+            self.files[levelno] = _LevelFile(filename)
+        if not delay:
+            for level_file in self.files.values():
+                level_file.open()
+
+    def handle(self, record: LogRecord) -> bool:
+        if record.levelno not in self.files:
+            return False
+        return super().handle(record)
+
+    def emit(self, record: LogRecord) -> None:
+        level_file = self.files.get(record.levelno)
+        if level_file is None:
+            return
+        try:
+            data = (self.format(record) + self.terminator).encode(self.encoding, "backslashreplace")
+            stream = level_file.open()
+            if self.maxBytes > 0 and level_file.size and level_file.size + len(data) > self.maxBytes:
+                self.rollover(level_file)
+                stream = level_file.open()
+            stream.write(data)
+            stream.flush()
+            level_file.size += len(data)
+        except Exception:
+            self.handleError(record)
+
+    def archive_name(self, filename: str, index: int) -> str:
+        return "%s.%d%s" % (filename, index, ".gz" if self.compress else "")
+
+    def rollover(self, level_file: _LevelFile):
+        """Shift the archives of `level_file` by one and start an empty file"""
+        level_file.close()
+        filename = level_file.filename
+        if self.backupCount > 0:
+            for index in range(self.backupCount - 1, 0, -1):
+                src = self.archive_name(filename, index)
+                if os.path.exists(src):
+                    os.replace(src, self.archive_name(filename, index + 1))
+            dst = self.archive_name(filename, 1)
+            if self.compress:
+                with open(filename, "rb") as src_fh, gzip.open(dst, "wb") as dst_fh:
+                    shutil.copyfileobj(src_fh, dst_fh)
+                os.remove(filename)
+            else:
+                os.replace(filename, dst)
+        else:
+            os.remove(filename)
+        level_file.size = 0
+
+    def flush(self):
+        with self.lock:  # type: ignore
+            for level_file in self.files.values():
+                if level_file.stream is not None:
+                    level_file.stream.flush()
+
+    def close(self):
+        with self.lock:  # type: ignore
+            for level_file in self.files.values():
+                level_file.close()
+        super().close()
+
+
 if __name__ == "__main__":
     import logging.config
 
@@ -2,17 +2,25 @@ import logging
 import logging.config
 import os
 import sys
+from typing import Any, Dict, Optional
 
 from . import lexers
+from .handlers import AsyncQueueHandler, enqueue_handlers
 
 
 ENV = os.getenv("ENV")
 BASE_DIR: str = os.getenv("BASE_DIR", os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 if BASE_DIR not in sys.path:
     sys.path.insert(0, BASE_DIR)
+# Created by the handlers when they write the first record
 LOG_DIR: str = os.path.join(BASE_DIR, "logs")
 LOG_LEVEL: str = os.getenv("LOG_LEVEL", "WARNING")
 LOG_BACKUP_COUNT: int = int(os.getenv("LOG_BACKUP_COUNT", 5))
+LOG_MAX_BYTES: int = int(os.getenv("LOG_MAX_BYTES", 5 * 1024 * 1024))
+# Gzip the rotated log files
+LOG_COMPRESS: bool = os.getenv("LOG_COMPRESS", "0") != "0"
+# Run the root handlers on a background thread, set to 0 to log synchronously
+LOG_QUEUE: bool = os.getenv("LOG_QUEUE", "1") != "0"
 LOG_FORMATTER = "standard"
 LOG_FILTERS = []
 if ENV == "development":
@@ -57,13 +65,14 @@ LOG_CONFIG = {
             # Default is stderr
             # 'stream': 'ext://sys.stdout',
             # 'class': 'logging.StreamHandler',
-            "class": "logging.handlers.TimedRotatingFileHandler",
+            "class": "utils.logger.handlers.LazyTimedRotatingFileHandler",
             "filename": f"{LOG_DIR}/default.log",
             "when": "midnight",
             # "interval": 1,
             "backupCount": LOG_BACKUP_COUNT,
             "encoding": "utf8",
-            # "delay": False,
+            # Open the file on the first record, not at startup
+            "delay": True,
             # "utc": False,
             # "atTime": None,
             # "errors": None,
@@ -71,82 +80,23 @@ LOG_CONFIG = {
             "formatter": "standard",
             "filters": ["default"],
         },
-        "info": {
-            # Default is stderr
-            # 'stream': 'ext://sys.stdout',
-            # 'class': 'logging.StreamHandler',
-            "class": "logging.handlers.TimedRotatingFileHandler",
-            "filename": f"{LOG_DIR}/info.log",
-            "when": "midnight",
-            # "interval": 1,
+        "levels": {
+            # One file per level, a record goes to the file of its exact level
+            "()": "utils.logger.handlers.LevelRoutingHandler",
+            "filenames": {
+                "INFO": f"{LOG_DIR}/info.log",
+                "WARNING": f"{LOG_DIR}/warning.log",
+                "ERROR": f"{LOG_DIR}/error.log",
+                "CRITICAL": f"{LOG_DIR}/critical.log",
+            },
+            "maxBytes": LOG_MAX_BYTES,
             "backupCount": LOG_BACKUP_COUNT,
+            "compress": LOG_COMPRESS,
             "encoding": "utf8",
-            # "delay": False,
-            # "utc": False,
-            # "atTime": None,
-            # "errors": None,
+            # Open the files on the first record, not at startup
+            "delay": True,
             "level": "INFO",
             "formatter": "standard",
-            # 'maxBytes': 5*1024*1024,
-            "filters": ["info"],
-        },
-        "warning": {
-            # Default is stderr
-            # 'stream': 'ext://sys.stdout',
-            # 'class': 'logging.StreamHandler',
-            "class": "logging.handlers.TimedRotatingFileHandler",
-            "filename": f"{LOG_DIR}/warning.log",
-            "when": "midnight",
-            # "interval": 1,
-            "backupCount": LOG_BACKUP_COUNT,
-            "encoding": "utf8",
-            # "delay": False,
-            # "utc": False,
-            # "atTime": None,
-            # "errors": None,
-            "level": "WARNING",
-            "formatter": "standard",
-            # 'maxBytes': 5*1024*1024,
-            "filters": ["warning"],
-        },
-        "error": {
-            # Default is stderr
-            # 'stream': 'ext://sys.stdout',
-            # 'class': 'logging.StreamHandler',
-            "class": "logging.handlers.TimedRotatingFileHandler",
-            "filename": f"{LOG_DIR}/error.log",
-            "when": "midnight",
-            # "interval": 1,
-            "backupCount": LOG_BACKUP_COUNT,
-            "encoding": "utf8",
-            # "delay": False,
-            # "utc": False,
-            # "atTime": None,
-            # "errors": None,
-            "level": "ERROR",
-            "formatter": "standard",
-            # 'maxBytes': 5*1024*1024,
-            "filters": ["error"],
-        },
-        "critical": {
-            "level": "CRITICAL",
-            # Default is stderr
-            # 'stream': 'ext://sys.stdout',
-            # 'class': 'logging.StreamHandler',
-            "class": "logging.handlers.TimedRotatingFileHandler",
-            "filename": f"{LOG_DIR}/critical.log",
-            "when": "midnight",
-            # "interval": 1,
-            "backupCount": LOG_BACKUP_COUNT,
-            "encoding": "utf8",
-            # "delay": False,
-            # "utc": False,
-            # "atTime": None,
-            # "errors": None,
-            "level": "CRITICAL",
-            "formatter": "standard",
-            # 'maxBytes': 5*1024*1024,
-            "filters": ["critical"],
         },
         "critical_mail": {
             "class": "logging.handlers.SMTPHandler",
@@ -172,10 +122,7 @@ LOG_CONFIG = {
         "": {
             "handlers": [
                 # "default",
-                "info",
-                "warning",
-                "error",
-                "critical",
+                "levels",
                 # Keep console at the end. for colored output only at stdout.
                 "console",
             ],
@@ -185,7 +132,7 @@ LOG_CONFIG = {
         "script": {"handlers": ["default"], "level": "INFO", "propagate": False},
         # if __name__ == '__main__'
         "__main__": {
-            "handlers": ["default", "console", "info", "warning", "critical", "error"],
+            "handlers": ["default", "console", "levels"],
             "level": "DEBUG",
             "propagate": False,
         },
@@ -201,11 +148,19 @@ LOG_CONFIG = {
 }
 
 
-logging.config.dictConfig(LOG_CONFIG)
-logging.info(f"Logging is configured. ENV: {ENV}, FORMATTER: {LOG_FORMATTER}, LOG_FILTERS: {LOG_FILTERS}")
+def configure(config: Dict[str, Any] = LOG_CONFIG, queue: bool = LOG_QUEUE) -> Optional[AsyncQueueHandler]:
+    """Apply `config`, then move the root handlers behind a queue so callers never wait on file I/O.
+
+    Not run at import, `plugin_loaded` calls it once the plugin modules are loaded.
+    """
+    logging.config.dictConfig(config)
+    queue_handler = enqueue_handlers(logging.getLogger()) if queue else None
+    logging.info(f"Logging is configured. ENV: {ENV}, FORMATTER: {LOG_FORMATTER}, LOG_FILTERS: {LOG_FILTERS}")
+    return queue_handler
 
 
 if __name__ == "__main__":
+    configure()
     logger = logging.getLogger()
     # logger.setLevel(logging.DEBUG)
     logger.debug("Logging is configured.")
@@ -1,6 +1,6 @@
 import logging
 from pprint import pformat
-from typing import Any, Dict, List, Tuple, Union
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 
 
 logger = logging.getLogger(__name__)
@@ -8,13 +8,23 @@ logger = logging.getLogger(__name__)
 __all__ = ["json"]
 
 
-json = lambda msg: pformat(msg, indent=1, width=80, depth=9)
-try:
-    from pygments import formatters, highlight, lexers
+_highlight: Optional[Callable[[Any], str]] = None
 
-    def json(msg: Union[Dict[str, Any], List[Any], Tuple[Any], str, int, float, bool, None]) -> str:
+
+def _pformat(msg: Any) -> str:
+    return pformat(msg, indent=1, width=80, depth=9)
+
+
+def _load_highlight() -> Callable[[Any], str]:
+    try:
+        from pygments import formatters, highlight, lexers
+    except ImportError:
+        logger.warning("Using default json lexer formatter. Install pygments `pip install pygments` for better output.")
+        return _pformat
+
+    def _json(msg: Union[Dict[str, Any], List[Any], Tuple[Any], str, int, float, bool, None]) -> str:
         return highlight(
-            pformat(msg, indent=1, width=80, depth=9),
+            _pformat(msg),
             lexers.JsonnetLexer(),
             # lexers.JsonLexer(),
             # lexers.PythonTracebackLexer(),
@@ -51,9 +61,18 @@ try:
             # formatters.TerminalFormatter(bg="light"),
         )
 
-except ImportError:
-    logger.warning("Using default json lexer formatter. Install pygments `pip install pygments` for better output.")
-    pass
+    return _json
+
+
+def json(msg: Union[Dict[str, Any], List[Any], Tuple[Any], str, int, float, bool, None]) -> str:
+    """Pretty format `msg`, highlighted when pygments is installed.
+
+    pygments is only imported by the first call, keeping it out of the plugin startup.
+    """
+    global _highlight
+    if _highlight is None:
+        _highlight = _load_highlight()
+    return _highlight(msg)
 
 
 if __name__ == "__main__":
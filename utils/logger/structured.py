@@ -0,0 +1,85 @@
+"""
+Structured, lazy log messages.
+
+`log(logger, logging.DEBUG, "request", url=url, data=data)` returns right away when the
+level is disabled. Otherwise the fields are only rendered when a handler formats the
+record, with large payloads truncated and fingerprinted and credentials redacted.
+Zero-argument callables are evaluated on rendering, for fields that are costly to compute.
+"""
+
+import hashlib
+import logging
+from typing import Any, Dict
+
+
+__all__ = ["Fields", "summarize", "log", "debug", "info", "warning", "error"]
+
+
+# Longest rendered field, longer values are cut and fingerprinted
+MAX_FIELD_LENGTH = 200
+SENSITIVE_KEYS = frozenset({"password", "token", "access_token", "x-simperium-token", "x-simperium-api-key"})
+
+
+def _fingerprint(data: bytes) -> str:
+    return hashlib.blake2b(data, digest_size=8).hexdigest()
+
+
+def summarize(value: Any, limit: int = MAX_FIELD_LENGTH) -> str:
+    """Render `value` in at most about `limit` characters"""
+    if callable(value):
+        value = value()
+    if isinstance(value, dict):
+        value = {key: "***" if str(key).casefold() in SENSITIVE_KEYS else item for key, item in value.items()}
+    if isinstance(value, (bytes, bytearray)):
+        if len(value) <= limit:
+            return repr(bytes(value))
+        return "<%s bytes blake2b:%s>" % (len(value), _fingerprint(bytes(value)))
+    text = value if isinstance(value, str) else repr(value)
+    if len(text) <= limit:
+        return text
+    return "%s...<%s chars blake2b:%s>" % (text[:limit], len(text), _fingerprint(text.encode("utf-8", "replace")))
+
+
+class Fields:
+    """A log message rendered as `event key=value ...` only when it is formatted"""
+
+    __slots__ = ("event", "fields", "limit")
+
+    def __init__(self, event: str, fields: Dict[str, Any], limit: int = MAX_FIELD_LENGTH):
+        self.event = event
+        self.fields = fields
+        self.limit = limit
+
+    def __str__(self) -> str:
+        parts = [self.event]
+        for key, value in self.fields.items():
+            parts.append("%s=%s" % (key, "***" if key.casefold() in SENSITIVE_KEYS else summarize(value, self.limit)))
+        return " ".join(parts)
+
+    def __repr__(self) -> str:
+        return "Fields(%r)" % self.event
+
+
+def log(logger: logging.Logger, level: int, event: str, **fields: Any):
+    if logger.isEnabledFor(level):
+        logger.log(level, Fields(event, fields), stacklevel=2)
+
+
+def debug(logger: logging.Logger, event: str, **fields: Any):
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.log(logging.DEBUG, Fields(event, fields), stacklevel=2)
+
+
+def info(logger: logging.Logger, event: str, **fields: Any):
+    if logger.isEnabledFor(logging.INFO):
+        logger.log(logging.INFO, Fields(event, fields), stacklevel=2)
+
+
+def warning(logger: logging.Logger, event: str, **fields: Any):
+    if logger.isEnabledFor(logging.WARNING):
+        logger.log(logging.WARNING, Fields(event, fields), stacklevel=2)
+
+
+def error(logger: logging.Logger, event: str, **fields: Any):
+    if logger.isEnabledFor(logging.ERROR):
+        logger.log(logging.ERROR, Fields(event, fields), stacklevel=2)
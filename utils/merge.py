@@ -0,0 +1,149 @@
+"""
+Three-way merge of text, used to reconcile local edits with remote changes.
+
+Both sides are diffed against their common base. Hunks touched by only one side
+are taken as is; hunks touched by both sides are retried at character level and
+only reported as a conflict if they still overlap.
+"""
+
+from difflib import SequenceMatcher
+import logging
+from typing import List, NamedTuple, Optional, Sequence, Tuple
+
+
+__all__ = [
+    "MergeResult",
+    "merge3",
+]
+
+
+logger = logging.getLogger()
+
+
+CONFLICT_LOCAL = "<<<<<<< local\n"
+CONFLICT_SEPARATOR = "=======\n"
+CONFLICT_REMOTE = ">>>>>>> remote\n"
+
+# (base_start, base_end, replacement)
+_Change = Tuple[int, int, Sequence[str]]
+
+
+class MergeResult(NamedTuple):
+    content: str
+    conflicts: int = 0
+
+
+def _changes(base: Sequence[str], other: Sequence[str]) -> List[_Change]:
+    matcher = SequenceMatcher(None, base, other, autojunk=False)
+    return [(i1, i2, other[j1:j2]) for tag, i1, i2, j1, j2 in matcher.get_opcodes() if tag != "equal"]
+
+
+def _apply(base: Sequence[str], start: int, end: int, changes: List[_Change]) -> List[str]:
+    output: List[str] = []
+    position = start
+    for i1, i2, replacement in changes:
+        output.extend(base[position:i1])
+        output.extend(replacement)
+        position = i2
+    output.extend(base[position:end])
+    return output
+
+
+def _merge(
+    base: Sequence[str], local: Sequence[str], remote: Sequence[str], prefer: Optional[str] = None
+) -> Tuple[List[str], List[Tuple[List[str], List[str], List[str]]]]:
+    """Merge token sequences, returns the merged tokens and the unresolved hunks as (base, local, remote)"""
+    changes = sorted(
+        [(change, 0) for change in _changes(base, local)] + [(change, 1) for change in _changes(base, remote)],
+        key=lambda item: (item[0][0], item[0][1]),
+    )
+    output: List[str] = []
+    conflicts: List[Tuple[List[str], List[str], List[str]]] = []
+    position = 0
+    index = 0
+    while index < len(changes):
+        # Collect the cluster of changes overlapping (or touching) the same base range
+        start, end = changes[index][0][0], changes[index][0][1]
+        cluster: Tuple[List[_Change], List[_Change]] = ([], [])
+        while index < len(changes) and changes[index][0][0] <= end:
+            change, side = changes[index]
+            cluster[side].append(change)
+            end = max(end, change[1])
+            index += 1
+
+        output.extend(base[position:start])
+        position = end
+        local_changes, remote_changes = cluster
+        if not remote_changes:
+            output.extend(_apply(base, start, end, local_changes))
+            continue
+        if not local_changes:
+            output.extend(_apply(base, start, end, remote_changes))
+            continue
+        local_hunk = _apply(base, start, end, local_changes)
+        remote_hunk = _apply(base, start, end, remote_changes)
+        if local_hunk == remote_hunk:
+            output.extend(local_hunk)
+        elif prefer == "local":
+            output.extend(local_hunk)
+        elif prefer == "remote":
+            output.extend(remote_hunk)
+        else:
+            # Keep a placeholder, the caller decides how to render the conflict
+            output.append("")
+            conflicts.append((list(base[start:end]), local_hunk, remote_hunk))
+    output.extend(base[position:])
+    return output, conflicts
+
+
+def _render_conflict(local: str, remote: str) -> str:
+    if local and not local.endswith("\n"):
+        local += "\n"
+    if remote and not remote.endswith("\n"):
+        remote += "\n"
+    return CONFLICT_LOCAL + local + CONFLICT_SEPARATOR + remote + CONFLICT_REMOTE
+
+
+def merge3(base: str, local: str, remote: str, prefer: Optional[str] = None) -> MergeResult:
+    """Three-way merge `local` and `remote` edits of `base`.
+
+    Arguments:
+        - base (string): last content both sides agreed on
+        - local (string): content edited locally
+        - remote (string): content edited on the server
+        - prefer (string): "local" or "remote" to resolve conflicting hunks, `None` to keep both with markers
+
+    Returns:
+        A `MergeResult` with the merged content and the number of conflicting hunks
+    """
+    if local == remote or remote == base:
+        return MergeResult(local)
+    if local == base:
+        return MergeResult(remote)
+
+    lines, line_conflicts = _merge(
+        base.splitlines(keepends=True), local.splitlines(keepends=True), remote.splitlines(keepends=True), prefer
+    )
+    conflicts = 0
+    resolved: List[str] = []
+    for base_hunk, local_hunk, remote_hunk in line_conflicts:
+        # Both sides edited the same lines, retry at character level before giving up
+        chars, char_conflicts = _merge("".join(base_hunk), "".join(local_hunk), "".join(remote_hunk))
+        if char_conflicts:
+            conflicts += 1
+            resolved.append(_render_conflict("".join(local_hunk), "".join(remote_hunk)))
+        else:
+            resolved.append("".join(chars))
+
+    output: List[str] = []
+    hunks = iter(resolved)
+    conflict_slots = len(line_conflicts)
+    for line in lines:
+        if line == "" and conflict_slots:
+            output.append(next(hunks))
+            conflict_slots -= 1
+            continue
+        output.append(line)
+    if conflicts:
+        logger.warning("Three-way merge left %s conflicting hunk(s)", conflicts)
+    return MergeResult("".join(output), conflicts)
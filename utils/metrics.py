@@ -0,0 +1,229 @@
+"""
+In-process metrics: counters, gauges and fixed-bucket latency histograms.
+
+Recording is a lock and a few additions, cheap enough for every request and callback.
+`report()` renders the current values, with percentiles interpolated within the buckets.
+"""
+
+from bisect import bisect_left
+from contextlib import contextmanager
+import functools
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Sequence, TypeVar
+
+
+__all__ = [
+    "Counter",
+    "Gauge",
+    "Histogram",
+    "Registry",
+    "REGISTRY",
+    "counter",
+    "gauge",
+    "histogram",
+    "timed",
+    "report",
+]
+
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+# Histograms of requests held open until there is something to answer, reported apart
+LONG_POLL_PREFIX = "long_poll."
+
+# Upper bounds of the latency buckets, in seconds. The last bucket catches everything slower
+LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+
+
+class Counter:
+
+    def __init__(self, name: str):
+        self.name = name
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, value: int = 1):
+        with self._lock:
+            self.value += value
+
+
+class Gauge:
+
+    def __init__(self, name: str):
+        self.name = name
+        self.value: float = 0
+        self._lock = threading.Lock()
+
+    def set(self, value: float):
+        self.value = value
+
+    def inc(self, value: float = 1):
+        with self._lock:
+            self.value += value
+
+    def dec(self, value: float = 1):
+        self.inc(-value)
+
+
+class Histogram:
+
+    def __init__(self, name: str, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.buckets = tuple(buckets)
+        self.counts: List[int] = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+            if value > self.max:
+                self.max = value
+
+    @contextmanager
+    def time(self) -> Iterator[None]:
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start_time)
+
+    def percentile(self, percent: float) -> float:
+        """Estimate the `percent` percentile, interpolating linearly within its bucket"""
+        with self._lock:
+            counts = list(self.counts)
+            count = self.count
+            maximum = self.max
+        if not count:
+            return 0.0
+        rank = count * percent / 100
+        cumulative = 0
+        for index, bucket_count in enumerate(counts):
+            if bucket_count and cumulative + bucket_count >= rank:
+                lower = self.buckets[index - 1] if index > 0 else 0.0
+                upper = self.buckets[index] if index < len(self.buckets) else maximum
+                upper = min(upper, maximum)
+                return lower + (upper - lower) * max(rank - cumulative, 0) / bucket_count
+            cumulative += bucket_count
+        return maximum
+
+
+class Registry:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters: Dict[str, Counter] = {}
+        self.gauges: Dict[str, Gauge] = {}
+        self.histograms: Dict[str, Histogram] = {}
+
+    def counter(self, name: str) -> Counter:
+        metric = self.counters.get(name)
+        if metric is None:
+            with self._lock:
+                metric = self.counters.setdefault(name, Counter(name))
+        return metric
+
+    def gauge(self, name: str) -> Gauge:
+        metric = self.gauges.get(name)
+        if metric is None:
+            with self._lock:
+                metric = self.gauges.setdefault(name, Gauge(name))
+        return metric
+
+    def histogram(self, name: str) -> Histogram:
+        metric = self.histograms.get(name)
+        if metric is None:
+            with self._lock:
+                metric = self.histograms.setdefault(name, Histogram(name))
+        return metric
+
+    def timed(self, name: str) -> Callable[[F], F]:
+        """Decorator recording the duration of every call in the histogram `name`"""
+
+        def decorator(fn: F) -> F:
+            metric = self.histogram(name)
+
+            @functools.wraps(fn)
+            def wrap(*args, **kwargs):
+                with metric.time():
+                    return fn(*args, **kwargs)
+
+            return wrap  # type: ignore
+
+        return decorator
+
+    def clear(self):
+        with self._lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.histograms.clear()
+
+    def report(self) -> str:
+        histograms = sorted(self.histograms.items())
+        lines: List[str] = []
+        # Long-polls wait for a change on purpose, they get their own table
+        for title, long_poll in (("histogram", False), ("long-poll", True)):
+            rows = [
+                (name, metric)
+                for name, metric in histograms
+                if metric.count and name.startswith(LONG_POLL_PREFIX) == long_poll
+            ]
+            if long_poll and not rows:
+                continue
+            lines.append(
+                "%-40s %8s %10s %10s %10s %10s %10s" % (title, "count", "mean(ms)", "p50", "p95", "p99", "max")
+            )
+            for name, metric in rows:
+                lines.append(
+                    "%-40s %8d %10.2f %10.2f %10.2f %10.2f %10.2f"
+                    % (
+                        name,
+                        metric.count,
+                        metric.sum / metric.count * 1000,
+                        metric.percentile(50) * 1000,
+                        metric.percentile(95) * 1000,
+                        metric.percentile(99) * 1000,
+                        metric.max * 1000,
+                    )
+                )
+            lines.append("")
+        lines.append("%-40s %12s" % ("counter", "value"))
+        for name, metric in sorted(self.counters.items()):
+            lines.append("%-40s %12d" % (name, metric.value))
+        if self.gauges:
+            lines.append("")
+            lines.append("%-40s %12s" % ("gauge", "value"))
+            for name, metric in sorted(self.gauges.items()):
+                lines.append("%-40s %12g" % (name, metric.value))
+        return "\n".join(lines)
+
+
+REGISTRY = Registry()
+counter = REGISTRY.counter
+gauge = REGISTRY.gauge
+histogram = REGISTRY.histogram
+timed = REGISTRY.timed
+report = REGISTRY.report
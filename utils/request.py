@@ -1,18 +1,28 @@
+import base64
+import codecs
+from contextlib import contextmanager
 from dataclasses import dataclass
 from email.message import Message
-import gzip
+import http.client
 import io
-import json
 import logging
+from queue import Empty, Full, LifoQueue
+import threading
 import typing
 import urllib.error
 import urllib.parse
 import urllib.request
 import zlib
 
+from utils import codec, metrics, trace
+from utils.logger import structured
+
+
 __all__ = [
     "request",
+    "iter_content",
     "Response",
+    "Session",
 ]
 __version__ = "0.0.1"
 __author__ = "redatman"
@@ -46,9 +56,12 @@ DEFAULT_HEADERS = {
 
 @dataclass
 class ContentDecoding:
-    default: typing.Callable = lambda response: response.read().decode(response.headers.get_content_charset("utf-8"))
+    """Body bytes of a response by `Content-Encoding`, text is decoded by `Response.text`"""
+
+    default: typing.Callable = lambda response: response.read()
     # TODO: need validate
-    gzip: typing.Callable = lambda response: gzip.GzipFile(fileobj=io.BytesIO(response.read())).read().decode()
+    # One zlib call, `gzip.decompress` joins its output into a second copy
+    gzip: typing.Callable = lambda response: zlib.decompress(response.read(), 16 + zlib.MAX_WBITS)
     # TODO: need validate
     deflate: typing.Callable = lambda response: zlib.decompress(response.read(), -zlib.MAX_WBITS)
 
@@ -58,30 +71,314 @@ class ContentDecoding:
         return decompressor.decompress(response.read()) + decompressor.flush()
 
 
-class Response(typing.NamedTuple):
-    status: int
-    headers: Message
-    body: str
-    error_count: int = 0
+# Bytes read from the socket at a time when the body is streamed
+CHUNK_SIZE = 64 * 1024
+_STREAM_WBITS = {"gzip": 16 + zlib.MAX_WBITS, "br": 16 + zlib.MAX_WBITS, "deflate": -zlib.MAX_WBITS}
+
+
+def iter_content(httpresponse, chunk_size: int = CHUNK_SIZE) -> typing.Iterator[bytes]:
+    """The body bytes of a response chunk by chunk as they are received, decompressed like `ContentDecoding`"""
+    wbits = _STREAM_WBITS.get(httpresponse.info().get("content-encoding", "default"))
+    decompressor = zlib.decompressobj(wbits=wbits) if wbits is not None else None
+    while True:
+        chunk = httpresponse.read(chunk_size)
+        if not chunk:
+            break
+        if decompressor is not None:
+            chunk = decompressor.decompress(chunk)
+        if chunk:
+            yield chunk
+    if decompressor is not None:
+        tail = decompressor.flush()
+        if tail:
+            yield tail
+
+
+_UNSET: typing.Any = object()
+# Characters of the body in the debug log of a response
+LOG_BODY_LENGTH = 160
+
+# Statuses followed like `urllib.request` does, 307 and 308 keep the method and the body
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+MAX_REDIRECTS = 10
+
+
+class _Proxy(typing.NamedTuple):
+    host: str
+    port: int
+    headers: typing.Dict[str, str]
+
+
+def _get_proxy(scheme: str, host: str) -> typing.Optional[_Proxy]:
+    """The proxy `urllib.request` would use for the host, from the environment or the system settings"""
+    proxy = urllib.request.getproxies().get(scheme)
+    if not proxy or urllib.request.proxy_bypass(host):
+        return None
+    if "://" not in proxy:
+        proxy = "http://" + proxy
+    url = urllib.parse.urlsplit(proxy)
+    headers: typing.Dict[str, str] = {}
+    if url.username is not None:
+        credentials = "%s:%s" % (urllib.parse.unquote(url.username), urllib.parse.unquote(url.password or ""))
+        headers["Proxy-Authorization"] = "Basic " + base64.b64encode(credentials.encode()).decode("ascii")
+    return _Proxy(url.hostname or "", url.port or 80, headers)
+
+
+def _redirected(httprequest: urllib.request.Request, status: int, location: str) -> urllib.request.Request:
+    """The request to send to `location`, as `urllib.request.HTTPRedirectHandler` builds it"""
+    url = urllib.parse.urljoin(httprequest.full_url, location)
+    headers = dict(httprequest.header_items())
+    if status in (307, 308):
+        return urllib.request.Request(url, data=httprequest.data, headers=headers, method=httprequest.get_method())
+    # The others turn into a GET without a body
+    headers = {key: value for key, value in headers.items() if key.lower() not in ("content-length", "content-type")}
+    method = "HEAD" if httprequest.get_method() == "HEAD" else "GET"
+    return urllib.request.Request(url, headers=headers, method=method)
+
+
+class Response:
+    """An HTTP response holding its body as received.
+
+    The bytes are kept as received, `text` and `data` are decoded on first use and cached
+    next to them: re-encoding a decoded body would not give back bytes of another charset,
+    nor invalid ones.
+    """
+
+    __slots__ = ("status", "headers", "error_count", "charset", "_body", "_text", "_data")
+
+    def __init__(self, status: int, headers: Message, body: typing.Union[bytes, str], error_count: int = 0):
+        self.status = status
+        self.headers = headers
+        self.error_count = error_count
+        get_content_charset = getattr(headers, "get_content_charset", None)
+        self.charset: str = get_content_charset("utf-8") if get_content_charset is not None else "utf-8"
+        self._body: typing.Optional[bytes] = None
+        self._text: typing.Optional[str] = None
+        # Error responses carry a message instead of a body
+        if isinstance(body, str):
+            self._text = body
+        else:
+            self._body = body
+        self._data = _UNSET
+
+    def __repr__(self) -> str:
+        return "Response(status=%r, headers=%r, body=%r, error_count=%r)" % (
+            self.status,
+            self.headers,
+            self._body if self._body is not None else self._text,
+            self.error_count,
+        )
+
+    def _encoding(self) -> str:
+        try:
+            return codecs.lookup(self.charset).name
+        except LookupError:
+            return "utf-8"
+
+    @property
+    def body(self) -> bytes:
+        if self._body is None:
+            # Only error responses are built from a message
+            self._body = (self._text or "").encode(self._encoding(), errors="replace")
+        return self._body
+
+    @property
+    def view(self) -> memoryview:
+        """The body without a copy, for consumers working on bytes"""
+        return memoryview(self.body)
+
+    @property
+    def text(self) -> str:
+        """The body decoded with the charset of its `Content-Type`, once"""
+        if self._text is None:
+            self._text = self.body.decode(self._encoding(), errors="replace")
+        return self._text
+
+    def head(self, limit: int = LOG_BODY_LENGTH) -> str:
+        """The beginning of the body as text, for logs, the rest is neither decoded nor copied"""
+        if self._text is not None:
+            if len(self._text) <= limit:
+                return self._text
+            return "%s...<%s chars>" % (self._text[:limit], len(self._text))
+        view = self.view
+        text = view[:limit].tobytes().decode(self._encoding(), errors="replace")
+        if len(view) <= limit:
+            return text
+        return "%s...<%s bytes>" % (text, len(view))
 
     def json(self) -> typing.Union[typing.Dict[str, str], typing.List[typing.Dict[str, str]]]:
         """
-        Decode body's JSON.
+        Decode body's JSON, once.
+
+        UTF-8 bytes are parsed as they are by a codec able to, otherwise from `text`.
 
         Returns:
-            Pythonic representation of the JSON object
+            Pythonic representation of the JSON object, shared by every call
         """
-        try:
-            output = json.loads(self.body)
-        except json.JSONDecodeError:
-            output = {}
-        return output
+        if self._data is _UNSET:
+            try:
+                parse_bytes = codec.PARSES_BYTES and self._body is not None and self._encoding() in ("utf-8", "ascii")
+                source = self.body if parse_bytes else self.text
+                with trace.span("json.loads", size=len(source), codec=codec.NAME):
+                    self._data = codec.loads(source)
+            except ValueError:
+                self._data = {}
+        return self._data
 
     @property
     def data(self):
         return self.json()
 
 
+_Connection = typing.Tuple[http.client.HTTPConnection, typing.Optional[_Proxy]]
+
+
+class Session:
+    """Reuse keep-alive connections across requests and count what goes through them.
+
+    `urlopen` is a drop-in replacement of `urllib.request.urlopen`: it raises
+    `urllib.error.HTTPError` for error statuses, so callers handle both the same way,
+    follows redirects and goes through the proxy `urllib.request` would use. HTTPS is
+    tunnelled through the proxy with CONNECT.
+    """
+
+    def __init__(self, pool_size: int = 10, timeout: float = 60, metric: str = "http.request"):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        # Histogram timing the requests of the session
+        self.metric = metric
+        self._lock = threading.Lock()
+        self._pools: typing.Dict[typing.Tuple[str, str, int], LifoQueue] = {}
+        self.stats: typing.Dict[str, int] = {
+            "requests": 0,
+            "errors": 0,
+            "connections": 0,
+            "bytes_sent": 0,
+            "bytes_received": 0,
+        }
+
+    def _count(self, key: str, value: int = 1):
+        with self._lock:
+            self.stats[key] += value
+        metrics.counter("http.%s" % key).inc(value)
+
+    def _pool(self, key: typing.Tuple[str, str, int]) -> LifoQueue:
+        with self._lock:
+            if key not in self._pools:
+                self._pools[key] = LifoQueue(maxsize=self.pool_size)
+            return self._pools[key]
+
+    def _connect(self, scheme: str, host: str, port: int) -> _Connection:
+        """A new connection to the host, or to its proxy, which is returned too"""
+        self._count("connections")
+        proxy = _get_proxy(scheme, host)
+        if proxy is None:
+            if scheme == "https":
+                return http.client.HTTPSConnection(host, port, timeout=self.timeout), None
+            return http.client.HTTPConnection(host, port, timeout=self.timeout), None
+        if scheme == "https":
+            connection = http.client.HTTPSConnection(proxy.host, proxy.port, timeout=self.timeout)
+            connection.set_tunnel(host, port, headers=proxy.headers)
+            return connection, proxy
+        return http.client.HTTPConnection(proxy.host, proxy.port, timeout=self.timeout), proxy
+
+    def _release(self, key: typing.Tuple[str, str, int], connection: _Connection):
+        try:
+            self._pool(key).put_nowait(connection)
+        except Full:
+            connection[0].close()
+
+    @contextmanager
+    def urlopen(self, httprequest: urllib.request.Request, redirects: int = 0):
+        url = urllib.parse.urlsplit(httprequest.full_url)
+        scheme = url.scheme.lower()
+        port = url.port or (443 if scheme == "https" else 80)
+        key = (scheme, url.hostname or "", port)
+        path = url.path or "/"
+        if url.query:
+            path += "?" + url.query
+        body = typing.cast(typing.Optional[bytes], httprequest.data)
+        headers = dict(httprequest.header_items())
+
+        def send(connection: http.client.HTTPConnection, proxy: typing.Optional[_Proxy]):
+            if proxy is not None and scheme == "http":
+                # Plain HTTP goes to the proxy as is, with the absolute URL
+                connection.request(
+                    httprequest.get_method(), httprequest.full_url, body=body, headers=dict(headers, **proxy.headers)
+                )
+            else:
+                connection.request(httprequest.get_method(), path, body=body, headers=headers)
+            return connection.getresponse()
+
+        try:
+            (connection, proxy), reused = self._pool(key).get_nowait(), True
+        except Empty:
+            (connection, proxy), reused = self._connect(*key), False
+        try:
+            try:
+                response = send(connection, proxy)
+            except (http.client.RemoteDisconnected, ConnectionError, BrokenPipeError):
+                if not reused:
+                    raise
+                # The server closed the idle keep-alive connection, retry once on a fresh one
+                connection.close()
+                connection, proxy = self._connect(*key)
+                response = send(connection, proxy)
+        except Exception:
+            connection.close()
+            self._count("errors")
+            raise
+
+        self._count("requests")
+        self._count("bytes_sent", len(body or b""))
+        reader = response.read
+        received = 0
+
+        def read(*args):
+            nonlocal received
+            chunk = reader(*args)
+            received += len(chunk)
+            return chunk
+
+        response.read = read  # type: ignore
+        location = response.headers.get("Location")
+        redirected = None
+        try:
+            if response.status in REDIRECT_STATUSES and location and redirects < MAX_REDIRECTS:
+                redirected = _redirected(httprequest, response.status, location)
+            elif response.status >= 300:
+                self._count("errors")
+                fp = io.BytesIO(read())
+                raise urllib.error.HTTPError(
+                    httprequest.full_url, response.status, response.reason, response.headers, fp
+                )
+            else:
+                yield response
+        finally:
+            # Drain what the caller left so the connection can be reused
+            if not response.isclosed():
+                read()
+            self._count("bytes_received", received)
+            if response.will_close:
+                connection.close()
+            else:
+                self._release(key, (connection, proxy))
+        if redirected is not None:
+            with self.urlopen(redirected, redirects + 1) as response:
+                yield response
+
+    def close(self):
+        with self._lock:
+            pools, self._pools = self._pools, {}
+        for pool in pools.values():
+            while True:
+                try:
+                    pool.get_nowait()[0].close()
+                except Empty:
+                    break
+
+
+@trace.traced("http.request")
 def request(
     url: str,
     data: typing.Optional[typing.Dict] = None,
@@ -90,6 +387,30 @@ def request(
     method: str = "GET",
     data_as_json: bool = True,
     error_count: int = 0,
+    session: typing.Optional[Session] = None,
+    on_chunk: typing.Optional[typing.Callable[[bytes], typing.Any]] = None,
+) -> Response:
+    """Send a request, the whole body is read into the `Response`.
+
+    With `on_chunk`, the body is passed to it chunk by chunk while it is received instead,
+    and the `Response` has an empty body. An exception raised by `on_chunk` fails the
+    request like a network error does. The duration is recorded in the histogram of the
+    session, `http.request` without one.
+    """
+    with metrics.histogram(session.metric if session is not None else "http.request").time():
+        return _request(url, data, params, headers, method, data_as_json, error_count, session, on_chunk)
+
+
+def _request(
+    url: str,
+    data: typing.Optional[typing.Dict],
+    params: typing.Optional[typing.Dict],
+    headers: typing.Optional[typing.Dict],
+    method: str,
+    data_as_json: bool,
+    error_count: int,
+    session: typing.Optional[Session],
+    on_chunk: typing.Optional[typing.Callable[[bytes], typing.Any]],
 ) -> Response:
     if not url.casefold().startswith("http"):
         raise urllib.error.URLError("Incorrect and possibly insecure protocol in url")
@@ -109,32 +430,39 @@ def request(
 
     if data:
         if data_as_json:
-            request_data = json.dumps(data).encode()
+            request_data = codec.dumps(data)
             headers["Content-Type"] = "application/json; charset=UTF-8"
         else:
             request_data = urllib.parse.urlencode(data).encode()
 
-    logger.debug(f"url: {url}, method: {method}, headers: {headers}, data: {data}")
+    structured.debug(logger, "request", method=method, url=url, headers=headers, data=data)
     httprequest = urllib.request.Request(url, data=request_data, headers=headers, method=method)
 
-    with urllib.request.urlopen(httprequest) as httpresponse:
+    urlopen = session.urlopen if session is not None else urllib.request.urlopen
+    with urlopen(httprequest) as httpresponse:
         try:
             # content_encoding = httpresponse.getheader("Content-Encoding", "default")
             content_encoding = httpresponse.info().get("content-encoding", "default")
-            logger.debug(content_encoding)
-            body = getattr(ContentDecoding, content_encoding, ContentDecoding.default)(httpresponse)
+            if on_chunk is not None:
+                for chunk in iter_content(httpresponse):
+                    on_chunk(chunk)
+                body = b""
+            else:
+                body = getattr(ContentDecoding, content_encoding, ContentDecoding.default)(httpresponse)
             response = Response(
                 headers=httpresponse.headers,
                 status=httpresponse.status,
                 body=body,
             )
+            structured.debug(logger, "response", status=response.status, encoding=content_encoding, body=response.head)
         except Exception as err:
-            logger.error((method, url, headers, data))
+            structured.error(logger, "request failed", method=method, url=url, headers=headers, data=data)
             logger.exception(err)
             _body = str(err)
             _headers = Message()
             _status = 500
             error_count += 1
+            metrics.counter("http.failed").inc()
             if isinstance(err, urllib.error.HTTPError):
                 _body = str(err.reason)
                 _headers = err.headers
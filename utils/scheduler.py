@@ -0,0 +1,98 @@
+"""
+Adaptive interval between background syncs.
+
+The interval starts at `min_interval`, doubles after every sync that found nothing new
+up to `max_interval`, and drops back to `min_interval` as soon as a sync brings changes
+or the user edits a note. Syncing pauses while the editor is unfocused or nothing
+happened in it for `idle_timeout` seconds, and resumes on the next activity.
+"""
+
+import logging
+import threading
+import time
+from typing import Callable, Optional
+
+
+__all__ = [
+    "SyncScheduler",
+]
+
+
+logger = logging.getLogger()
+
+
+class SyncScheduler:
+
+    def __init__(
+        self,
+        min_interval: float = 30,
+        max_interval: float = 600,
+        backoff: float = 2.0,
+        idle_timeout: float = 0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.min_interval = min_interval
+        self.max_interval = max(min_interval, max_interval)
+        self.backoff = backoff
+        # Seconds without activity after which syncing pauses, 0 to never pause
+        self.idle_timeout = idle_timeout
+        self.clock = clock
+        self._lock = threading.Lock()
+        self.interval = min_interval
+        self.focused = True
+        self.last_activity = clock()
+        self.last_sync: Optional[float] = None
+        # Set when a sync was skipped for being paused, the next activity resumes syncing
+        self.sleeping = False
+
+    def configure(self, min_interval: float, max_interval: float, idle_timeout: float = 0):
+        with self._lock:
+            self.min_interval = min_interval
+            self.max_interval = max(min_interval, max_interval)
+            self.idle_timeout = idle_timeout
+            self.interval = min(max(self.interval, self.min_interval), self.max_interval)
+
+    def synced(self, changes: int):
+        """Record a finished sync, `changes` notes were updated by it"""
+        with self._lock:
+            self.last_sync = self.clock()
+            if changes:
+                self.interval = self.min_interval
+            else:
+                self.interval = min(self.interval * self.backoff, self.max_interval)
+
+    def changed(self):
+        """A local edit, the next syncs come sooner"""
+        with self._lock:
+            self.interval = self.min_interval
+        self.touch()
+
+    def touch(self):
+        with self._lock:
+            self.last_activity = self.clock()
+
+    def focus(self, focused: bool):
+        with self._lock:
+            self.focused = focused
+            if focused:
+                self.last_activity = self.clock()
+
+    @property
+    def paused(self) -> bool:
+        if not self.focused:
+            return True
+        return bool(self.idle_timeout) and self.clock() - self.last_activity > self.idle_timeout
+
+    def wake(self) -> Optional[float]:
+        """Leave the paused state, returns in how many seconds to sync, None if syncing was not asleep"""
+        with self._lock:
+            if not self.sleeping:
+                return None
+            self.sleeping = False
+            if self.last_sync is None:
+                return 0.0
+            return max(0.0, self.last_sync + self.interval - self.clock())
+
+    def sleep(self):
+        with self._lock:
+            self.sleeping = True
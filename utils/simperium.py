@@ -0,0 +1,399 @@
+"""
+Local stand-in of the Simperium HTTP API used by Simplenote.
+
+Implements `authorize/`, `index` with `mark`/`limit`/`data`, GET, POST and DELETE on
+`i/<id>` and `i/<id>/v/<v>`, answering with `X-Simperium-Version` headers, and the
+`all?cv=` long-poll change feed, held open until a change or `poll_timeout`. Latency,
+bandwidth and errors can be injected to benchmark the client on a machine without network.
+
+    python -m utils.simperium --port 8080 --latency 0.05 --error-rate 0.01
+
+then set `"api_url": "http://127.0.0.1:8080/1"` or `SIMPLENOTE_API_URL`.
+"""
+
+import gzip
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import logging
+import random
+import re
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+import urllib.parse
+import uuid
+
+
+__all__ = ["Faults", "SimperiumStore", "SimperiumServer", "serve"]
+
+
+logger = logging.getLogger()
+
+
+class Faults:
+    """What goes wrong, and how slowly. Can be changed while the server runs"""
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        bandwidth: int = 0,
+        error_rate: float = 0.0,
+        error_status: int = 503,
+        seed: Optional[int] = None,
+    ):
+        # Seconds added to every response, plus up to `jitter` seconds at random
+        self.latency = latency
+        self.jitter = jitter
+        # Response bytes per second, 0 for unlimited
+        self.bandwidth = bandwidth
+        # Share of requests answered with `error_status`
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        # Statuses forced on the next requests, see `fail_next`
+        self._forced: List[int] = []
+
+    def fail_next(self, count: int = 1, status: int = 503):
+        with self._lock:
+            self._forced.extend([status] * count)
+
+    def error(self) -> Optional[int]:
+        with self._lock:
+            if self._forced:
+                return self._forced.pop(0)
+            if self.error_rate and self._rng.random() < self.error_rate:
+                return self.error_status
+        return None
+
+    def delay(self) -> float:
+        with self._lock:
+            return self.latency + (self._rng.uniform(0, self.jitter) if self.jitter else 0.0)
+
+
+class SimperiumStore:
+    """Objects of one bucket with their version history, and the issued tokens"""
+
+    def __init__(self, users: Optional[Dict[str, str]] = None):
+        # username -> password, any credentials are accepted if empty
+        self.users: Dict[str, str] = dict(users or {})
+        self.tokens: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        # id -> version -> data, the last version is the current one
+        self.objects: Dict[str, Dict[int, Dict[str, Any]]] = {}
+        self.deleted: Dict[str, int] = {}
+        self.cv = 0
+        # Change objects in cv order, as served by `all?cv=`
+        self.changes: List[Dict[str, Any]] = []
+        self._changed = threading.Condition(self._lock)
+        self.closed = False
+
+    def close(self):
+        """Answer the pending long-polls now"""
+        with self._changed:
+            self.closed = True
+            self._changed.notify_all()
+
+    def authorize(self, username: str, password: str) -> Optional[str]:
+        if self.users and self.users.get(username) != password:
+            return None
+        token = uuid.uuid4().hex
+        with self._lock:
+            self.tokens[token] = username
+        return token
+
+    def expire_tokens(self):
+        """Forget every issued token, the clients have to authorize again"""
+        with self._lock:
+            self.tokens.clear()
+
+    def put(self, object_id: str, data: Dict[str, Any]) -> int:
+        """Store a new version of an object, merged over the current one, returns the version"""
+        with self._lock:
+            versions = self.objects.setdefault(object_id, {})
+            version = (max(versions) if versions else self.deleted.pop(object_id, 0)) + 1
+            current = versions[max(versions)] if versions else {}
+            versions[version] = dict(current, **data)
+            self._record(object_id, "M", version, versions[version])
+            return version
+
+    def get(self, object_id: str, version: Optional[int] = None) -> Optional[Tuple[int, Dict[str, Any]]]:
+        with self._lock:
+            versions = self.objects.get(object_id)
+            if not versions:
+                return None
+            version = max(versions) if version is None else version
+            if version not in versions:
+                return None
+            return version, versions[version]
+
+    def delete(self, object_id: str) -> Optional[int]:
+        with self._lock:
+            versions = self.objects.pop(object_id, None)
+            if not versions:
+                return None
+            version = max(versions) + 1
+            self.deleted[object_id] = version
+            self._record(object_id, "-", version)
+            return version
+
+    def _record(self, object_id: str, operation: str, version: int, data: Optional[Dict[str, Any]] = None):
+        # Called with the lock held
+        self.cv += 1
+        change: Dict[str, Any] = {"cv": "%024x" % self.cv, "id": object_id, "o": operation, "ev": version}
+        if data is not None:
+            change["sv"] = version - 1
+            change["d"] = data
+        self.changes.append(change)
+        self._changed.notify_all()
+
+    def changes_since(self, cv: str, timeout: float = 0, data: bool = False) -> List[Dict[str, Any]]:
+        """The changes after `cv`, waiting up to `timeout` seconds for one if there are none yet"""
+        since = int(cv, 16) if cv else 0
+        with self._changed:
+            self._changed.wait_for(lambda: self.cv > since or self.closed, timeout)
+            # The cv of the change at index `i` is `i + 1`
+            changes = self.changes[since:]
+        if data:
+            return changes
+        return [{key: value for key, value in change.items() if key != "d"} for change in changes]
+
+    def index(self, limit: int, mark: str = "", data: bool = False) -> Dict[str, Any]:
+        """A page of at most `limit` objects sorted by id, starting at `mark`"""
+        with self._lock:
+            ids = sorted(object_id for object_id in self.objects if object_id >= mark)
+            page = ids[:limit]
+            result: Dict[str, Any] = {"current": "%024x" % self.cv, "index": []}
+            for object_id in page:
+                versions = self.objects[object_id]
+                version = max(versions)
+                entry: Dict[str, Any] = {"id": object_id, "v": version}
+                if data:
+                    entry["d"] = versions[version]
+                result["index"].append(entry)
+            if len(ids) > limit:
+                result["mark"] = ids[limit]
+        return result
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    server: "SimperiumServer"
+
+    ROUTE = re.compile(r"^/1/(?P<app>[^/]+)/(?:(?P<authorize>authorize)/?|(?P<bucket>[^/]+)/(?P<rest>.*))$")
+    OBJECT = re.compile(r"^i/(?P<id>[^/]+)(?:/v/(?P<v>\d+))?/?$")
+
+    def log_message(self, format, *args):
+        logger.debug("simperium: " + format % args)
+
+    def reply(self, status: int, body: Any = None, version: Optional[int] = None):
+        data = b"" if body is None else json.dumps(body).encode("utf-8")
+        compress = len(data) > 1024 and "gzip" in self.headers.get("Accept-Encoding", "")
+        if compress:
+            data = gzip.compress(data, compresslevel=5)
+        delay = self.server.faults.delay()
+        if delay:
+            time.sleep(delay)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=UTF-8")
+        self.send_header("Content-Length", str(len(data)))
+        if compress:
+            self.send_header("Content-Encoding", "gzip")
+        if version is not None:
+            self.send_header("X-Simperium-Version", str(version))
+        self.end_headers()
+        bandwidth = self.server.faults.bandwidth
+        if bandwidth and data:
+            chunk_size = max(1, bandwidth // 20)
+            for start in range(0, len(data), chunk_size):
+                self.wfile.write(data[start : start + chunk_size])
+                time.sleep(min(chunk_size, len(data) - start) / bandwidth)
+        else:
+            self.wfile.write(data)
+        self.server.count(status)
+
+    def read_body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+    def handle_request(self, method: str):
+        body = self.read_body()
+        url = urllib.parse.urlsplit(self.path)
+        query = dict(urllib.parse.parse_qsl(url.query))
+        route = self.ROUTE.match(url.path)
+        if route is None:
+            return self.reply(404, {"error": "not found"})
+        status = self.server.faults.error()
+        if status is not None:
+            return self.reply(status, {"error": "injected"})
+        if route.group("authorize"):
+            if method != "POST":
+                return self.reply(405)
+            return self.authorize(body)
+        if self.headers.get("X-Simperium-Token") not in self.server.store.tokens:
+            return self.reply(401, {"error": "invalid token"})
+        rest = route.group("rest")
+        if rest.rstrip("/") == "all":
+            if method != "GET":
+                return self.reply(405)
+            try:
+                changes = self.server.store.changes_since(
+                    query.get("cv", ""), self.server.poll_timeout, query.get("data", "") in ("1", "true")
+                )
+            except ValueError:
+                return self.reply(400, {"error": "invalid cv"})
+            return self.reply(200, changes)
+        if rest.rstrip("/") == "index":
+            if method != "GET":
+                return self.reply(405)
+            try:
+                limit = max(1, min(int(query.get("limit", 100)), 1000))
+            except ValueError:
+                return self.reply(400, {"error": "invalid limit"})
+            data = query.get("data", "").lower() in ("1", "true")
+            return self.reply(200, self.server.store.index(limit, query.get("mark", ""), data))
+        match = self.OBJECT.match(rest)
+        if match is None:
+            return self.reply(404, {"error": "not found"})
+        object_id = match.group("id")
+        version = int(match.group("v")) if match.group("v") else None
+        if method == "GET":
+            found = self.server.store.get(object_id, version)
+            if found is None:
+                return self.reply(404, {"error": "not found"})
+            return self.reply(200, found[1], found[0])
+        if method == "POST":
+            current = self.server.store.get(object_id)
+            if version is not None and current is not None and current[0] != version:
+                return self.reply(412, {"error": "version mismatch"}, current[0])
+            try:
+                data = json.loads(body or b"{}")
+            except ValueError:
+                return self.reply(400, {"error": "invalid json"})
+            if not isinstance(data, dict):
+                return self.reply(400, {"error": "expected an object"})
+            new_version = self.server.store.put(object_id, data)
+            if query.get("response") == "1":
+                found = self.server.store.get(object_id)
+                assert found is not None
+                return self.reply(200, found[1], new_version)
+            return self.reply(200, None, new_version)
+        if method == "DELETE":
+            deleted_version = self.server.store.delete(object_id)
+            if deleted_version is None:
+                return self.reply(404, {"error": "not found"})
+            return self.reply(200, None, deleted_version)
+        return self.reply(405)
+
+    def authorize(self, body: bytes):
+        try:
+            credentials = json.loads(body)
+        except ValueError:
+            credentials = dict(urllib.parse.parse_qsl(body.decode("utf-8")))
+        if not isinstance(credentials, dict):
+            return self.reply(400, {"error": "invalid body"})
+        username = credentials.get("username", "")
+        token = self.server.store.authorize(username, credentials.get("password", ""))
+        if token is None:
+            return self.reply(401, {"error": "invalid password"})
+        return self.reply(200, {"access_token": token, "userid": uuid.uuid5(uuid.NAMESPACE_DNS, username).hex})
+
+    def do_GET(self):
+        self.handle_request("GET")
+
+    def do_POST(self):
+        self.handle_request("POST")
+
+    def do_DELETE(self):
+        self.handle_request("DELETE")
+
+
+class SimperiumServer(ThreadingHTTPServer):
+    """Serve a `SimperiumStore` over HTTP, on a background thread after `start`"""
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        store: Optional[SimperiumStore] = None,
+        faults: Optional[Faults] = None,
+        poll_timeout: float = 25,
+    ):
+        super().__init__((host, port), _Handler)
+        self.store = store or SimperiumStore()
+        self.faults = faults or Faults()
+        # Seconds an `all?cv=` request waits for a change before answering an empty list
+        self.poll_timeout = poll_timeout
+        self._lock = threading.Lock()
+        # status -> number of responses, and accepted connections
+        self.stats: Dict[Any, int] = {"connections": 0}
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        """The base URL to give `URL.set_base`"""
+        host, port = self.server_address[:2]
+        return "http://%s:%s/1" % (host, port)
+
+    def count(self, key: Any):
+        with self._lock:
+            self.stats[key] = self.stats.get(key, 0) + 1
+
+    def process_request(self, request, client_address):
+        self.count("connections")
+        super().process_request(request, client_address)
+
+    def start(self) -> "SimperiumServer":
+        self._thread = threading.Thread(target=self.serve_forever, name="SimperiumServer", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.store.close()
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self) -> "SimperiumServer":
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def serve(argv: Optional[List[str]] = None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Local Simperium stand-in server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="up to this many more seconds, at random")
+    parser.add_argument("--bandwidth", type=int, default=0, help="response bytes per second, 0 for unlimited")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with an error")
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--notes", type=int, default=0, help="fill the bucket with this many notes")
+    args = parser.parse_args(argv)
+
+    faults = Faults(args.latency, args.jitter, args.bandwidth, args.error_rate, args.error_status)
+    server = SimperiumServer(args.host, args.port, faults=faults)
+    for index in range(args.notes):
+        server.store.put(
+            str(uuid.UUID(int=index)),
+            {"content": "Note %s\n\nbody" % index, "tags": [], "systemTags": [], "deleted": False},
+        )
+    print("Serving Simperium on %s" % server.url)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    serve()
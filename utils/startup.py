@@ -0,0 +1,126 @@
+"""
+Startup cost accounting.
+
+`ImportTimer` is a meta path finder that wraps the loader of every module it sees
+and records how long executing the module took, like `python -X importtime` does
+but available inside Sublime Text. `measure` records arbitrary startup steps.
+"""
+
+from contextlib import contextmanager
+import importlib.abc
+import sys
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+
+__all__ = [
+    "ImportTimer",
+    "install",
+    "measure",
+    "report",
+]
+
+
+class _TimedLoader(importlib.abc.Loader):
+    """Delegate to the real loader, timing `exec_module`"""
+
+    def __init__(self, loader, timer: "ImportTimer", name: str):
+        self._loader = loader
+        self._timer = timer
+        self._name = name
+
+    def __getattr__(self, name: str):
+        return getattr(self._loader, name)
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        stack = self._timer.stack()
+        stack.append(0.0)
+        start_time = time.perf_counter()
+        try:
+            self._loader.exec_module(module)
+        finally:
+            cumulative = time.perf_counter() - start_time
+            children = stack.pop()
+            if stack:
+                stack[-1] += cumulative
+            self._timer.costs[self._name] = (cumulative - children, cumulative)
+
+
+def _packages(prefixes: Optional[Sequence[str]]) -> Optional[Tuple[str, ...]]:
+    if prefixes is None:
+        return None
+    # Top level names, "" would match every module
+    return tuple({prefix.partition(".")[0] for prefix in prefixes if prefix})
+
+
+class ImportTimer(importlib.abc.MetaPathFinder):
+
+    def __init__(self, prefixes: Optional[Sequence[str]] = None):
+        # Only the modules of the packages named in `prefixes` are timed, all of them if `None`
+        self.prefixes = _packages(prefixes)
+        # module name -> (self seconds, cumulative seconds)
+        self.costs: Dict[str, Tuple[float, float]] = {}
+        self._local = threading.local()
+
+    def stack(self) -> List[float]:
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    def find_spec(self, fullname, path, target=None):
+        if self.prefixes is not None and fullname.partition(".")[0] not in self.prefixes:
+            # Loaders of other packages of the plugin host are left alone
+            return None
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is None:
+                continue
+            if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+                spec.loader = _TimedLoader(spec.loader, self, fullname)
+            return spec
+        return None
+
+
+TIMER = ImportTimer()
+# Startup steps other than imports, step name -> seconds
+STEPS: Dict[str, float] = {}
+
+
+def install(prefixes: Optional[Sequence[str]] = None) -> ImportTimer:
+    """Time the imports of the `prefixes` packages from now on, of every module if `None`, returns the timer"""
+    TIMER.prefixes = _packages(prefixes)
+    if TIMER not in sys.meta_path:
+        sys.meta_path.insert(0, TIMER)
+    return TIMER
+
+
+def uninstall():
+    if TIMER in sys.meta_path:
+        sys.meta_path.remove(TIMER)
+
+
+@contextmanager
+def measure(name: str) -> Iterator[None]:
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        STEPS[name] = time.perf_counter() - start_time
+
+
+def report() -> str:
+    """Format the recorded costs, most expensive first, in milliseconds"""
+    lines = ["%10s %10s  %s" % ("self(ms)", "cumul(ms)", "module")]
+    for name, (self_cost, cumulative) in sorted(TIMER.costs.items(), key=lambda item: item[1][0], reverse=True):
+        lines.append("%10.2f %10.2f  %s" % (self_cost * 1000, cumulative * 1000, name))
+    lines.append("")
+    lines.append("%10s %10s  %s" % ("", "total(ms)", "step"))
+    for name, cost in STEPS.items():
+        lines.append("%10s %10.2f  %s" % ("", cost * 1000, name))
+    return "\n".join(lines)
@@ -1,5 +1,7 @@
 import logging
-from typing import Optional
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
 
 import sublime
 
@@ -8,18 +10,88 @@ logger = logging.getLogger()
 
 
 __all__ = [
+    "StatusReporter",
+    "REPORTER",
     "show_message",
     "remove_status",
     "close_view",
+    "show_panel",
 ]
 
 
-def show_message(message: str):
-    if not message:
-        message = ""
-    for window in sublime.windows():
-        for currentView in window.views():
-            currentView.set_status("Simplenote", message)
+class StatusReporter:
+    """Status bar message of the plugin, shown in the active view of each window.
+
+    Messages are coalesced: at most one update per `interval` seconds reaches the views,
+    showing the latest message. A view that becomes active gets the message from `apply`.
+    """
+
+    KEY = "Simplenote"
+
+    def __init__(self, interval: float = 0.25, clock: Callable[[], float] = time.monotonic):
+        self.interval = interval
+        self.clock = clock
+        self.message = ""
+        self._lock = threading.Lock()
+        self._last_flush = float("-inf")
+        self._pending = False
+        # view id -> (view, message shown in it)
+        self._views: Dict[int, Tuple[sublime.View, str]] = {}
+        self.stats = {"messages": 0, "flushes": 0, "set_status": 0}
+
+    def show(self, message: Optional[str]):
+        with self._lock:
+            self.message = message or ""
+            self.stats["messages"] += 1
+            if self._pending:
+                return
+            wait = self._last_flush + self.interval - self.clock()
+            if wait > 0:
+                self._pending = True
+        if wait > 0:
+            sublime.set_timeout(self._flush_pending, int(wait * 1000) + 1)
+        else:
+            self.flush()
+
+    def _flush_pending(self):
+        with self._lock:
+            self._pending = False
+        self.flush()
+
+    def flush(self):
+        with self._lock:
+            self._last_flush = self.clock()
+            self.stats["flushes"] += 1
+            message = self.message
+        if not message:
+            views, self._views = self._views, {}
+            for view, _ in views.values():
+                view.erase_status(self.KEY)
+            return
+        for window in sublime.windows():
+            view = window.active_view()
+            if view is not None:
+                self._set(view, message)
+
+    def apply(self, view: sublime.View):
+        """Show the current message in `view`, which just became active"""
+        if self.message:
+            self._set(view, self.message)
+
+    def _set(self, view: sublime.View, message: str):
+        shown = self._views.get(view.id())
+        if shown is not None and shown[1] == message:
+            return
+        view.set_status(self.KEY, message)
+        self._views[view.id()] = (view, message)
+        self.stats["set_status"] += 1
+
+
+REPORTER = StatusReporter()
+
+
+def show_message(message: Optional[str]):
+    REPORTER.show(message)
 
 
 def remove_status():
@@ -45,3 +117,11 @@ def close_view(view: sublime.View):
     window = get_view_window(view)
     window.focus_view(view)
     window.run_command("close_file")
+
+
+def show_panel(name: str, text: str, window: Optional[sublime.Window] = None):
+    """Show `text` in the output panel `name` of the window"""
+    window = window or sublime.active_window()
+    panel = window.create_output_panel(name)
+    panel.run_command("append", {"characters": text})
+    window.run_command("show_panel", {"panel": "output.%s" % name})
@@ -0,0 +1,152 @@
+"""
+Span tracing exported as Chrome trace-event JSON.
+
+`span(name)` records a complete ("X") event with the thread that ran it. Tracing is off
+until `start()`, and a disabled span is a shared no-op. `save(filepath)` writes the
+recorded events for chrome://tracing, Perfetto or speedscope to display as a flame chart.
+"""
+
+import functools
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, TypeVar
+
+from utils.fs import atomic_write
+
+
+__all__ = [
+    "Tracer",
+    "TRACER",
+    "span",
+    "traced",
+    "start",
+    "stop",
+    "save",
+]
+
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+# Stop recording past this many events, a trace is meant to cover a single sync cycle
+MAX_EVENTS = 200000
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ("tracer", "name", "cat", "args", "start_time")
+
+    def __init__(self, tracer: "Tracer", name: str, cat: str, args: Dict[str, Any]):
+        self.tracer = tracer
+        self.name = name
+        self.cat = cat
+        self.args = args
+        self.start_time = 0.0
+
+    def __enter__(self):
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.args["error"] = repr(exc_value)
+        self.tracer.add(self.name, self.cat, self.start_time, time.perf_counter(), self.args)
+        return False
+
+
+class Tracer:
+
+    def __init__(self):
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._events: List[Dict[str, Any]] = []
+        # thread id -> thread name
+        self._threads: Dict[int, str] = {}
+        self._origin = time.perf_counter()
+
+    def start(self):
+        """Forget the previous events and record from now on"""
+        with self._lock:
+            self._events = []
+            self._threads = {}
+            self._origin = time.perf_counter()
+            self.enabled = True
+
+    def stop(self) -> List[Dict[str, Any]]:
+        """Stop recording, returns the recorded events with the thread names"""
+        with self._lock:
+            self.enabled = False
+            pid = os.getpid()
+            events = [
+                {"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+                for tid, name in self._threads.items()
+            ]
+            events.extend(self._events)
+        return events
+
+    def span(self, name: str, cat: str = "sync", **args: Any):
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, cat, args)
+
+    def traced(self, name: Optional[str] = None, cat: str = "sync") -> Callable[[F], F]:
+        """Decorator recording every call as a span, named after the function by default"""
+
+        def decorator(fn: F) -> F:
+            span_name = name or fn.__qualname__
+
+            @functools.wraps(fn)
+            def wrap(*args, **kwargs):
+                with self.span(span_name, cat):
+                    return fn(*args, **kwargs)
+
+            return wrap  # type: ignore
+
+        return decorator
+
+    def add(self, name: str, cat: str, start_time: float, end_time: float, args: Dict[str, Any]):
+        thread = threading.current_thread()
+        with self._lock:
+            if not self.enabled or len(self._events) >= MAX_EVENTS:
+                return
+            self._threads.setdefault(thread.ident or 0, thread.name)
+            self._events.append(
+                {
+                    "name": name,
+                    "cat": cat,
+                    "ph": "X",
+                    "ts": (start_time - self._origin) * 1e6,
+                    "dur": (end_time - start_time) * 1e6,
+                    "pid": os.getpid(),
+                    "tid": thread.ident or 0,
+                    "args": args,
+                }
+            )
+
+    def save(self, filepath: str):
+        """Stop recording and write the trace to `filepath`"""
+        events = self.stop()
+        data = json.dumps({"traceEvents": events, "displayTimeUnit": "ms"}, default=repr)
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        atomic_write(filepath, data.encode("utf-8"))
+
+
+TRACER = Tracer()
+span = TRACER.span
+traced = TRACER.traced
+start = TRACER.start
+stop = TRACER.stop
+save = TRACER.save